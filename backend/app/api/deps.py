@@ -1,6 +1,6 @@
-from typing import Generator
+from typing import Generator, Optional
 
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Query, WebSocket, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import jwt, JWTError
 from pydantic import ValidationError
@@ -40,3 +40,26 @@ async def get_current_user(
     if not user.status:
         raise HTTPException(status_code=400, detail="Inactive user")
     return user
+
+async def get_current_user_ws(
+    websocket: WebSocket, token: Optional[str] = Query(None)
+) -> Optional[User]:
+    """
+    WebSocket auth: browsers can't set headers on a WS handshake, so the JWT comes as ?token=...
+    Returns None instead of raising, the endpoint closes the socket itself.
+    Uses its own session so the connection goes back to the pool right after the handshake.
+    """
+    if not token:
+        return None
+    try:
+        payload = jwt.decode(
+            token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM]
+        )
+        token_data = TokenPayload(**payload)
+    except (JWTError, ValidationError):
+        return None
+    async with AsyncSessionLocal() as db:
+        user = await crud_user.get_by_email(db, email=token_data.sub)
+    if not user or not user.status:
+        return None
+    return user
@@ -1,24 +1,62 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from typing import List, Any
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects.postgresql import insert
+from typing import List, Any, Optional
 from datetime import datetime
+import asyncio
 import json
+import numpy as np
 
 from app.api.deps import get_db, get_current_user
-from app.models.assessment import Assessment, AssessmentSubmission
+from app.db.session import AsyncSessionLocal
+from app.models.assessment import Assessment, AssessmentSubmission, QueuedSubmission, SubmissionStatus
 from app.schemas.assessment import (
-    AssessmentCreate, AssessmentResponse, AssessmentWithQuestions,
-    SubmissionCreate, SubmissionResponse, StudentSubmissionResponse,
-    SubmissionWithStudent, AssessmentWithSubmissions
+    AssessmentCreate, AssessmentUpdate, AssessmentResponse, AssessmentWithQuestions,
+    SubmissionCreate, SubmissionReceipt, StudentSubmissionResponse,
+    SubmissionWithStudent, AssessmentWithSubmissions, RegradeResponse, AssessmentAnalytics
 )
 from app.services.bunny_service import bunny_service
+from app.services.template_cache_service import template_cache_service
+from app.services.answer_matrix import AnswerMatrix, parse_response_data
+from app.services.item_analytics_service import item_analytics_service
+from app.services.submission_queue_service import submission_queue_service
+from app.services.gradebook_service import gradebook_header, gradebook_rows, stream_csv, stream_xlsx
+from app.crud.crud_question import question as crud_question
+from app.crud.crud_submission import submission as crud_submission
+from app.crud.crud_assignment import assignment as crud_assignment
 from app.models.course import Course
 from app.models.batch import Batch
-from app.models.user import User
+from app.models.user import User, UserRole
 
 router = APIRouter()
 
+def _template_filename(batch_id: int, course_title: str) -> str:
+    # Generate Filename: batch_id_coursename_timestamp.json
+    safe_course_title = "".join(c for c in course_title if c.isalnum() or c in (' ', '_', '-')).rstrip()
+    safe_course_title = safe_course_title.replace(" ", "_")
+    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+    return f"{batch_id}_{safe_course_title}_{timestamp}.json"
+
+async def _upload_template(questions: dict, filename: str) -> str:
+    template_url = await bunny_service.upload_json(questions, filename)
+    if template_url.startswith(bunny_service.cdn_url):
+        # Students start right after creation: serve the template from memory
+        template_cache_service.put(template_url, questions)
+    return template_url
+
+async def _answer_key(db: AsyncSession, assessment: Assessment) -> dict:
+    try:
+        answer_key = await crud_question.get_answer_key(db, assessment=assessment)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to fetch questions: {str(e)}")
+    if answer_key is None:
+        raise HTTPException(status_code=400, detail="Assessment has no questions")
+    return answer_key
+
 @router.post("/", response_model=AssessmentResponse)
 async def create_assessment(
     assessment_in: AssessmentCreate,
@@ -35,14 +73,10 @@ async def create_assessment(
     if not batch:
         raise HTTPException(status_code=404, detail="Batch not found")
 
-    # Generate Filename: batch_id_coursename_timestamp.json
-    safe_course_title = "".join(c for c in course.title if c.isalnum() or c in (' ', '_', '-')).rstrip()
-    safe_course_title = safe_course_title.replace(" ", "_")
-    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-    filename = f"{assessment_in.batch_id}_{safe_course_title}_{timestamp}.json"
+    filename = _template_filename(assessment_in.batch_id, course.title)
 
     # Upload Questions to Bunny.net
-    template_url = await bunny_service.upload_json(assessment_in.questions, filename)
+    template_url = await _upload_template(assessment_in.questions, filename)
 
     # Create Assessment Record in DB with quiz settings
     assessment = Assessment(
@@ -61,8 +95,13 @@ async def create_assessment(
     )
     
     db.add(assessment)
+    await db.flush()
+    await crud_assignment.set_for_assessment(db, assessment=assessment)
     await db.commit()
     await db.refresh(assessment)
+
+    # Question bank index
+    await crud_question.index_assessment(db, assessment_id=assessment.id, questions_data=assessment_in.questions)
     
     # Populate names for response
     assessment.course_name = course.title
@@ -94,6 +133,55 @@ async def read_assessments(
         
     return response
 
+@router.get("/gradebook/export")
+async def export_gradebook(
+    batch_id: Optional[int] = Query(None, description="Export one batch"),
+    course_id: Optional[int] = Query(None, description="Export every batch of a course"),
+    format: str = Query("csv", pattern="^(csv|xlsx)$"),
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Students × assessments marks of a batch or course, streamed as CSV or XLSX"""
+    if current_user.role not in [UserRole.admin, UserRole.coordinator, UserRole.teacher]:
+        raise HTTPException(status_code=403, detail="Not authorized to export grades")
+    if (batch_id is None) == (course_id is None):
+        raise HTTPException(status_code=400, detail="Pass either batch_id or course_id")
+
+    if batch_id is not None:
+        batch = (await db.execute(select(Batch).filter(Batch.id == batch_id))).scalars().first()
+        if not batch:
+            raise HTTPException(status_code=404, detail="Batch not found")
+        batch_ids = [batch_id]
+        assessment_filter = Assessment.batch_id == batch_id
+        name = batch.batch_name
+    else:
+        course = (await db.execute(select(Course).filter(Course.id == course_id))).scalars().first()
+        if not course:
+            raise HTTPException(status_code=404, detail="Course not found")
+        batch_ids = (await db.execute(select(Batch.id).filter(Batch.course_id == course_id))).scalars().all()
+        assessment_filter = Assessment.course_id == course_id
+        name = course.title
+
+    result = await db.execute(
+        select(Assessment).filter(assessment_filter).order_by(Assessment.due_date.nulls_last(), Assessment.id)
+    )
+    assessments = result.scalars().all()
+
+    rows = gradebook_rows(batch_ids, assessments)
+    header = gradebook_header(assessments)
+    safe_name = "".join(c if c.isalnum() or c in ("-", "_") else "_" for c in name)
+    if format == "xlsx":
+        body = stream_xlsx(header, rows)
+        media_type = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    else:
+        body = stream_csv(header, rows)
+        media_type = "text/csv"
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="gradebook_{safe_name}.{format}"'}
+    )
+
 @router.get("/{assessment_id}", response_model=AssessmentResponse)
 async def read_assessment(
     assessment_id: int,
@@ -116,6 +204,51 @@ async def read_assessment(
     
     return assessment
 
+@router.put("/{assessment_id}", response_model=AssessmentResponse)
+async def update_assessment(
+    assessment_id: int,
+    assessment_in: AssessmentUpdate,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Update an assessment. New questions are uploaded as a new template file (templates are never overwritten)."""
+    if current_user.role not in [UserRole.admin, UserRole.coordinator, UserRole.teacher]:
+        raise HTTPException(status_code=403, detail="Not authorized to update assessments")
+
+    stmt = select(Assessment, Course.title, Batch.batch_name)\
+        .join(Course, Assessment.course_id == Course.id)\
+        .join(Batch, Assessment.batch_id == Batch.id)\
+        .filter(Assessment.id == assessment_id)
+
+    result = await db.execute(stmt)
+    row = result.first()
+
+    if not row:
+        raise HTTPException(status_code=404, detail="Assessment not found")
+
+    assessment, course_title, batch_name = row
+    update_data = assessment_in.model_dump(exclude_unset=True)
+    questions = update_data.pop("questions", None)
+    for field, value in update_data.items():
+        setattr(assessment, field, value)
+
+    if questions is not None:
+        assessment.template_url = await _upload_template(
+            questions, _template_filename(assessment.batch_id, course_title)
+        )
+
+    db.add(assessment)
+    await db.commit()
+    await db.refresh(assessment)
+
+    if questions is not None:
+        await crud_question.index_assessment(db, assessment_id=assessment.id, questions_data=questions)
+
+    assessment.course_name = course_title
+    assessment.batch_name = batch_name
+
+    return assessment
+
 @router.get("/{assessment_id}/full", response_model=AssessmentWithQuestions)
 async def get_assessment_with_questions(
     assessment_id: int,
@@ -137,10 +270,10 @@ async def get_assessment_with_questions(
     assessment.course_name = course_title
     assessment.batch_name = batch_name
     
-    # Fetch questions from Bunny.net
+    # Fetch questions from Bunny.net (cached)
     if assessment.template_url:
         try:
-            questions_data = await bunny_service.download_json(assessment.template_url)
+            questions_data = await template_cache_service.get(assessment.template_url)
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Failed to fetch questions: {str(e)}")
     else:
@@ -175,13 +308,12 @@ async def get_student_assessments(
     current_user: User = Depends(get_current_user)
 ):
     """Get assessments assigned to the current student with submission status"""
-    # Get student's batch
-    # Note: Assuming user has a batch_id field or relationship
-    # Adjust based on your actual User model
-    
+    # Only the student's own assignments (see assessment_assignments), through their batch memberships
     stmt = select(Assessment, Course.title, Batch.batch_name)\
         .join(Course, Assessment.course_id == Course.id)\
-        .join(Batch, Assessment.batch_id == Batch.id)
+        .join(Batch, Assessment.batch_id == Batch.id)\
+        .filter(Assessment.id.in_(crud_assignment.assessment_ids_for_student(current_user.id)))\
+        .order_by(Assessment.id)
         
     result = await db.execute(stmt)
     rows = result.all()
@@ -196,130 +328,212 @@ async def get_student_assessments(
     # Create submission map: assessment_id -> submission
     submission_map = {sub.assessment_id: sub for sub in submissions}
     
-    # Filter assessments assigned to this student
     response = []
     for assessment, course_title, batch_name in rows:
-        # Check if assigned to entire batch or specific student
-        if assessment.assigned_to == "entire_batch":
-            # Include if student is in this batch
-            # You may need to add batch filtering based on user's batch
-            submission = submission_map.get(assessment.id)
-            
-            assessment_data = {
-                "id": assessment.id,
-                "course_id": assessment.course_id,
-                "batch_id": assessment.batch_id,
-                "title": assessment.title,
-                "type": assessment.type,
-                "total_marks": assessment.total_marks,
-                "due_date": assessment.due_date,
-                "template_url": assessment.template_url,
-                "created_at": assessment.created_at,
-                "time_limit_minutes": assessment.time_limit_minutes,
-                "passing_score": assessment.passing_score,
-                "shuffle_questions": bool(assessment.shuffle_questions),
-                "show_results_immediately": bool(assessment.show_results_immediately),
-                "assigned_to": assessment.assigned_to,
-                "course_name": course_title,
-                "batch_name": batch_name,
-                "has_submitted": submission is not None,
-                "submission_id": submission.id if submission else None,
-                "marks_obtained": submission.marks_obtained if submission else None
-            }
-            response.append(assessment_data)
-        else:
-            # Check if student ID is in assigned_to JSON
-            try:
-                assigned_ids = json.loads(assessment.assigned_to)
-                if str(current_user.id) in assigned_ids:
-                    submission = submission_map.get(assessment.id)
-                    
-                    assessment_data = {
-                        "id": assessment.id,
-                        "course_id": assessment.course_id,
-                        "batch_id": assessment.batch_id,
-                        "title": assessment.title,
-                        "type": assessment.type,
-                        "total_marks": assessment.total_marks,
-                        "due_date": assessment.due_date,
-                        "template_url": assessment.template_url,
-                        "created_at": assessment.created_at,
-                        "time_limit_minutes": assessment.time_limit_minutes,
-                        "passing_score": assessment.passing_score,
-                        "shuffle_questions": bool(assessment.shuffle_questions),
-                        "show_results_immediately": bool(assessment.show_results_immediately),
-                        "assigned_to": assessment.assigned_to,
-                        "course_name": course_title,
-                        "batch_name": batch_name,
-                        "has_submitted": submission is not None,
-                        "submission_id": submission.id if submission else None,
-                        "marks_obtained": submission.marks_obtained if submission else None
-                    }
-                    response.append(assessment_data)
-            except:
-                pass
+        submission = submission_map.get(assessment.id)
+        response.append({
+            "id": assessment.id,
+            "course_id": assessment.course_id,
+            "batch_id": assessment.batch_id,
+            "title": assessment.title,
+            "type": assessment.type,
+            "total_marks": assessment.total_marks,
+            "due_date": assessment.due_date,
+            "template_url": assessment.template_url,
+            "created_at": assessment.created_at,
+            "time_limit_minutes": assessment.time_limit_minutes,
+            "passing_score": assessment.passing_score,
+            "shuffle_questions": bool(assessment.shuffle_questions),
+            "show_results_immediately": bool(assessment.show_results_immediately),
+            "assigned_to": assessment.assigned_to,
+            "course_name": course_title,
+            "batch_name": batch_name,
+            "has_submitted": submission is not None,
+            "submission_id": submission.id if submission else None,
+            "marks_obtained": submission.marks_obtained if submission else None
+        })
                 
     return response
 
-@router.post("/{assessment_id}/submit", response_model=SubmissionResponse)
+def _receipt(job: QueuedSubmission, assessment: Assessment) -> SubmissionReceipt:
+    return SubmissionReceipt(
+        receipt_id=job.id,
+        status=job.status,
+        id=job.submission_id,
+        assessment_id=job.assessment_id,
+        student_id=str(job.student_id),
+        marks_obtained=job.marks_obtained,
+        submitted_at=job.created_at,
+        show_results=bool(assessment.show_results_immediately),
+        error=job.error
+    )
+
+async def _await_grading(job: QueuedSubmission, wait: float) -> QueuedSubmission:
+    """
+    Wait up to `wait` seconds for the job to be graded. Holds no connection while waiting: woken up
+    when this process grades it, re-read with a short-lived session (other processes grade too).
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + wait
+    while job.status in (SubmissionStatus.queued, SubmissionStatus.processing):
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            break
+        await submission_queue_service.wait(job.id, min(remaining, 1.0))
+        async with AsyncSessionLocal() as db:
+            job = await db.get(QueuedSubmission, job.id) or job
+    return job
+
+@router.post("/{assessment_id}/submit", response_model=SubmissionReceipt)
 async def submit_assessment(
     assessment_id: int,
     submission_in: SubmissionCreate,
+    wait: float = Query(2.0, ge=0, le=10, description="Seconds to wait for the score before returning the receipt"),
+    idempotency_key: Optional[str] = Header(None, max_length=255),
     db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    """Submit assessment answers and calculate score"""
+    """
+    Submit assessment answers. The submission is stored right away and graded by the submission
+    queue workers: the receipt carries the score if grading finished within `wait` seconds,
+    otherwise poll GET /assessments/submissions/receipts/{receipt_id}.
+    One submission per student; retrying with the same Idempotency-Key returns the same receipt.
+    A submission that failed grading for good can be submitted again.
+    """
     # Fetch assessment
     result = await db.execute(select(Assessment).filter(Assessment.id == assessment_id))
     assessment = result.scalars().first()
     
     if not assessment:
         raise HTTPException(status_code=404, detail="Assessment not found")
-    
-    # Fetch questions from Bunny.net
-    if not assessment.template_url:
-        raise HTTPException(status_code=400, detail="Assessment has no questions")
-    
-    try:
-        questions_data = await bunny_service.download_json(assessment.template_url)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to fetch questions: {str(e)}")
-    
-    # Calculate score
-    total_points = 0
-    earned_points = 0
-    
-    questions = questions_data.get("questions", [])
-    for question in questions:
-        q_id = str(question.get("id"))
-        correct_answer = question.get("correctOption") or question.get("correctAnswer")
-        points = question.get("points", 0)
-        total_points += points
-        
-        user_answer = submission_in.answers.get(q_id)
-        if user_answer is not None and user_answer == correct_answer:
-            earned_points += points
-    
-    # Save submission
-    submission = AssessmentSubmission(
+
+    # Without a key, a student's retries of the same assessment are the same submission
+    key = idempotency_key or f"assessment:{assessment_id}"
+    stmt = insert(QueuedSubmission).values(
         assessment_id=assessment_id,
         student_id=current_user.id,
-        marks_obtained=earned_points,
-        response_data=json.dumps(submission_in.answers)
+        idempotency_key=key,
+        answers=json.dumps(submission_in.answers)
     )
-    
-    db.add(submission)
+    try:
+        result = await db.execute(
+            stmt.on_conflict_do_update(
+                index_elements=[QueuedSubmission.assessment_id, QueuedSubmission.student_id],
+                # A submission that could never be graded doesn't count: it's replaced by the new one
+                set_={
+                    "idempotency_key": stmt.excluded.idempotency_key,
+                    "answers": stmt.excluded.answers,
+                    "status": SubmissionStatus.queued,
+                    "attempts": 0,
+                    "error": None,
+                    "submission_id": None,
+                    "marks_obtained": None,
+                    "created_at": func.now(),
+                    "claimed_at": None,
+                    "graded_at": None,
+                },
+                where=QueuedSubmission.status == SubmissionStatus.failed,
+            )
+            .returning(QueuedSubmission)
+        )
+    except IntegrityError:
+        # Same Idempotency-Key already used for another assessment
+        await db.rollback()
+        raise HTTPException(status_code=409, detail="Idempotency-Key already used for another submission")
+    job = result.scalars().first()
     await db.commit()
-    await db.refresh(submission)
-    
-    # Return response
-    return SubmissionResponse(
-        id=submission.id,
-        assessment_id=submission.assessment_id,
-        student_id=str(submission.student_id),
-        marks_obtained=submission.marks_obtained,
-        submitted_at=submission.submitted_at,
-        show_results=bool(assessment.show_results_immediately)
+
+    if job is None:
+        result = await db.execute(select(QueuedSubmission).filter(
+            QueuedSubmission.assessment_id == assessment_id,
+            QueuedSubmission.student_id == current_user.id
+        ))
+        job = result.scalars().first()
+        if job is None or job.idempotency_key != key:
+            raise HTTPException(status_code=409, detail="Assessment already submitted")
+    else:
+        submission_queue_service.notify()
+
+    # Give the connection back to the pool before waiting, the graders need it during bursts
+    await db.close()
+    return _receipt(await _await_grading(job, wait), assessment)
+
+@router.get("/submissions/receipts/{receipt_id}", response_model=SubmissionReceipt)
+async def get_submission_receipt(
+    receipt_id: int,
+    wait: float = Query(0, ge=0, le=25, description="Long poll: seconds to wait for the score"),
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Status and score of a queued submission (the student's own only)"""
+    result = await db.execute(
+        select(QueuedSubmission, Assessment)
+        .join(Assessment, QueuedSubmission.assessment_id == Assessment.id)
+        .filter(QueuedSubmission.id == receipt_id, QueuedSubmission.student_id == current_user.id)
+    )
+    row = result.first()
+
+    if not row:
+        raise HTTPException(status_code=404, detail="Receipt not found")
+
+    job, assessment = row
+    await db.close()
+    return _receipt(await _await_grading(job, wait), assessment)
+
+@router.post("/{assessment_id}/regrade", response_model=RegradeResponse)
+async def regrade_assessment(
+    assessment_id: int,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Re-score every submission against the current answer key (e.g. after a wrong answer was fixed)"""
+    if current_user.role not in [UserRole.admin, UserRole.coordinator, UserRole.teacher]:
+        raise HTTPException(status_code=403, detail="Not authorized to regrade assessments")
+
+    result = await db.execute(select(Assessment).filter(Assessment.id == assessment_id))
+    assessment = result.scalars().first()
+
+    if not assessment:
+        raise HTTPException(status_code=404, detail="Assessment not found")
+
+    answer_key = await _answer_key(db, assessment)
+
+    # Score a chunk at a time with the answer matrix, only rows whose marks change are written
+    regraded = changed = 0
+    async for rows in crud_submission.iter_responses(db, assessment_id=assessment_id):
+        matrix = AnswerMatrix(answer_key, [parse_response_data(row.response_data) for row in rows])
+        new_marks = np.rint(matrix.scores()).astype(np.int64)
+        updates = [
+            (row.id, int(new)) for row, new in zip(rows, new_marks)
+            if row.marks_obtained != new
+        ]
+        changed += await crud_submission.set_marks(db, marks=updates)
+        regraded += len(rows)
+    await db.commit()
+
+    return RegradeResponse(assessment_id=assessment_id, regraded=regraded, changed=changed)
+
+@router.get("/{assessment_id}/analytics", response_model=AssessmentAnalytics)
+async def get_assessment_analytics(
+    assessment_id: int,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Per-question difficulty, discrimination and answer frequencies plus the score distribution (for teachers)"""
+    if current_user.role not in [UserRole.admin, UserRole.coordinator, UserRole.teacher]:
+        raise HTTPException(status_code=403, detail="Not authorized to view assessment analytics")
+
+    result = await db.execute(select(Assessment).filter(Assessment.id == assessment_id))
+    assessment = result.scalars().first()
+
+    if not assessment:
+        raise HTTPException(status_code=404, detail="Assessment not found")
+
+    return await item_analytics_service.get(
+        db,
+        assessment_id=assessment_id,
+        answer_key=await _answer_key(db, assessment),
+        key_version=assessment.questions_indexed_at
     )
 
 @router.get("/{assessment_id}/my-submission", response_model=StudentSubmissionResponse)
@@ -381,7 +595,7 @@ async def get_my_submission(
     # If show_results is enabled, fetch questions data
     if assessment.show_results_immediately and assessment.template_url:
         try:
-            questions_data = await bunny_service.download_json(assessment.template_url)
+            questions_data = await template_cache_service.get(assessment.template_url)
             response["questions"] = questions_data
         except Exception as e:
             print(f"Failed to fetch questions: {str(e)}")
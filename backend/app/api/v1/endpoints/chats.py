@@ -1,21 +1,29 @@
-from typing import Any, List, Optional
-from fastapi import APIRouter, Depends, HTTPException, Query, WebSocket, WebSocketDisconnect, File, UploadFile
+from typing import Any, List, Optional, Tuple
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, WebSocket, WebSocketDisconnect, File, UploadFile
+from starlette.status import WS_1008_POLICY_VIOLATION
 from sqlalchemy.ext.asyncio import AsyncSession
 from app import crud, models
 from app.api import deps
+from app.db.session import AsyncSessionLocal
 from app.models.user import User
 from app.models.chat import ChatTypeEnum
 from app.schemas import chat as schemas
 from app.crud.crud_chat import chat as crud_chat, message as crud_message, message_read as crud_message_read
 from app.utils.websockets import manager
+from app.utils.presence import presence_tracker
+from app.services.chat_ingest_service import chat_ingest_service, PendingMessage, message_event
 from app.services.storage_service import storage_service
+from app.services.chat_membership_service import chat_membership_service
+from app.services.read_receipt_service import read_receipt_service
+from app.services.download_proxy_service import download_proxy_service
 import json
 from datetime import datetime
+from uuid import UUID
 
 router = APIRouter()
 
-import aiohttp
-from fastapi.responses import StreamingResponse
+# Max messages replayed from the database on reconnect
+REPLAY_DB_LIMIT = 500
 
 
 
@@ -40,7 +48,8 @@ async def read_chats(
     current_user: User = Depends(deps.get_current_user),
 ) -> Any:
     """
-    Retrieve chats for current user.
+    Retrieve chats for current user (inbox), most recently active first,
+    with each chat's latest message and the user's unread count.
     """
     chats = await crud_chat.get_by_user(db=db, user_id=current_user.id, skip=skip, limit=limit)
     
@@ -63,6 +72,64 @@ async def read_chats(
             
     return chats
 
+def _parse_search_cursor(cursor: Optional[str]) -> Optional[Tuple[float, int]]:
+    if not cursor:
+        return None
+    try:
+        rank, message_id = cursor.split(":")
+        return float(rank), int(message_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def _search_page(rows, limit: int) -> dict:
+    results = []
+    for msg, rank in rows:
+        msg.rank = rank
+        results.append(msg)
+    next_cursor = None
+    if len(rows) == limit:
+        last_msg, last_rank = rows[-1]
+        next_cursor = f"{last_rank!r}:{last_msg.id}"
+    return {"results": results, "next_cursor": next_cursor}
+
+@router.get("/search", response_model=schemas.MessageSearchPage)
+async def search_my_messages(
+    *,
+    db: AsyncSession = Depends(deps.get_db),
+    q: str = Query(..., min_length=1),
+    limit: int = Query(20, le=100),
+    cursor: Optional[str] = None,
+    current_user: User = Depends(deps.get_current_user),
+) -> Any:
+    """
+    Search messages across all chats the current user is a member of, best matches first.
+    """
+    rows = await crud_message.search(
+        db, q=q, user_id=current_user.id, limit=limit, cursor=_parse_search_cursor(cursor)
+    )
+    return _search_page(rows, limit)
+
+@router.get("/proxy-download")
+async def proxy_download_file(url: str, request: Request):
+    """
+    Proxy a file download to bypass CORS/Browser opening file.
+    Forces download by setting Content-Disposition attachment.
+    Range / If-None-Match are honoured, repeat downloads may come from the local disk cache.
+    """
+    if not url:
+        raise HTTPException(status_code=400, detail="URL is required")
+
+    # Determine filename from URL
+    try:
+        filename = url.split("/")[-1]
+        # handling URL decoding if needed, but basic split works for most CDN paths
+        from urllib.parse import unquote
+        filename = unquote(filename)
+    except:
+        filename = "downloaded_file"
+
+    return await download_proxy_service.download(url, request.headers, filename)
+
 @router.get("/{chat_id}", response_model=schemas.Chat)
 async def read_chat(
     *,
@@ -97,9 +164,11 @@ async def create_message(
     if message_in.chat_id != chat_id:
         raise HTTPException(status_code=400, detail="Chat ID mismatch")
         
-    chat = await crud_chat.get(db=db, id=chat_id)
-    if not chat:
+    is_member = await chat_membership_service.is_member(db, chat_id, current_user.id)
+    if is_member is None:
         raise HTTPException(status_code=404, detail="Chat not found")
+    if not is_member:
+        raise HTTPException(status_code=403, detail="Not a member of this chat")
         
     message = await crud_message.create(db=db, obj_in=message_in, sender_id=current_user.id)
     return message
@@ -110,50 +179,321 @@ async def read_messages(
     db: AsyncSession = Depends(deps.get_db),
     chat_id: int,
     skip: int = 0,
-    limit: int = 50,
+    limit: int = Query(50, le=200),
+    before_id: Optional[int] = Query(None, description="Return messages older than this message id"),
+    after_id: Optional[int] = Query(None, description="Return messages newer than this message id"),
     current_user: User = Depends(deps.get_current_user),
 ) -> Any:
     """
-    Get messages for a chat.
+    Get messages for a chat, newest first.
+    Page back with before_id=<oldest id received>; catch up with after_id=<newest id received>.
     """
-    messages = await crud_message.get_by_chat(db=db, chat_id=chat_id, skip=skip, limit=limit)
+    messages = await crud_message.get_by_chat(
+        db=db, chat_id=chat_id, skip=skip, limit=limit, before_id=before_id, after_id=after_id
+    )
     return messages
 
-@router.post("/{chat_id}/messages/{message_id}/read", response_model=schemas.MessageRead)
-async def mark_message_read(
+@router.get("/{chat_id}/messages/search", response_model=schemas.MessageSearchPage)
+async def search_messages(
     *,
     db: AsyncSession = Depends(deps.get_db),
     chat_id: int,
-    message_id: int,
+    q: str = Query(..., min_length=1),
+    limit: int = Query(20, le=100),
+    cursor: Optional[str] = None,
     current_user: User = Depends(deps.get_current_user),
 ) -> Any:
     """
-    Mark a message as read.
+    Search a chat's messages, best matches first. Page with the returned next_cursor.
     """
-    chat = await crud_chat.get(db=db, id=chat_id)
-    if not chat:
+    is_member = await chat_membership_service.is_member(db, chat_id, current_user.id)
+    if is_member is None:
         raise HTTPException(status_code=404, detail="Chat not found")
-        
-    # Check if user is member? (Optional but good)
-    
-    # Verify message belongs to chat (Optional, but strict)
-    # logic handled in mark_read creation (it stores chat_id)
-    
-    # Perform mark read
-    message_read = await crud_message_read.mark_read(
-        db=db, message_id=message_id, user_id=current_user.id, chat_id=chat_id
+    if not is_member:
+        raise HTTPException(status_code=403, detail="Not a member of this chat")
+
+    rows = await crud_message.search(
+        db, q=q, user_id=current_user.id, chat_id=chat_id, limit=limit, cursor=_parse_search_cursor(cursor)
+    )
+    return _search_page(rows, limit)
+
+async def _mark_read(db: AsyncSession, chat_id: int, user_id: UUID, message_id: int) -> Optional[schemas.ChatReadState]:
+    """Advance the user's watermark and queue the (coalesced) receipt broadcast. None if not allowed."""
+    last_read_message_id = await crud_message_read.mark_read(
+        db=db, message_id=message_id, user_id=user_id, chat_id=chat_id
+    )
+    if last_read_message_id is None:
+        return None
+    await read_receipt_service.record(chat_id, user_id, last_read_message_id)
+    return schemas.ChatReadState(chat_id=chat_id, user_id=user_id, last_read_message_id=last_read_message_id)
+
+@router.get("/{chat_id}/presence", response_model=schemas.ChatPresence)
+async def read_chat_presence(
+    *,
+    db: AsyncSession = Depends(deps.get_db),
+    chat_id: int,
+    current_user: User = Depends(deps.get_current_user),
+) -> Any:
+    """
+    Members currently online / typing in the chat (served from memory, see PresenceTracker).
+    """
+    is_member = await chat_membership_service.is_member(db, chat_id, current_user.id)
+    if is_member is None:
+        raise HTTPException(status_code=404, detail="Chat not found")
+    if not is_member:
+        raise HTTPException(status_code=403, detail="Not a member of this chat")
+    return schemas.ChatPresence(
+        chat_id=chat_id,
+        online=presence_tracker.online(chat_id),
+        typing=presence_tracker.typing_users(chat_id),
     )
-    return message_read
+
+@router.post("/{chat_id}/read", response_model=schemas.ChatReadState)
+async def mark_chat_read(
+    *,
+    db: AsyncSession = Depends(deps.get_db),
+    chat_id: int,
+    read_in: schemas.ChatReadUpdate,
+    current_user: User = Depends(deps.get_current_user),
+) -> Any:
+    """
+    Mark every message up to (and including) up_to_message_id, or the highest of
+    message_ids, as read. One call for the whole screen instead of one per message.
+    """
+    candidates = read_in.message_ids + ([read_in.up_to_message_id] if read_in.up_to_message_id is not None else [])
+    if not candidates:
+        raise HTTPException(status_code=422, detail="up_to_message_id or message_ids is required")
+    read_state = await _mark_read(db, chat_id, current_user.id, max(candidates))
+    if read_state is None:
+        raise HTTPException(status_code=404, detail="Message not found in a chat you are a member of")
+    return read_state
+
+@router.post("/{chat_id}/messages/{message_id}/read", response_model=schemas.ChatReadState)
+async def mark_message_read(
+    *,
+    db: AsyncSession = Depends(deps.get_db),
+    chat_id: int,
+    message_id: int,
+    current_user: User = Depends(deps.get_current_user),
+) -> Any:
+    """
+    Mark a message as read (kept for older clients, same as POST /{chat_id}/read).
+    """
+    read_state = await _mark_read(db, chat_id, current_user.id, message_id)
+    if read_state is None:
+        raise HTTPException(status_code=404, detail="Message not found in a chat you are a member of")
+    return read_state
+
+def _reject_ws_message(websocket: WebSocket, chat_id: int, client_msg_id: Optional[str], detail: str):
+    if client_msg_id:
+        manager.send_personal({
+            "type": "ack",
+            "chat_id": chat_id,
+            "client_msg_id": client_msg_id,
+            "status": "rejected",
+            "detail": detail
+        }, websocket)
+    else:
+        manager.send_personal({"type": "error", "chat_id": chat_id, "detail": detail}, websocket)
+
+async def _ingest_ws_message(websocket: WebSocket, chat_id: int, sender_id: UUID, message_data: dict):
+    client_msg_id = message_data.get("client_msg_id")
+    content = message_data.get("message")
+    batch_id = message_data.get("batch_id")
+
+    # Validate before acknowledging: once "accepted", the client won't send it again
+    if not isinstance(content, str) or not content.strip():
+        _reject_ws_message(websocket, chat_id, client_msg_id, "Message must be a non-empty string")
+        return
+    if batch_id is not None and not isinstance(batch_id, int):
+        _reject_ws_message(websocket, chat_id, client_msg_id, "batch_id must be an integer")
+        return
+    # Served from the membership cache; a session only takes a connection on a cache miss
+    async with AsyncSessionLocal() as db:
+        is_member = await chat_membership_service.is_member(db, chat_id, sender_id)
+    if not is_member:
+        _reject_ws_message(websocket, chat_id, client_msg_id, "Not a member of this chat")
+        return
+
+    # Persisted in batches by the ingest service, which broadcasts it
+    # (with its DB id) to the chat once the batch is written
+    await chat_ingest_service.submit(PendingMessage(
+        chat_id=chat_id,
+        sender_id=sender_id,
+        message=content,
+        batch_id=batch_id,
+        client_msg_id=client_msg_id,
+        websocket=websocket
+    ))
+
+    # Acknowledge right away, the client can retry with the same client_msg_id
+    # (clients that don't tag their messages don't get acks). A message that then
+    # fails to persist gets a second ack with status "failed".
+    if client_msg_id:
+        manager.send_personal({
+            "type": "ack",
+            "chat_id": chat_id,
+            "client_msg_id": client_msg_id,
+            "status": "accepted"
+        }, websocket)
+
+async def _replay_missed(websocket: WebSocket, chat_id: int, last_seq: int):
+    """Send the client everything after last_seq in one "replay" event, from memory when possible."""
+    events = manager.replay_buffer.since(chat_id, last_seq)
+    complete = True
+    if events is None:
+        # Gap is older than the in-memory buffer
+        async with AsyncSessionLocal() as db:
+            missed = await crud_message.get_since_seq(db, chat_id=chat_id, last_seq=last_seq, limit=REPLAY_DB_LIMIT)
+        events = [message_event(m) for m in missed]
+        # Too far behind: client should reload the history over REST
+        complete = len(missed) < REPLAY_DB_LIMIT
+    manager.send_personal({
+        "type": "replay",
+        "chat_id": chat_id,
+        "messages": events,
+        "complete": complete
+    }, websocket)
+
+@router.websocket("/ws")
+async def multiplexed_websocket_endpoint(
+    websocket: WebSocket,
+    current_user: Optional[User] = Depends(deps.get_current_user_ws),
+):
+    """
+    One socket per user for all their chats. Authenticate with ?token=<JWT>, then send:
+      {"type": "subscribe", "chat_ids": [1, 2], "last_seq": {"1": 42}}
+      {"type": "unsubscribe", "chat_ids": [2]}
+      {"type": "message", "chat_id": 1, "message": "...", "client_msg_id": "..."}
+      {"type": "read", "chat_id": 1, "up_to_message_id": 99}
+      {"type": "typing", "chat_id": 1}
+      {"type": "heartbeat"}   (every ~10s, keeps the user online in the subscribed chats)
+    Every event pushed to the client carries its chat_id. Read receipts of other members
+    arrive batched as {"type": "read_receipts", "chat_id": 1, "receipts": [...]}, presence
+    changes as "presence" events and who is typing as coalesced "typing" events.
+    """
+    if current_user is None:
+        await websocket.close(code=WS_1008_POLICY_VIOLATION)
+        return
+
+    await manager.connect(websocket)
+    subscribed = set()
+    try:
+        while True:
+            data = await websocket.receive_json()
+            event_type = data.get("type")
+
+            if event_type == "subscribe":
+                requested = [int(c) for c in data.get("chat_ids", [])]
+                # Short-lived session: don't hold a pooled connection for the socket's lifetime
+                async with AsyncSessionLocal() as db:
+                    allowed = await crud_chat.get_member_chat_ids(
+                        db, user_id=current_user.id, chat_ids=requested
+                    )
+                joined = [chat_id for chat_id in allowed if chat_id not in subscribed]
+                for chat_id in allowed:
+                    manager.subscribe(websocket, chat_id)
+                    subscribed.add(chat_id)
+                await presence_tracker.join(current_user.id, joined)
+                manager.send_personal({
+                    "type": "subscribed",
+                    "chat_ids": sorted(subscribed),
+                    "rejected": sorted(set(requested) - set(allowed))
+                }, websocket)
+                # Replay after subscribing so nothing falls between the two (client dedupes by seq)
+                last_seqs = data.get("last_seq") or {}
+                for chat_id in allowed:
+                    if last_seqs.get(str(chat_id)) is not None:
+                        await _replay_missed(websocket, chat_id, int(last_seqs[str(chat_id)]))
+
+            elif event_type == "unsubscribe":
+                left = [int(c) for c in data.get("chat_ids", []) if int(c) in subscribed]
+                for chat_id in left:
+                    manager.unsubscribe(websocket, chat_id)
+                    subscribed.discard(chat_id)
+                await presence_tracker.leave(current_user.id, left)
+                manager.send_personal({"type": "subscribed", "chat_ids": sorted(subscribed)}, websocket)
+
+            elif event_type == "message":
+                chat_id = int(data.get("chat_id", 0))
+                if chat_id not in subscribed:
+                    manager.send_personal({
+                        "type": "error",
+                        "chat_id": chat_id,
+                        "detail": "Not subscribed to this chat"
+                    }, websocket)
+                elif data.get("message"):
+                    await _ingest_ws_message(websocket, chat_id, current_user.id, data)
+
+            elif event_type == "read":
+                chat_id = int(data.get("chat_id", 0))
+                up_to_message_id = data.get("up_to_message_id")
+                read_state = None
+                if chat_id in subscribed and up_to_message_id is not None:
+                    async with AsyncSessionLocal() as db:
+                        read_state = await _mark_read(db, chat_id, current_user.id, int(up_to_message_id))
+                if read_state is None:
+                    manager.send_personal({
+                        "type": "error",
+                        "chat_id": chat_id,
+                        "detail": "Message not found in a chat you are subscribed to"
+                    }, websocket)
+                else:
+                    manager.send_personal({
+                        "type": "read_state",
+                        "chat_id": chat_id,
+                        "last_read_message_id": read_state.last_read_message_id
+                    }, websocket)
+
+            elif event_type == "typing":
+                chat_id = int(data.get("chat_id", 0))
+                if chat_id in subscribed:
+                    await presence_tracker.typing(current_user.id, chat_id)
+
+            elif event_type == "heartbeat":
+                await presence_tracker.heartbeat(current_user.id, subscribed)
+
+    except WebSocketDisconnect:
+        manager.disconnect(websocket)
+    except Exception as e:
+        print(f"WS Error: {e}")
+        manager.disconnect(websocket)
+    finally:
+        await presence_tracker.leave(current_user.id, subscribed)
+
+async def _legacy_socket_user(chat_id: int, sender_id: Any) -> Optional[UUID]:
+    """The user behind a legacy per-chat socket: the sender_id its client sends, if that's a chat member."""
+    try:
+        user_id = UUID(str(sender_id))
+    except ValueError:
+        return None
+    async with AsyncSessionLocal() as db:
+        is_member = await chat_membership_service.is_member(db, chat_id, user_id)
+    return user_id if is_member else None
 
 @router.websocket("/{chat_id}/ws")
 async def websocket_endpoint(
     websocket: WebSocket,
     chat_id: int,
-    db: AsyncSession = Depends(deps.get_db),
+    last_seq: Optional[int] = Query(None, description="Last message seq the client has, missed messages are replayed"),
+    live_events: bool = Query(False, description="Also receive read_receipts, presence and typing events"),
     # token: str = Query(...) # In real app, validate token here for auth
 ):
-    await manager.connect(websocket, chat_id)
+    """
+    Per-chat socket of older clients. Every payload carries sender_id:
+      {"message": "...", "sender_id": "...", "client_msg_id": "..."}
+      {"type": "typing", "sender_id": "..."}
+      {"type": "heartbeat", "sender_id": "..."}   (every ~10s, keeps the user online in the chat)
+    The first sender_id that is a member of the chat puts that user online until the socket closes.
+    """
+    # No Depends(get_db) here: it would hold a pooled connection for as long as the socket is open.
+    # Writes go through chat_ingest_service, reads open their own short-lived session.
+    await manager.connect(websocket, chat_id, live_events=live_events)
+    presence_user: Optional[UUID] = None
     try:
+        if last_seq is not None:
+            await _replay_missed(websocket, chat_id, last_seq)
+
         while True:
             data = await websocket.receive_text()
             message_data = json.loads(data)
@@ -174,38 +514,72 @@ async def websocket_endpoint(
             
             sender_id = message_data.get("sender_id")
             content = message_data.get("message")
-            
-            if sender_id and content:
-                # Construct MessageCreate
-                msg_in = schemas.MessageCreate(
-                    message=content,
-                    chat_id=chat_id,
-                    batch_id=message_data.get("batch_id")
-                )
-                
-                # Save to DB
-                new_msg = await crud_message.create(db=db, obj_in=msg_in, sender_id=sender_id)
-                
-                # Prepare broadcast payload (serialize Pydantic/DB model)
-                # We can broadcast the full message object
-                # Date serialization might need helper
-                
-                response_data = {
-                    "id": new_msg.id,
-                    "message": new_msg.message,
-                    "sender_id": str(new_msg.sender_id),
-                    "chat_id": new_msg.chat_id,
-                    "created_at": new_msg.created_at.isoformat(),
-                    "status": "sent"
-                }
-                
-                await manager.broadcast(response_data, chat_id)
+            event_type = message_data.get("type", "message")
+
+            if presence_user is None and sender_id:
+                presence_user = await _legacy_socket_user(chat_id, sender_id)
+                if presence_user is not None:
+                    await presence_tracker.join(presence_user, [chat_id])
+
+            if event_type == "heartbeat":
+                if presence_user is not None:
+                    await presence_tracker.heartbeat(presence_user, [chat_id])
+            elif event_type == "typing":
+                if presence_user is not None:
+                    await presence_tracker.typing(presence_user, chat_id)
+            elif sender_id and content:
+                try:
+                    sender_uuid = UUID(str(sender_id))
+                except ValueError:
+                    _reject_ws_message(websocket, chat_id, message_data.get("client_msg_id"), "Invalid sender_id")
+                    continue
+                await _ingest_ws_message(websocket, chat_id, sender_uuid, message_data)
                 
     except WebSocketDisconnect:
         manager.disconnect(websocket, chat_id)
     except Exception as e:
         print(f"WS Error: {e}")
         manager.disconnect(websocket, chat_id)
+    finally:
+        if presence_user is not None:
+            await presence_tracker.leave(presence_user, [chat_id])
+
+async def _check_member(db: AsyncSession, chat_id: int, user_id: UUID):
+    is_member = await chat_membership_service.is_member(db, chat_id, user_id)
+    if is_member is None:
+        raise HTTPException(status_code=404, detail="Chat not found")
+    if not is_member:
+        raise HTTPException(status_code=403, detail="Not a member of this chat")
+
+@router.get("/{chat_id}/resources", response_model=List[schemas.ChatResource])
+async def read_resources(
+    *,
+    db: AsyncSession = Depends(deps.get_db),
+    chat_id: int,
+    skip: int = 0,
+    limit: int = Query(100, le=500),
+    file_type: Optional[str] = Query(None, description="MIME type or prefix, e.g. 'image/' or 'application/pdf'"),
+    current_user: User = Depends(deps.get_current_user),
+) -> Any:
+    """
+    Files shared in the chat, newest first (from the resource catalog, not a storage listing).
+    """
+    await _check_member(db, chat_id, current_user.id)
+    return await crud_chat.get_resources(db, chat_id=chat_id, skip=skip, limit=limit, file_type=file_type)
+
+@router.get("/{chat_id}/resources/summary", response_model=schemas.ChatResourceSummary)
+async def read_resources_summary(
+    *,
+    db: AsyncSession = Depends(deps.get_db),
+    chat_id: int,
+    current_user: User = Depends(deps.get_current_user),
+) -> Any:
+    """
+    Number of files in the chat, in total and per file type.
+    """
+    await _check_member(db, chat_id, current_user.id)
+    by_type = await crud_chat.count_resources(db, chat_id=chat_id)
+    return schemas.ChatResourceSummary(chat_id=chat_id, total=sum(by_type.values()), by_type=by_type)
 
 @router.post("/{chat_id}/resources", response_model=schemas.ChatResource)
 async def upload_resource(
@@ -217,13 +591,12 @@ async def upload_resource(
     """
     Upload a file to chat resources.
     """
-    chat = await crud_chat.get(db=db, id=chat_id)
+    chat = await chat_membership_service.get(db, chat_id)
     if not chat:
         raise HTTPException(status_code=404, detail="Chat not found")
     
     # Check membership
-    is_member = any(m.user_id == current_user.id for m in chat.members)
-    if not is_member:
+    if current_user.id not in chat.member_ids:
         raise HTTPException(status_code=403, detail="Not a member of this chat")
 
     # Determine storage path based on chat type
@@ -232,7 +605,7 @@ async def upload_resource(
     # Prompt says: "if any send send into group ,it will store under group... similar direct folder contains folder for userid all direct chat uploded files store into user id folder."
     
     if chat.chat_type == ChatTypeEnum.group:
-        path = f"resources/groups/{chat.id}"
+        path = f"resources/groups/{chat_id}"
     else:
         # direct chat -> resources/direct/{user_id}
         path = f"resources/direct/{current_user.id}"
@@ -248,41 +621,10 @@ async def upload_resource(
     resource_in = schemas.ChatResourceCreate(
         file_url=public_url,
         file_name=file.filename,
-        file_type=file.content_type
+        file_type=file.content_type,
+        storage_path=f"{path}/{file.filename}",
+        file_size=file.size
     )
     resource = await crud_chat.create_resource(db=db, obj_in=resource_in, chat_id=chat_id, sender_id=current_user.id)
     
     return resource
-
-@router.get("/proxy-download")
-async def proxy_download_file(url: str):
-    """
-    Proxy a file download to bypass CORS/Browser opening file.
-    Forces download by setting Content-Disposition attachment.
-    """
-    if not url:
-        raise HTTPException(status_code=400, detail="URL is required")
-
-    async def iterfile():
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                if response.status != 200:
-                    raise HTTPException(status_code=404, detail="File not found or upstream error")
-                
-                async for chunk in response.content.iter_chunked(1024 * 1024): # 1MB chunks
-                    yield chunk
-
-    # Determine filename from URL
-    try:
-        filename = url.split("/")[-1]
-        # handling URL decoding if needed, but basic split works for most CDN paths
-        from urllib.parse import unquote
-        filename = unquote(filename)
-    except:
-        filename = "downloaded_file"
-
-    return StreamingResponse(
-        iterfile(),
-        media_type="application/octet-stream",
-        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
-    )
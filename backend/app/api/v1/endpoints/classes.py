@@ -1,5 +1,5 @@
-from typing import Any, List
-from fastapi import APIRouter, Depends, HTTPException
+from typing import Any, List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.api import deps
 from app.crud.crud_batch import batch as crud_batch, batch_member as crud_batch_member
@@ -220,30 +220,46 @@ async def read_batch_members(
     members = await crud_batch_member.get_by_batch(db, batch_id=batch_id, skip=skip, limit=limit)
     return members
 
+def _as_storage_listing(resource) -> dict:
+    """Catalog row in the Bunny.net listing format the clients already parse."""
+    directory, _, object_name = (resource.storage_path or resource.file_name).rpartition("/")
+    return {
+        "Guid": resource.storage_guid or str(resource.id),
+        "StorageZoneName": bunny_service.storage_zone,
+        "Path": f"/{bunny_service.storage_zone}/{directory}/" if directory else f"/{bunny_service.storage_zone}/",
+        "ObjectName": object_name or resource.file_name,
+        "Length": resource.file_size or 0,
+        "LastChanged": resource.created_at.isoformat() if resource.created_at else None,
+        "DateCreated": resource.created_at.isoformat() if resource.created_at else None,
+        "IsDirectory": False,
+        "ContentType": resource.file_type,
+        "url": resource.file_url,
+    }
+
 @router.get("/{batch_id}/resources", response_model=List[Any])
 async def read_batch_resources(
     *,
     db: AsyncSession = Depends(deps.get_db),
     batch_id: int,
+    skip: int = 0,
+    limit: int = Query(100, le=500),
+    file_type: Optional[str] = Query(None, description="MIME type or prefix, e.g. 'image/' or 'application/pdf'"),
     current_user: User = Depends(deps.get_current_user),
 ) -> Any:
     """
     Get resources for a batch (from its group chat).
+    Served from the chat resource catalog (kept in sync with Bunny.net by the reconciler).
     """
     batch = await crud_batch.get(db=db, id=batch_id)
     if not batch:
         raise HTTPException(status_code=404, detail="Batch not found")
 
     # Resolve Chat Group ID from Batch ID
-    chat = await crud_chat.get_by_batch(db, batch_id=batch_id)
+    chat_id = await crud_chat.get_id_by_batch(db, batch_id=batch_id)
     
-    if not chat:
+    if not chat_id:
         # If no chat exists yet (e.g. auto-creation failed), returns empty list instead of 404 for resources
         return []
-        
-    # Fetch resources from Bunny.net
-    # Path: resources/groups/{chat_id}/
-    path = f"resources/groups/{chat.id}"
-    files = await bunny_service.list_files(path)
-    
-    return files
+
+    resources = await crud_chat.get_resources(db, chat_id=chat_id, skip=skip, limit=limit, file_type=file_type)
+    return [_as_storage_listing(resource) for resource in resources]
@@ -1,16 +1,173 @@
 from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from typing import List, Optional
+from sqlalchemy import func
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+import asyncio
 import json
+import time
 
 from app.api.deps import get_db
+from app.db.session import AsyncSessionLocal
 from app.models.assessment import Assessment
-from app.models.course import Course
-from app.services.bunny_service import bunny_service
+from app.services.template_cache_service import template_cache_service
+from app.crud.crud_question import question as crud_question
 
 router = APIRouter()
 
+# Templates downloaded at the same time for assessments that aren't indexed yet
+TEMPLATE_FETCH_CONCURRENCY = 8
+# Rows per index query in streaming mode
+STREAM_PAGE_SIZE = 200
+# Seconds before a template that failed to download is tried again
+FAILED_TEMPLATE_RETRY_AFTER = 300.0
+
+# template_url -> (time.monotonic() of the failure, the exception)
+_failed_templates: Dict[str, Tuple[float, Exception]] = {}
+
+def _parse_cursor(cursor: Optional[str]) -> Tuple[Optional[Tuple[int, int]], Optional[List[int]]]:
+    """
+    (key, pending assessment ids). "assessment_id:position" pages the index, a third part
+    (comma separated assessment ids) resumes the second phase of a stream.
+    """
+    if not cursor:
+        return None, None
+    try:
+        parts = cursor.split(":")
+        if len(parts) == 2:
+            return (int(parts[0]), int(parts[1])), None
+        if len(parts) == 3:
+            return (int(parts[0]), int(parts[1])), sorted(int(i) for i in parts[2].split(","))
+    except ValueError:
+        pass
+    raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def _format_cursor(key: Optional[Tuple[int, int]], pending_ids: Optional[List[int]] = None) -> Optional[str]:
+    if not key:
+        return None
+    if pending_ids:
+        return f"{key[0]}:{key[1]}:{','.join(str(i) for i in pending_ids)}"
+    return f"{key[0]}:{key[1]}"
+
+def _recent_failure(template_url: str) -> Optional[Exception]:
+    failure = _failed_templates.get(template_url)
+    if failure and time.monotonic() - failure[0] < FAILED_TEMPLATE_RETRY_AFTER:
+        return failure[1]
+    _failed_templates.pop(template_url, None)
+    return None
+
+def _start_template_fetches(pending: List[Tuple[Assessment, str]]) -> Dict[int, asyncio.Task]:
+    """
+    Start downloading the templates, a few at a time. assessment id -> task of
+    (assessment, course_title, questions_data or the exception).
+    """
+    semaphore = asyncio.Semaphore(TEMPLATE_FETCH_CONCURRENCY)
+
+    async def fetch(assessment: Assessment, course_title: str):
+        # Failed recently: don't download it again on every request
+        failure = _recent_failure(assessment.template_url)
+        if failure is not None:
+            return assessment, course_title, failure
+        async with semaphore:
+            try:
+                return assessment, course_title, await template_cache_service.get(assessment.template_url)
+            except Exception as e:
+                _failed_templates[assessment.template_url] = (time.monotonic(), e)
+                return assessment, course_title, e
+
+    return {
+        assessment.id: asyncio.ensure_future(fetch(assessment, course_title))
+        for assessment, course_title in pending
+    }
+
+async def _fetch_templates(pending: List[Tuple[Assessment, str]]) -> AsyncIterator[Tuple[Assessment, str, object]]:
+    """(assessment, course_title, questions_data or the exception) as each template arrives."""
+    for next_done in asyncio.as_completed(list(_start_template_fetches(pending).values())):
+        yield await next_done
+
+async def _index_fetched(db: AsyncSession, assessment: Assessment, questions_data, errors: List[str]) -> Optional[dict]:
+    """Index a fetched template, or record why it couldn't be fetched."""
+    if isinstance(questions_data, Exception):
+        error_msg = f"Failed to fetch questions from assessment {assessment.id} ({assessment.title}): {str(questions_data)}"
+        print(f"  ❌ {error_msg}")
+        errors.append(error_msg)
+        return None
+    await crud_question.index_assessment(db, assessment_id=assessment.id, questions_data=questions_data)
+    return questions_data
+
+async def _index_missing_templates(db: AsyncSession, course_id: Optional[int] = None) -> List[str]:
+    """
+    Extract the questions of assessments that aren't in the index yet (created before it existed,
+    or whose extraction failed). backfill_question_index.py does the same for everything at once.
+    Templates that failed to download are only retried every FAILED_TEMPLATE_RETRY_AFTER seconds.
+    """
+    errors = []
+    async for assessment, _, questions_data in _fetch_templates(await crud_question.get_unindexed(db, course_id=course_id)):
+        await _index_fetched(db, assessment, questions_data, errors)
+    return errors
+
+async def _stream_question_bank(
+    filters: dict, after: Optional[Tuple[int, int]], pending_ids: Optional[List[int]], limit: int
+) -> AsyncIterator[str]:
+    """
+    NDJSON: indexed questions first (one index page at a time), then the questions of the
+    assessments that weren't indexed yet, in assessment order as their templates arrive (each
+    is indexed on the way). The last line is a summary, its next_cursor resumes whichever
+    phase `limit` cut short (pending_ids set: resume the second phase with those assessments).
+    """
+    # Own session: the request's one is closed once the response starts streaming
+    async with AsyncSessionLocal() as db:
+        sent = 0
+        next_cursor = None
+        if pending_ids is None:
+            pending = await crud_question.get_unindexed(db, course_id=filters.get("course_id"))
+            # Indexed while we stream: keep them out of the index pages so nothing is sent twice
+            pending_ids = [assessment.id for assessment, _ in pending]
+            last_key = after
+            more = True
+            while more and sent < limit:
+                page_size = min(STREAM_PAGE_SIZE, limit - sent)
+                entries, key = await crud_question.search(
+                    db, after=last_key, limit=page_size, exclude_assessment_ids=pending_ids, **filters
+                )
+                for entry in entries:
+                    yield json.dumps(entry, default=str) + "\n"
+                sent += len(entries)
+                if key is not None:
+                    last_key = key
+                if len(entries) < page_size:
+                    more = False
+            if more:
+                next_cursor = _format_cursor(last_key)
+            after = None
+        else:
+            pending = await crud_question.get_unindexed(
+                db, course_id=filters.get("course_id"), assessment_ids=pending_ids
+            )
+
+        errors = []
+        if next_cursor is None:
+            # Downloads run ahead, questions go out in assessment order so the cursor can resume them.
+            # Downloads still running when the limit is hit are left to finish: they warm the template cache.
+            fetches = _start_template_fetches(pending)
+            for i, assessment_id in enumerate(pending_ids):
+                if assessment_id in fetches:
+                    assessment, _, questions_data = await fetches[assessment_id]
+                    if await _index_fetched(db, assessment, questions_data, errors) is None:
+                        continue
+                entries, key = await crud_question.search(
+                    db, after=after, limit=limit - sent, assessment_ids=[assessment_id], **filters
+                )
+                for entry in entries:
+                    yield json.dumps(entry, default=str) + "\n"
+                sent += len(entries)
+                if sent >= limit:
+                    next_cursor = _format_cursor(key, pending_ids[i:])
+                    break
+
+        yield json.dumps({"done": True, "count": sent, "next_cursor": next_cursor, "errors": errors or None}) + "\n"
+
 @router.get("/")
 async def get_question_bank(
     category: Optional[str] = Query(None, description="Filter by category"),
@@ -18,108 +175,47 @@ async def get_question_bank(
     question_type: Optional[str] = Query(None, description="Filter by question type (Multiple Choice, True/False, etc)"),
     course_id: Optional[int] = Query(None, description="Filter by course ID"),
     search: Optional[str] = Query(None, description="Search in question text"),
+    skip: int = 0,
+    limit: int = Query(500, le=1000),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page (replaces skip)"),
+    stream: bool = Query(False, description="Stream matching questions as NDJSON, one per line, summary last"),
     db: AsyncSession = Depends(get_db)
 ):
     """
-    Fetch all questions from all assessments with optional filtering.
-    Aggregates questions from all assessment JSON files stored in Bunny storage.
+    Fetch questions from all assessments with optional filtering.
+    Served from the `questions` index (extracted from the assessment JSON files stored in Bunny storage).
     """
-    print("=== Question Bank API Called ===")
-    print(f"Filters: category={category}, difficulty={difficulty}, question_type={question_type}, course_id={course_id}, search={search}")
-    
-    # Fetch all assessments with their template URLs
-    stmt = select(Assessment, Course.title).join(Course, Assessment.course_id == Course.id)
-    
+    filters = dict(
+        category=category, difficulty=difficulty, question_type=question_type, course_id=course_id, search=search
+    )
+    after, pending_ids = _parse_cursor(cursor)
+
+    if stream:
+        return StreamingResponse(
+            _stream_question_bank(filters, after, pending_ids, limit), media_type="application/x-ndjson"
+        )
+    if pending_ids is not None:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    count_stmt = select(func.count(Assessment.id))
     if course_id:
-        stmt = stmt.filter(Assessment.course_id == course_id)
-    
-    result = await db.execute(stmt)
-    rows = result.all()
-    
-    print(f"Found {len(rows)} assessments in database")
-    
-    if not rows:
-        print("No assessments found in database")
+        count_stmt = count_stmt.filter(Assessment.course_id == course_id)
+    total_assessments = (await db.execute(count_stmt)).scalar()
+
+    if not total_assessments:
         return {"questions": [], "total": 0, "error": "No assessments found in database"}
-    
-    # Aggregate questions from all assessments
-    all_questions = []
-    errors = []
-    
-    for assessment, course_title in rows:
-        print(f"\nProcessing Assessment ID: {assessment.id}, Title: {assessment.title}")
-        print(f"  Template URL: {assessment.template_url}")
-        
-        if not assessment.template_url:
-            print(f"  ⚠️ Assessment {assessment.id} has no template_url - skipping")
-            errors.append(f"Assessment '{assessment.title}' has no template URL")
-            continue
-            
-        try:
-            # Fetch questions from Bunny storage
-            print(f"  Fetching questions from Bunny storage...")
-            questions_data = await bunny_service.download_json(assessment.template_url)
-            print(f"  Downloaded data structure: {list(questions_data.keys())}")
-            
-            questions = questions_data.get("questions", [])
-            print(f"  Found {len(questions)} questions in this assessment")
-            
-            if len(questions) == 0:
-                print(f"  ⚠️ No questions array in downloaded data")
-                errors.append(f"Assessment '{assessment.title}' has no questions in stored data")
-            
-            # Add metadata to each question
-            for idx, question in enumerate(questions):
-                print(f"    Question {idx + 1}: {question.get('text', 'No text')[:50]}...")
-                question_with_meta = {
-                    **question,
-                    "assessment_id": assessment.id,
-                    "assessment_title": assessment.title,
-                    "course_id": assessment.course_id,
-                    "course_name": course_title,
-                    "created_at": assessment.created_at.isoformat() if assessment.created_at else None
-                }
-                all_questions.append(question_with_meta)
-                
-        except Exception as e:
-            error_msg = f"Failed to fetch questions from assessment {assessment.id} ({assessment.title}): {str(e)}"
-            print(f"  ❌ {error_msg}")
-            errors.append(error_msg)
-            continue
-    
-    print(f"\n=== Total questions aggregated: {len(all_questions)} ===")
-    
-    # Apply filters
-    filtered_questions = all_questions
-    
-    if difficulty:
-        filtered_questions = [q for q in filtered_questions if q.get("difficulty", "").lower() == difficulty.lower()]
-        print(f"After difficulty filter: {len(filtered_questions)} questions")
-    
-    if question_type:
-        filtered_questions = [q for q in filtered_questions if q.get("type", "") == question_type]
-        print(f"After question_type filter: {len(filtered_questions)} questions")
-    
-    if category:
-        filtered_questions = [q for q in filtered_questions if q.get("category", "").lower() == category.lower()]
-        print(f"After category filter: {len(filtered_questions)} questions")
-    
-    if search:
-        search_lower = search.lower()
-        filtered_questions = [
-            q for q in filtered_questions 
-            if search_lower in q.get("text", "").lower()
-        ]
-        print(f"After search filter: {len(filtered_questions)} questions")
-    
-    print(f"Final filtered count: {len(filtered_questions)}")
-    print("=== End Question Bank API ===\n")
-    
+
+    errors = await _index_missing_templates(db, course_id=course_id)
+
+    questions, last_key = await crud_question.search(db, skip=skip, limit=limit, after=after, **filters)
+    total = await crud_question.count(db, **filters)
+
     return {
-        "questions": filtered_questions,
-        "total": len(filtered_questions),
+        "questions": questions,
+        "total": total,
+        "next_cursor": _format_cursor(last_key) if len(questions) == limit else None,
         "debug_info": {
-            "total_assessments": len(rows),
+            "total_assessments": total_assessments,
             "errors": errors if errors else None
         }
     }
@@ -142,18 +238,16 @@ async def get_question_by_id(
     
     if not assessment.template_url:
         raise HTTPException(status_code=404, detail="Assessment has no questions")
-    
-    try:
-        questions_data = await bunny_service.download_json(assessment.template_url)
-        questions = questions_data.get("questions", [])
-        
-        # Find question by ID
-        question = next((q for q in questions if str(q.get("id")) == str(question_id)), None)
-        
-        if not question:
-            raise HTTPException(status_code=404, detail="Question not found")
-        
-        return question
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to fetch question: {str(e)}")
+
+    if assessment.questions_indexed_at is None:
+        try:
+            questions_data = await template_cache_service.get(assessment.template_url)
+            await crud_question.index_assessment(db, assessment_id=assessment.id, questions_data=questions_data)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Failed to fetch question: {str(e)}")
+
+    question = await crud_question.get_by_key(db, assessment_id=assessment_id, question_key=str(question_id))
+    if not question:
+        raise HTTPException(status_code=404, detail="Question not found")
+
+    return question.data
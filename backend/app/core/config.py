@@ -23,6 +23,22 @@ class Settings(BaseSettings):
     GOOGLE_CLIENT_SECRET: str = ""
     GOOGLE_REDIRECT_URI: str = ""
 
+    # Chat WebSocket fan-out: "memory" (single worker) or "postgres" (LISTEN/NOTIFY across workers)
+    CHAT_BROKER: str = "memory"
+
+    # Local disk cache for /chats/proxy-download (empty = disabled), LRU-evicted past the byte limit
+    PROXY_CACHE_DIR: str = ""
+    PROXY_CACHE_MAX_BYTES: int = 2 * 1024 * 1024 * 1024
+
+    # Seconds between resource catalog / storage reconciliations (0 = disabled)
+    RESOURCE_RECONCILE_INTERVAL: int = 900
+
+    # In-memory cache of assessment question templates (JSON from Bunny.net)
+    TEMPLATE_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+
+    # Async workers grading queued assessment submissions, per process
+    SUBMISSION_WORKERS: int = 4
+
     @property
     def ASYNC_DATABASE_URL(self) -> str:
 
@@ -0,0 +1,64 @@
+import json
+import uuid
+from typing import List, Optional
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from sqlalchemy import delete, insert, union
+from sqlalchemy.sql import Select
+
+from app.models.assessment import Assessment, AssessmentAssignment
+from app.models.batch import BatchMember, BatchMemberRole, BatchMemberStatus
+
+
+def assigned_student_ids(assigned_to: Optional[str]) -> Optional[List[uuid.UUID]]:
+    """Student ids of an Assessment.assigned_to JSON array, None for "entire_batch" (unreadable ids are skipped)."""
+    if not assigned_to or assigned_to == "entire_batch":
+        return None
+    try:
+        raw_ids = json.loads(assigned_to)
+    except ValueError:
+        return []
+    student_ids = []
+    for raw_id in raw_ids if isinstance(raw_ids, list) else []:
+        try:
+            student_ids.append(uuid.UUID(str(raw_id)))
+        except ValueError:
+            continue
+    return list(dict.fromkeys(student_ids))
+
+
+class CRUDAssignment:
+    async def set_for_assessment(self, db: AsyncSession, *, assessment: Assessment) -> None:
+        """Replace the assessment's assignment rows with what its assigned_to says. Not committed."""
+        await db.execute(delete(AssessmentAssignment).where(AssessmentAssignment.assessment_id == assessment.id))
+        student_ids = assigned_student_ids(assessment.assigned_to)
+        if student_ids is None:
+            rows = [{"assessment_id": assessment.id, "batch_id": assessment.batch_id}]
+        else:
+            rows = [{"assessment_id": assessment.id, "student_id": student_id} for student_id in student_ids]
+        if rows:
+            await db.execute(insert(AssessmentAssignment), rows)
+
+    def assessment_ids_for_student(self, student_id: uuid.UUID) -> Select:
+        """
+        Ids of the assessments assigned to a student: assigned to one of the student's batches, or to the
+        student by name within a batch they belong to. Only active student memberships count.
+        """
+        student_batch_ids = select(BatchMember.batch_id).filter(
+            BatchMember.user_id == student_id,
+            BatchMember.role == BatchMemberRole.student,
+            BatchMember.status == BatchMemberStatus.active,
+        )
+        via_batch = (
+            select(AssessmentAssignment.assessment_id)
+            .filter(AssessmentAssignment.batch_id.in_(student_batch_ids))
+        )
+        individually = (
+            select(AssessmentAssignment.assessment_id)
+            .join(Assessment, Assessment.id == AssessmentAssignment.assessment_id)
+            .filter(AssessmentAssignment.student_id == student_id, Assessment.batch_id.in_(student_batch_ids))
+        )
+        return union(via_batch, individually)
+
+
+assignment = CRUDAssignment()
@@ -1,13 +1,19 @@
-from typing import List, Optional
+from bisect import bisect_left
+from typing import Dict, List, Optional, Tuple
 from uuid import UUID
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy.orm import selectinload
-from sqlalchemy import desc, func, case, and_
+from sqlalchemy.orm import selectinload, aliased
+from sqlalchemy import desc, func, case, and_, exists, update, true, tuple_, cast, REAL, literal
+from sqlalchemy.dialects.postgresql import TIMESTAMP, insert
 
-from app.models.chat import Chat, ChatMember, Message, ChatMemberRoleEnum, MessageRead, ChatResource
+from app.models.chat import Chat, ChatMember, Message, ChatMemberRoleEnum, ChatResource
+from app.services.chat_membership_service import chat_membership_service
 from app.schemas.chat import ChatCreate, ChatUpdate, MessageCreate, ChatMemberCreate, ChatResourceCreate
 
+NO_LOWER_BOUND = cast(literal("-infinity"), TIMESTAMP(timezone=True))
+
+
 class CRUDChat:
     async def get(self, db: AsyncSession, id: int) -> Optional[Chat]:
         result = await db.execute(
@@ -21,20 +27,49 @@ class CRUDChat:
         return result.scalars().first()
 
     async def get_by_user(self, db: AsyncSession, user_id: UUID, skip: int = 0, limit: int = 100) -> List[Chat]:
+        """
+        Inbox: the user's chats, most recently active first, each with its latest message
+        and the user's unread count, all from one query (LATERAL join on the latest message).
+        """
+        latest = (
+            select(Message)
+            .filter(Message.chat_id == Chat.id)
+            .order_by(desc(Message.id))
+            .limit(1)
+            .lateral("latest_message")
+        )
+        latest_message = aliased(Message, latest)
+        # Messages past the caller's read watermark, counted on the (chat_id, id) index
+        unread_count = (
+            select(func.count(Message.id))
+            .filter(
+                Message.chat_id == Chat.id,
+                Message.id > func.coalesce(ChatMember.last_read_message_id, 0),
+                Message.sender_id != user_id
+            )
+            .scalar_subquery()
+        )
+        last_activity_at = func.coalesce(latest.c.created_at, Chat.created_at)
+
         # Join with ChatMember to find chats where user is a member
         result = await db.execute(
-            select(Chat)
-            .join(ChatMember)
+            select(Chat, latest_message, unread_count.label("unread_count"))
+            .join(ChatMember, and_(ChatMember.chat_id == Chat.id, ChatMember.user_id == user_id))
+            .outerjoin(latest, true())
             .options(
                 selectinload(Chat.members).selectinload(ChatMember.user),
                 selectinload(Chat.batch)
             )
-            .filter(ChatMember.user_id == user_id)
-            .order_by(desc(Chat.created_at))
+            .order_by(desc(last_activity_at), desc(Chat.id))
             .offset(skip)
             .limit(limit)
         )
-        return result.unique().scalars().all()
+        chats = []
+        for chat_obj, latest_msg, unread in result.all():
+            chat_obj.latest_message = latest_msg
+            chat_obj.unread_count = unread or 0
+            chats.append(chat_obj)
+        return chats
 
     async def create(self, db: AsyncSession, *, obj_in: ChatCreate, created_by: UUID) -> Chat:
         db_obj = Chat(
@@ -68,8 +103,18 @@ class CRUDChat:
 
         await db.commit()
         # Instead of refresh, we fetch the full object with relations to avoid MissingGreenlet
-        return await self.get(db, db_obj.id)
+        chat_obj = await self.get(db, db_obj.id)
+        chat_membership_service.set(chat_obj.id, chat_obj.chat_type, {m.user_id for m in chat_obj.members})
+        return chat_obj
     
+    async def get_member_chat_ids(self, db: AsyncSession, *, user_id: UUID, chat_ids: List[int]) -> List[int]:
+        """Subset of chat_ids the user is a member of"""
+        result = await db.execute(
+            select(ChatMember.chat_id)
+            .filter(ChatMember.user_id == user_id, ChatMember.chat_id.in_(chat_ids))
+        )
+        return list(result.scalars().all())
+
     async def get_by_batch(self, db: AsyncSession, batch_id: int) -> Optional[Chat]:
         """Find chat for a specific batch"""
         result = await db.execute(
@@ -86,8 +131,9 @@ class CRUDChat:
             select(ChatMember)
             .filter(ChatMember.chat_id == chat_id, ChatMember.user_id == member_in.user_id)
         )
-        if existing.scalars().first():
-            return existing.scalars().first()
+        existing_member = existing.scalars().first()
+        if existing_member:
+            return existing_member
         
         member = ChatMember(
             chat_id=chat_id,
@@ -98,21 +144,114 @@ class CRUDChat:
         db.add(member)
         await db.commit()
         await db.refresh(member)
+        chat_membership_service.add_member(chat_id, member.user_id)
         return member
 
     async def create_resource(self, db: AsyncSession, *, obj_in: ChatResourceCreate, chat_id: int, sender_id: UUID) -> ChatResource:
-        db_obj = ChatResource(
-            chat_id=chat_id,
+        if obj_in.storage_path is None:
+            db_obj = ChatResource(
+                chat_id=chat_id,
+                sender_id=sender_id,
+                file_url=obj_in.file_url,
+                file_name=obj_in.file_name,
+                file_type=obj_in.file_type
+            )
+            db.add(db_obj)
+            await db.commit()
+            await db.refresh(db_obj)
+            return db_obj
+
+        # Uploading the same file name overwrites it in storage: refresh the existing row
+        values = dict(
             sender_id=sender_id,
             file_url=obj_in.file_url,
             file_name=obj_in.file_name,
-            file_type=obj_in.file_type
+            file_type=obj_in.file_type,
+            file_size=obj_in.file_size,
+            deleted_at=None,
         )
-        db.add(db_obj)
+        result = await db.execute(
+            insert(ChatResource)
+            .values(chat_id=chat_id, storage_path=obj_in.storage_path, **values)
+            .on_conflict_do_update(
+                index_elements=[ChatResource.storage_path],
+                set_={**values, "chat_id": chat_id, "created_at": func.now()},
+            )
+            .returning(ChatResource)
+        )
+        db_obj = result.scalar_one()
         await db.commit()
-        await db.refresh(db_obj)
         return db_obj
 
+    async def get_id_by_batch(self, db: AsyncSession, batch_id: int) -> Optional[int]:
+        """Chat id of a batch, without loading the chat and its members"""
+        result = await db.execute(select(Chat.id).filter(Chat.batch_id == batch_id).limit(1))
+        return result.scalar()
+
+    async def get_resources(
+        self,
+        db: AsyncSession,
+        *,
+        chat_id: int,
+        skip: int = 0,
+        limit: int = 100,
+        file_type: Optional[str] = None,
+    ) -> List[ChatResource]:
+        """Newest first. file_type matches a MIME prefix ('image/', 'application/pdf')."""
+        query = select(ChatResource).filter(ChatResource.chat_id == chat_id, ChatResource.deleted_at.is_(None))
+        if file_type:
+            query = query.filter(ChatResource.file_type.startswith(file_type, autoescape=True))
+        result = await db.execute(
+            query.order_by(desc(ChatResource.created_at), desc(ChatResource.id)).offset(skip).limit(limit)
+        )
+        return result.scalars().all()
+
+    async def count_resources(self, db: AsyncSession, *, chat_id: int) -> Dict[str, int]:
+        """file_type -> number of resources in the chat"""
+        result = await db.execute(
+            select(ChatResource.file_type, func.count())
+            .filter(ChatResource.chat_id == chat_id, ChatResource.deleted_at.is_(None))
+            .group_by(ChatResource.file_type)
+        )
+        return {file_type or "unknown": count for file_type, count in result.all()}
+
+    async def sync_resources(
+        self, db: AsyncSession, *, chat_id: int, sender_id: UUID, prefix: str, stored: List[dict], prune: bool = True
+    ) -> Tuple[int, int]:
+        """
+        Make the catalog under storage prefix match a storage listing (dicts with storage_path,
+        file_name, file_url, file_type, file_size, storage_guid). Unknown files are added with
+        sender_id as uploader, rows whose file is gone are soft-deleted (only with prune).
+        Returns (upserted, deleted).
+        """
+        if stored:
+            stmt = insert(ChatResource).values([{**f, "chat_id": chat_id, "sender_id": sender_id} for f in stored])
+            await db.execute(
+                stmt.on_conflict_do_update(
+                    index_elements=[ChatResource.storage_path],
+                    set_={
+                        "file_size": stmt.excluded.file_size,
+                        "storage_guid": stmt.excluded.storage_guid,
+                        "deleted_at": None,
+                    },
+                )
+            )
+        if not prune:
+            await db.commit()
+            return len(stored), 0
+        result = await db.execute(
+            update(ChatResource)
+            .where(
+                ChatResource.chat_id == chat_id,
+                ChatResource.storage_path.startswith(prefix, autoescape=True),
+                ChatResource.storage_path.notin_([f["storage_path"] for f in stored]),
+                ChatResource.deleted_at.is_(None),
+            )
+            .values(deleted_at=func.now())
+        )
+        await db.commit()
+        return len(stored), result.rowcount
+
 class CRUDMessage:
     async def create(self, db: AsyncSession, *, obj_in: MessageCreate, sender_id: UUID) -> Message:
         db_obj = Message(
@@ -120,48 +259,130 @@ class CRUDMessage:
             batch_id=obj_in.batch_id,
             sender_id=sender_id,
             message=obj_in.message,
-            is_system_message=obj_in.is_system_message
+            is_system_message=obj_in.is_system_message,
+            client_msg_id=obj_in.client_msg_id
         )
         db.add(db_obj)
         await db.commit()
         await db.refresh(db_obj)
         return db_obj
 
-    async def get_by_chat(self, db: AsyncSession, chat_id: int, skip: int = 0, limit: int = 50) -> List[Message]:
-        # 1. Get raw messages
+    async def search(
+        self,
+        db: AsyncSession,
+        *,
+        q: str,
+        user_id: UUID,
+        chat_id: Optional[int] = None,
+        limit: int = 20,
+        cursor: Optional[Tuple[float, int]] = None,
+    ) -> List[Tuple[Message, float]]:
+        """
+        Ranked full-text search over the GIN-indexed search_vector, in one chat or in every
+        chat the user is a member of. Keyset paginated on (rank, id): cursor is the last row seen.
+        """
+        ts_query = func.websearch_to_tsquery('english', q)
+        rank = func.ts_rank(Message.search_vector, ts_query)
+        query = select(Message, rank.label("rank")).filter(Message.search_vector.op("@@")(ts_query))
+        if chat_id is not None:
+            query = query.filter(Message.chat_id == chat_id)
+        else:
+            query = query.filter(
+                Message.chat_id.in_(select(ChatMember.chat_id).filter(ChatMember.user_id == user_id))
+            )
+        if cursor is not None:
+            query = query.filter(tuple_(rank, Message.id) < tuple_(cast(cursor[0], REAL), cursor[1]))
+        result = await db.execute(query.order_by(desc(rank), desc(Message.id)).limit(limit))
+        return result.all()
+
+    def _cursor_created_at(self, chat_id: int, criterion):
+        """
+        created_at of the cursor message, so keyset queries also get a created_at bound and
+        Postgres only scans the monthly partitions that can match (ids/seqs aren't the partition key).
+        Exact: the messages_assign_seq trigger keeps a chat's created_at in id / seq order.
+        """
+        cursor = aliased(Message)
+        return (
+            select(cursor.created_at)
+            .filter(cursor.chat_id == chat_id, criterion(cursor))
+            .limit(1)
+            .scalar_subquery()
+        )
+
+    async def get_since_seq(self, db: AsyncSession, *, chat_id: int, last_seq: int, limit: int = 500) -> List[Message]:
+        """Messages after last_seq, oldest first (reconnect catch-up when the replay buffer can't cover the gap)"""
         result = await db.execute(
             select(Message)
-            .filter(Message.chat_id == chat_id)
-            .order_by(desc(Message.created_at))
-            .offset(skip)
+            .filter(
+                Message.chat_id == chat_id,
+                Message.seq > last_seq,
+                Message.created_at >= func.coalesce(
+                    self._cursor_created_at(chat_id, lambda m: m.seq == last_seq), NO_LOWER_BOUND
+                ),
+            )
+            .order_by(Message.seq)
             .limit(limit)
         )
+        return result.scalars().all()
+
+    async def get_by_chat(
+        self,
+        db: AsyncSession,
+        chat_id: int,
+        skip: int = 0,
+        limit: int = 50,
+        before_id: Optional[int] = None,
+        after_id: Optional[int] = None,
+    ) -> List[Message]:
+        """
+        Newest first. Use before_id (older page) / after_id (newer messages) cursors
+        instead of skip: they hit the (chat_id, id) index and don't shift on new inserts.
+        """
+        # 1. Get raw messages
+        query = select(Message).filter(Message.chat_id == chat_id)
+        if before_id is not None:
+            query = query.filter(
+                Message.id < before_id,
+                Message.created_at <= func.coalesce(
+                    self._cursor_created_at(chat_id, lambda m: m.id == before_id), func.now()
+                ),
+            )
+        if after_id is not None:
+            # Walk forward from the cursor, then flip back to newest first below
+            query = query.filter(
+                Message.id > after_id,
+                Message.created_at >= func.coalesce(
+                    self._cursor_created_at(chat_id, lambda m: m.id == after_id), NO_LOWER_BOUND
+                ),
+            ).order_by(Message.id)
+        else:
+            query = query.order_by(desc(Message.id))
+            if before_id is None:
+                query = query.offset(skip)
+        result = await db.execute(query.limit(limit))
         messages = result.scalars().all()
+        if after_id is not None:
+            messages = list(reversed(messages))
         
         if not messages:
             return []
 
-        # 2. Get total member count
-        total_members_query = await db.execute(
-            select(func.count(ChatMember.id)).filter(ChatMember.chat_id == chat_id)
+        # 2. One query for every member's read watermark
+        watermarks_query = await db.execute(
+            select(ChatMember.user_id, ChatMember.last_read_message_id)
+            .filter(ChatMember.chat_id == chat_id)
         )
-        total_members = total_members_query.scalar() or 0
-        
-        # 3. For each message, get read count
-        message_ids = [m.id for m in messages]
-        
-        read_counts_query = await db.execute(
-            select(MessageRead.message_id, func.count(MessageRead.id))
-            .filter(MessageRead.message_id.in_(message_ids))
-            .filter(MessageRead.status == 'read')
-            .group_by(MessageRead.message_id)
-        )
-        read_counts = dict(read_counts_query.all()) # {msg_id: count}
+        watermarks = {user_id: last_read or 0 for user_id, last_read in watermarks_query.all()}
+        total_members = len(watermarks)
+        sorted_watermarks = sorted(watermarks.values())
 
-        # 4. Compute status
+        # 3. Compute status: a member has read a message if their watermark reached its id
         for msg in messages:
-            read_count = read_counts.get(msg.id, 0)
-            
+            read_count = total_members - bisect_left(sorted_watermarks, msg.id)
+            # The sender doesn't count as a reader of their own message
+            if watermarks.get(msg.sender_id, 0) >= msg.id:
+                read_count -= 1
+
             # Logic: If read_count == (total_members - 1), then 'read' (Blue Tick)
             if total_members > 1 and read_count >= (total_members - 1):
                 msg.status = 'read' # Blue Tick
@@ -175,44 +396,43 @@ class CRUDMessage:
         return messages
 
 class CRUDMessageRead:
-    async def mark_read(self, db: AsyncSession, message_id: int, user_id: UUID, chat_id: int) -> Optional[MessageRead]:
-        # Check if already read
+    """
+    Read receipts are stored as a per-member watermark (ChatMember.last_read_message_id):
+    reading message N marks everything up to N in that chat as read.
+    """
+
+    async def mark_read(self, db: AsyncSession, message_id: int, user_id: UUID, chat_id: int) -> Optional[int]:
+        """
+        Advance the member's watermark to message_id (never moves backwards).
+        Returns the new watermark, or None if the user isn't a member or the message isn't in this chat.
+        """
         result = await db.execute(
-            select(MessageRead)
-            .filter(
-                MessageRead.message_id == message_id,
-                MessageRead.user_id == user_id
+            update(ChatMember)
+            .where(
+                ChatMember.chat_id == chat_id,
+                ChatMember.user_id == user_id,
+                exists().where(Message.id == message_id, Message.chat_id == chat_id)
             )
+            .values(
+                last_read_message_id=func.greatest(
+                    func.coalesce(ChatMember.last_read_message_id, 0), message_id
+                )
+            )
+            .returning(ChatMember.last_read_message_id)
         )
-        existing = result.scalars().first()
-        if existing:
-            return existing
-            
-        db_obj = MessageRead(
-            message_id=message_id,
-            user_id=user_id,
-            chat_id=chat_id,
-            status='read'
-        )
-        db.add(db_obj)
-        try:
-            await db.commit()
-            await db.refresh(db_obj)
-        except Exception:
-            await db.rollback()
-            # If constraint failed, it means race condition, so it exists
-            return await self.get(db, message_id, user_id)
-        return db_obj
+        last_read_message_id = result.scalar()
+        await db.commit()
+        return last_read_message_id
 
-    async def get(self, db: AsyncSession, message_id: int, user_id: UUID) -> Optional[MessageRead]:
+    async def get(self, db: AsyncSession, chat_id: int, user_id: UUID) -> Optional[int]:
         result = await db.execute(
-             select(MessageRead)
+            select(ChatMember.last_read_message_id)
             .filter(
-                MessageRead.message_id == message_id,
-                MessageRead.user_id == user_id
+                ChatMember.chat_id == chat_id,
+                ChatMember.user_id == user_id
             )
         )
-        return result.scalars().first()
+        return result.scalar()
 
 chat = CRUDChat()
 message = CRUDMessage()
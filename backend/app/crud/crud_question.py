@@ -0,0 +1,164 @@
+from typing import Any, List, Optional, Tuple
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from sqlalchemy import delete, func, insert, tuple_, update
+from sqlalchemy.sql import Select
+
+from app.models.assessment import Assessment, Question
+from app.models.course import Course
+from app.services.grading_service import compile_answer_key
+from app.services.template_cache_service import template_cache_service
+
+
+def _as_float(value: Any) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def question_rows(questions_data: dict) -> List[dict]:
+    """Index rows for a template ({"questions": [{"id", "text", "type", "difficulty", "category", "points", ...}]})."""
+    rows = []
+    for position, question in enumerate(questions_data.get("questions", [])):
+        if not isinstance(question, dict):
+            continue
+        rows.append({
+            "position": position,
+            "question_key": str(question["id"]) if question.get("id") is not None else None,
+            "text": question.get("text"),
+            "type": question.get("type"),
+            "difficulty": question.get("difficulty"),
+            "category": question.get("category"),
+            "points": _as_float(question.get("points")),
+            "data": question,
+        })
+    return rows
+
+
+def question_with_meta(question: dict, assessment: Assessment, course_title: str) -> dict:
+    """Question bank entry: the template question plus where it comes from."""
+    return {
+        **question,
+        "assessment_id": assessment.id,
+        "assessment_title": assessment.title,
+        "course_id": assessment.course_id,
+        "course_name": course_title,
+        "created_at": assessment.created_at.isoformat() if assessment.created_at else None
+    }
+
+
+class CRUDQuestion:
+    async def index_assessment(self, db: AsyncSession, *, assessment_id: int, questions_data: dict) -> int:
+        """Replace the assessment's indexed questions and answer key with the ones in questions_data."""
+        rows = question_rows(questions_data)
+        await db.execute(delete(Question).where(Question.assessment_id == assessment_id))
+        if rows:
+            await db.execute(insert(Question), [{**row, "assessment_id": assessment_id} for row in rows])
+        await db.execute(
+            update(Assessment)
+            .where(Assessment.id == assessment_id)
+            .values(questions_indexed_at=func.now(), answer_key=compile_answer_key(questions_data))
+        )
+        await db.commit()
+        return len(rows)
+
+    async def get_answer_key(self, db: AsyncSession, *, assessment: Assessment) -> Optional[dict]:
+        """
+        The assessment's compiled answer key. Assessments from before answer keys get theirs compiled
+        (and their questions indexed) from the template once. None if there is no template.
+        """
+        if assessment.answer_key is not None:
+            return assessment.answer_key
+        if not assessment.template_url:
+            return None
+        questions_data = await template_cache_service.get(assessment.template_url)
+        await self.index_assessment(db, assessment_id=assessment.id, questions_data=questions_data)
+        return compile_answer_key(questions_data)
+
+    async def get_unindexed(
+        self, db: AsyncSession, *, course_id: Optional[int] = None, assessment_ids: Optional[List[int]] = None
+    ) -> List[Tuple[Assessment, str]]:
+        """Assessments with a template whose questions were never extracted, with their course title."""
+        query = (
+            select(Assessment, Course.title)
+            .join(Course, Assessment.course_id == Course.id)
+            .filter(Assessment.questions_indexed_at.is_(None), Assessment.template_url.isnot(None))
+        )
+        if course_id:
+            query = query.filter(Assessment.course_id == course_id)
+        if assessment_ids is not None:
+            query = query.filter(Assessment.id.in_(assessment_ids))
+        result = await db.execute(query.order_by(Assessment.id))
+        return result.all()
+
+    def _filtered(
+        self,
+        query: Select,
+        *,
+        category: Optional[str] = None,
+        difficulty: Optional[str] = None,
+        question_type: Optional[str] = None,
+        course_id: Optional[int] = None,
+        search: Optional[str] = None,
+        assessment_ids: Optional[List[int]] = None,
+        exclude_assessment_ids: Optional[List[int]] = None,
+    ) -> Select:
+        query = query.join(Assessment, Question.assessment_id == Assessment.id)
+        if course_id:
+            query = query.filter(Assessment.course_id == course_id)
+        if assessment_ids is not None:
+            query = query.filter(Question.assessment_id.in_(assessment_ids))
+        if exclude_assessment_ids:
+            query = query.filter(Question.assessment_id.notin_(exclude_assessment_ids))
+        if difficulty:
+            query = query.filter(func.lower(Question.difficulty) == difficulty.lower())
+        if question_type:
+            query = query.filter(Question.type == question_type)
+        if category:
+            query = query.filter(func.lower(Question.category) == category.lower())
+        if search:
+            query = query.filter(Question.text.icontains(search, autoescape=True))
+        return query
+
+    async def search(
+        self,
+        db: AsyncSession,
+        *,
+        skip: int = 0,
+        limit: int = 100,
+        after: Optional[Tuple[int, int]] = None,
+        **filters,
+    ) -> Tuple[List[dict], Optional[Tuple[int, int]]]:
+        """
+        Question bank entries matching the filters, by assessment then template order.
+        Page with skip, or with after = the (assessment_id, position) key returned for the previous page.
+        Returns (entries, key of the last entry).
+        """
+        columns = (Question.assessment_id, Question.position, Question.data, Assessment, Course.title.label("course_title"))
+        query = self._filtered(select(*columns), **filters)
+        query = query.join(Course, Assessment.course_id == Course.id)
+        if after is not None:
+            query = query.filter(tuple_(Question.assessment_id, Question.position) > tuple_(*after))
+        else:
+            query = query.offset(skip)
+        result = await db.execute(query.order_by(Question.assessment_id, Question.position).limit(limit))
+        rows = result.all()
+        entries = [question_with_meta(row.data, row.Assessment, row.course_title) for row in rows]
+        return entries, ((rows[-1].assessment_id, rows[-1].position) if rows else None)
+
+    async def count(self, db: AsyncSession, **filters) -> int:
+        result = await db.execute(self._filtered(select(func.count(Question.id)), **filters))
+        return result.scalar()
+
+    async def get_by_key(self, db: AsyncSession, *, assessment_id: int, question_key: str) -> Optional[Question]:
+        result = await db.execute(
+            select(Question)
+            .filter(Question.assessment_id == assessment_id, Question.question_key == question_key)
+            .order_by(Question.position)
+            .limit(1)
+        )
+        return result.scalars().first()
+
+
+question = CRUDQuestion()
@@ -0,0 +1,52 @@
+from typing import AsyncIterator, List, Sequence, Tuple
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from sqlalchemy import Integer, column, update, values
+from sqlalchemy.engine import Row
+
+from app.models.assessment import AssessmentSubmission, QueuedSubmission
+
+
+class CRUDSubmission:
+    async def iter_responses(
+        self, db: AsyncSession, *, assessment_id: int, chunk_size: int = 2000
+    ) -> AsyncIterator[List[Row]]:
+        """(id, marks_obtained, response_data) of an assessment's submissions, chunk_size rows at a time by id."""
+        last_id = 0
+        while True:
+            result = await db.execute(
+                select(AssessmentSubmission.id, AssessmentSubmission.marks_obtained, AssessmentSubmission.response_data)
+                .filter(AssessmentSubmission.assessment_id == assessment_id, AssessmentSubmission.id > last_id)
+                .order_by(AssessmentSubmission.id)
+                .limit(chunk_size)
+            )
+            rows = result.all()
+            if not rows:
+                return
+            yield rows
+            last_id = rows[-1].id
+
+    async def set_marks(self, db: AsyncSession, *, marks: Sequence[Tuple[int, int]]) -> int:
+        """
+        Write (submission id, marks_obtained) pairs with a single UPDATE ... FROM (VALUES ...), and the
+        matching submission receipts. Not committed.
+        """
+        if not marks:
+            return 0
+        new_marks = values(column("id", Integer), column("marks", Integer), name="new_marks").data(list(marks))
+        result = await db.execute(
+            update(AssessmentSubmission)
+            .where(AssessmentSubmission.id == new_marks.c.id)
+            .values(marks_obtained=new_marks.c.marks)
+            .execution_options(synchronize_session=False)
+        )
+        await db.execute(
+            update(QueuedSubmission)
+            .where(QueuedSubmission.submission_id == new_marks.c.id)
+            .values(marks_obtained=new_marks.c.marks)
+            .execution_options(synchronize_session=False)
+        )
+        return result.rowcount
+
+
+submission = CRUDSubmission()
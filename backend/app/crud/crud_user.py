@@ -17,6 +17,7 @@ from app.models.parent_student import ParentStudent
 from app.models.assessment import AssessmentSubmission
 from app.schemas.user import UserCreate, UserUpdate
 from app.core.security import get_password_hash
+from app.services.chat_membership_service import chat_membership_service
 from sqlalchemy import delete, update
 
 class CRUDUser:
@@ -99,6 +100,7 @@ class CRUDUser:
 
         # 3. Chat Members
         await db.execute(delete(ChatMember).where(ChatMember.user_id == id))
+        chat_membership_service.invalidate()
 
         # 4. Messages (Sender) - This cascades to MessageReads usually, but better to be safe
         # Note: If we delete messages, we lose history. Ideally we'd validly anonymize, but for now delete.
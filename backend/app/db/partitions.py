@@ -0,0 +1,180 @@
+"""
+Monthly range partitions for the chat history tables.
+
+Partitions are named <table>_pYYYY_MM and cover [first of month, first of next month) in UTC.
+Helpers take a raw asyncpg connection, like the scripts in the backend root.
+"""
+import gzip
+import os
+import re
+from datetime import date
+from typing import List, Optional, Tuple
+
+import asyncpg
+
+# Partitioned table -> partition key column
+PARTITIONED_TABLES = {
+    "messages": "created_at",
+    "message_reads": "read_at",
+}
+
+
+def month_start(d: date) -> date:
+    return date(d.year, d.month, 1)
+
+
+def add_months(d: date, months: int) -> date:
+    month_index = d.year * 12 + (d.month - 1) + months
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def partition_name(table: str, month: date) -> str:
+    return f"{table}_p{month:%Y_%m}"
+
+
+async def default_partition(conn: asyncpg.Connection, table: str) -> Optional[str]:
+    """Name of table's DEFAULT partition, None if it has none."""
+    return await conn.fetchval(
+        """
+        SELECT d.relname FROM pg_partitioned_table pt
+        JOIN pg_class p ON p.oid = pt.partrelid
+        JOIN pg_class d ON d.oid = pt.partdefid
+        WHERE p.relname = $1
+        """,
+        table,
+    )
+
+
+async def _create_partition_from_default(
+    conn: asyncpg.Connection, table: str, name: str, default: str, lower: str, upper: str
+) -> int:
+    """
+    Create a monthly partition when the DEFAULT partition may already hold rows of that month
+    (CREATE TABLE ... PARTITION OF would fail then): build it as a plain table, move the month's
+    rows out of DEFAULT into it and attach it. Returns the number of rows moved.
+    The plain table has no triggers yet, so moved rows keep their values (e.g. messages.seq).
+    """
+    key = PARTITIONED_TABLES[table]
+    async with conn.transaction():
+        # Inserts routed to DEFAULT wait until the partition is attached
+        await conn.execute(f"LOCK TABLE {default} IN EXCLUSIVE MODE")
+        await conn.execute(f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING GENERATED)")
+        columns = await conn.fetch(
+            """
+            SELECT attname FROM pg_attribute
+            WHERE attrelid = to_regclass($1) AND attnum > 0 AND NOT attisdropped AND attgenerated = ''
+            ORDER BY attnum
+            """,
+            table,
+        )
+        column_list = ", ".join(f'"{column["attname"]}"' for column in columns)
+        in_range = f"{key} >= '{lower}' AND {key} < '{upper}'"
+        moved = await conn.fetchval(
+            f"WITH moved AS (DELETE FROM {default} WHERE {in_range} RETURNING {column_list}), "
+            f"inserted AS (INSERT INTO {name} ({column_list}) SELECT {column_list} FROM moved RETURNING 1) "
+            f"SELECT count(*) FROM inserted"
+        )
+        await conn.execute(f"ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM ('{lower}') TO ('{upper}')")
+    return moved
+
+
+async def ensure_monthly_partitions(conn: asyncpg.Connection, table: str, start: date, end: date) -> List[str]:
+    """
+    Create the missing monthly partitions from start's month up to (and including) end's month.
+    Rows of those months already in the DEFAULT partition are moved into the new partitions.
+    """
+    created = []
+    default = await default_partition(conn, table)
+    month = month_start(start)
+    while month <= month_start(end):
+        name = partition_name(table, month)
+        exists = await conn.fetchval("SELECT to_regclass($1)", name)
+        if not exists:
+            lower = f"{month.isoformat()} 00:00:00+00"
+            upper = f"{add_months(month, 1).isoformat()} 00:00:00+00"
+            if default:
+                moved = await _create_partition_from_default(conn, table, name, default, lower, upper)
+                if moved:
+                    print(f"  ↪️  Moved {moved} rows from {default} to {name}")
+            else:
+                await conn.execute(
+                    f"CREATE TABLE {name} PARTITION OF {table} FOR VALUES FROM ('{lower}') TO ('{upper}')"
+                )
+            created.append(name)
+        month = add_months(month, 1)
+    return created
+
+
+async def list_monthly_partitions(conn: asyncpg.Connection, table: str) -> List[Tuple[str, date]]:
+    """Attached monthly partitions of table, oldest first (the DEFAULT partition is skipped)."""
+    rows = await conn.fetch(
+        """
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        WHERE p.relname = $1
+        """,
+        table,
+    )
+    pattern = re.compile(rf"^{re.escape(table)}_p(\d{{4}})_(\d{{2}})$")
+    partitions = []
+    for row in rows:
+        match = pattern.match(row["relname"])
+        if match:
+            partitions.append((row["relname"], date(int(match.group(1)), int(match.group(2)), 1)))
+    return sorted(partitions, key=lambda p: p[1])
+
+
+async def list_detached_partitions(conn: asyncpg.Connection, table: str) -> List[Tuple[str, date]]:
+    """
+    Monthly partition tables of table that aren't attached anymore (left by an archive run that
+    failed before archive_partition exported before detaching), oldest first.
+    """
+    rows = await conn.fetch(
+        """
+        SELECT c.relname FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE c.relkind = 'r' AND NOT c.relispartition AND n.nspname = current_schema() AND c.relname LIKE $1
+        """,
+        f"{table}_p%",
+    )
+    pattern = re.compile(rf"^{re.escape(table)}_p(\d{{4}})_(\d{{2}})$")
+    partitions = []
+    for row in rows:
+        match = pattern.match(row["relname"])
+        if match:
+            partitions.append((row["relname"], date(int(match.group(1)), int(match.group(2)), 1)))
+    return sorted(partitions, key=lambda p: p[1])
+
+
+async def archive_partition(
+    conn: asyncpg.Connection, table: str, partition: str, out_dir: str, attached: bool = True
+) -> str:
+    """
+    Export a partition to <out_dir>/<partition>.csv.gz, then detach and drop it, in one transaction:
+    if the export fails the partition stays attached (data kept and still queried) and the error is raised.
+    Writes to the partition wait during the export (its month is over, there shouldn't be any),
+    the parent is only locked for the detach. attached=False archives a table list_detached_partitions found.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, f"{partition}.csv.gz")
+    temp_path = f"{path}.part"
+
+    try:
+        async with conn.transaction():
+            # Late writes would be lost between the export and the drop
+            await conn.execute(f"LOCK TABLE {partition} IN SHARE MODE")
+            with gzip.open(temp_path, "wb") as out:
+                async def write_chunk(chunk: bytes):
+                    out.write(chunk)
+
+                await conn.copy_from_table(partition, output=write_chunk, format="csv", header=True)
+            os.replace(temp_path, path)
+
+            if attached:
+                await conn.execute(f"ALTER TABLE {table} DETACH PARTITION {partition}")
+            await conn.execute(f"DROP TABLE {partition}")
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return path
@@ -2,6 +2,14 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.core.config import settings
 from app.api.v1.api import api_router
+from app.utils.websockets import manager
+from app.utils.presence import presence_tracker
+from app.services.chat_ingest_service import chat_ingest_service
+from app.services.read_receipt_service import read_receipt_service
+from app.services.download_proxy_service import download_proxy_service
+from app.services.resource_catalog_service import resource_catalog_service
+from app.services.template_cache_service import template_cache_service
+from app.services.submission_queue_service import submission_queue_service
 
 app = FastAPI(
     title=settings.PROJECT_NAME,
@@ -19,6 +27,27 @@ app.add_middleware(
 
 app.include_router(api_router, prefix=settings.API_V1_STR)
 
+@app.on_event("startup")
+async def start_chat_broker():
+    await manager.start()
+    await presence_tracker.start()
+    await chat_ingest_service.start()
+    await read_receipt_service.start()
+    await resource_catalog_service.start()
+    await submission_queue_service.start()
+
+@app.on_event("shutdown")
+async def stop_chat_broker():
+    # Flush queued messages while the broker can still broadcast them
+    await chat_ingest_service.stop()
+    await submission_queue_service.stop()
+    await read_receipt_service.stop()
+    await presence_tracker.stop()
+    await manager.stop()
+    await download_proxy_service.close()
+    await resource_catalog_service.stop()
+    await template_cache_service.close()
+
 @app.get("/")
 def root():
     return {"message": "Welcome to PJ005 Brainx Backend"}
@@ -1,7 +1,7 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Enum, Text
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Enum, Text, Float, Index, CheckConstraint
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.dialects.postgresql import UUID, JSONB
 import enum
 from app.db.base import Base
 
@@ -10,6 +10,12 @@ class AssessmentType(str, enum.Enum):
     quiz = "quiz"
     homework = "homework"
 
+class SubmissionStatus(str, enum.Enum):
+    queued = "queued"
+    processing = "processing"
+    graded = "graded"
+    failed = "failed"
+
 class Assessment(Base):
     __tablename__ = "assessments"
 
@@ -29,11 +35,17 @@ class Assessment(Base):
     shuffle_questions = Column(Integer, default=0)  # 0 = False, 1 = True (SQLite compatibility)
     show_results_immediately = Column(Integer, default=1)  # 0 = False, 1 = True
     assigned_to = Column(Text, default="entire_batch")  # "entire_batch" or JSON array of student IDs
+    # When the template's questions were last extracted into `questions` (NULL = not indexed yet)
+    questions_indexed_at = Column(DateTime(timezone=True), nullable=True)
+    # Compiled from the template with its questions (see grading_service.compile_answer_key)
+    answer_key = Column(JSONB, nullable=True)
 
     # Relationships
     course = relationship("Course", backref="assessments")
     batch = relationship("Batch", backref="assessments")
     submissions = relationship("AssessmentSubmission", back_populates="assessment")
+    questions = relationship("Question", back_populates="assessment", cascade="all, delete-orphan", passive_deletes=True)
+    assignments = relationship("AssessmentAssignment", back_populates="assessment", cascade="all, delete-orphan", passive_deletes=True)
 
 class AssessmentSubmission(Base):
     __tablename__ = "assessment_submissions"
@@ -47,3 +59,81 @@ class AssessmentSubmission(Base):
 
     assessment = relationship("Assessment", back_populates="submissions")
     student = relationship("User", backref="assessment_submissions")
+
+class Question(Base):
+    """One question of an assessment template, extracted so the question bank can be queried in SQL."""
+    __tablename__ = "questions"
+
+    id = Column(Integer, primary_key=True, index=True)
+    assessment_id = Column(Integer, ForeignKey("assessments.id", ondelete="CASCADE"), nullable=False)
+    position = Column(Integer, nullable=False)  # Index in the template's questions array
+    question_key = Column(String, nullable=True)  # The question's own "id" in the template
+    text = Column(Text, nullable=True)
+    type = Column(String, nullable=True)
+    difficulty = Column(String, nullable=True)
+    category = Column(String, nullable=True)
+    points = Column(Float, nullable=True)
+    data = Column(JSONB, nullable=False)  # The question as stored in the template
+
+    assessment = relationship("Assessment", back_populates="questions")
+
+    __table_args__ = (
+        Index("ux_questions_assessment_id_position", "assessment_id", "position", unique=True),
+        Index("ix_questions_assessment_id_question_key", "assessment_id", "question_key"),
+        Index("ix_questions_lower_difficulty", func.lower(difficulty)),
+        Index("ix_questions_type", "type"),
+        Index("ix_questions_lower_category", func.lower(category)),
+        # Substring search (ILIKE '%...%'), needs the pg_trgm extension
+        Index("ix_questions_text_trgm", "text", postgresql_using="gin", postgresql_ops={"text": "gin_trgm_ops"}),
+    )
+
+class AssessmentAssignment(Base):
+    """Who an assessment is assigned to: a whole batch, or one student (normalized from Assessment.assigned_to)."""
+    __tablename__ = "assessment_assignments"
+
+    id = Column(Integer, primary_key=True, index=True)
+    assessment_id = Column(Integer, ForeignKey("assessments.id", ondelete="CASCADE"), nullable=False)
+    batch_id = Column(Integer, ForeignKey("batches.id", ondelete="CASCADE"), nullable=True)
+    student_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), nullable=True)
+
+    assessment = relationship("Assessment", back_populates="assignments")
+
+    __table_args__ = (
+        CheckConstraint("(batch_id IS NULL) <> (student_id IS NULL)", name="ck_assessment_assignments_target"),
+        Index("ux_assessment_assignments_assessment_id_batch_id", "assessment_id", "batch_id", unique=True),
+        Index("ux_assessment_assignments_assessment_id_student_id", "assessment_id", "student_id", unique=True),
+        Index("ix_assessment_assignments_batch_id", "batch_id"),
+        Index("ix_assessment_assignments_student_id", "student_id"),
+    )
+
+class QueuedSubmission(Base):
+    """
+    A submission as accepted from the student, graded into an AssessmentSubmission by the
+    submission queue workers. At most one per student and assessment.
+    """
+    __tablename__ = "submission_queue"
+
+    id = Column(Integer, primary_key=True, index=True)
+    assessment_id = Column(Integer, ForeignKey("assessments.id", ondelete="CASCADE"), nullable=False)
+    student_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    idempotency_key = Column(String, nullable=False)  # Retries with the same key get the same receipt
+    answers = Column(Text, nullable=False)  # JSON string of student answers, copied to response_data
+    status = Column(Enum(SubmissionStatus), default=SubmissionStatus.queued, nullable=False)
+    attempts = Column(Integer, default=0, nullable=False)
+    error = Column(Text, nullable=True)
+    submission_id = Column(Integer, ForeignKey("assessment_submissions.id", ondelete="SET NULL"), nullable=True)
+    marks_obtained = Column(Integer, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    claimed_at = Column(DateTime(timezone=True), nullable=True)
+    graded_at = Column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        Index("ux_submission_queue_assessment_id_student_id", "assessment_id", "student_id", unique=True),
+        Index("ux_submission_queue_student_id_idempotency_key", "student_id", "idempotency_key", unique=True),
+        Index("ix_submission_queue_submission_id", "submission_id"),
+        # What the workers claim from
+        Index(
+            "ix_submission_queue_pending", "id",
+            postgresql_where=status.in_([SubmissionStatus.queued, SubmissionStatus.processing])
+        ),
+    )
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Date, DECIMAL, Boolean, DateTime, ForeignKey, Enum
+from sqlalchemy import Column, Integer, String, Date, DECIMAL, Boolean, DateTime, ForeignKey, Enum, Index
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from sqlalchemy.dialects.postgresql import UUID
@@ -53,3 +53,8 @@ class BatchMember(Base):
     batch = relationship("Batch", back_populates="members")
     user = relationship("User", foreign_keys=[user_id], backref="batch_memberships")
     system_role = relationship("Role", foreign_keys=[role_id])
+
+    __table_args__ = (
+        # A user's batches (assessments assigned to the student's batches)
+        Index("ix_batch_members_user_id_batch_id", "user_id", "batch_id"),
+    )
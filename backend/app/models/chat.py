@@ -1,6 +1,6 @@
-from sqlalchemy import Boolean, Column, Integer, String, ForeignKey, DateTime, Enum, Text
-from sqlalchemy.dialects.postgresql import UUID
-from sqlalchemy.orm import relationship
+from sqlalchemy import Boolean, Column, Integer, BigInteger, String, ForeignKey, DateTime, Enum, Text, Index, FetchedValue, Computed
+from sqlalchemy.dialects.postgresql import UUID, TSVECTOR
+from sqlalchemy.orm import relationship, deferred
 from sqlalchemy.sql import func
 import enum
 from app.db.base import Base
@@ -29,6 +29,10 @@ class Chat(Base):
     student_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=True)
     created_by = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Last message sequence number handed out in this chat (bumped by the messages_assign_seq trigger)
+    last_seq = Column(BigInteger, nullable=False, server_default="0")
+    # created_at of the chat's newest message, kept by the messages_assign_seq trigger
+    last_message_at = Column(DateTime(timezone=True), nullable=True)
 
     # Relationships
     batch = relationship("Batch", backref="chats")
@@ -47,6 +51,8 @@ class ChatMember(Base):
     role_id = Column(Integer, ForeignKey("roles.id"), nullable=True) # Ref schema
     role = Column(Enum(ChatMemberRoleEnum), nullable=False)
     joined_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Read watermark: every message in the chat with id <= this has been read by the member
+    last_read_message_id = Column(Integer, nullable=True)
 
     chat = relationship("Chat", back_populates="members")
     user = relationship("User", foreign_keys=[user_id])
@@ -61,31 +67,77 @@ class ChatMember(Base):
         return self.user.email if self.user else None
 
 class Message(Base):
+    # Range partitioned by month on created_at (see partition_chat_tables.py), so the
+    # primary key has to include created_at
     __tablename__ = "messages"
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True, autoincrement=True, index=True)
     chat_id = Column(Integer, ForeignKey("chats.id", ondelete="CASCADE"), nullable=False)
     batch_id = Column(Integer, ForeignKey("batches.id"), nullable=True) # Redundant if in chat, but in schema
     sender_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False)
     message = Column(Text, nullable=False)
     is_system_message = Column(Boolean, default=False)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Client-generated id, makes WebSocket send retries idempotent
+    client_msg_id = Column(String, nullable=True)
+    # Per-chat, monotonically increasing (gaps possible). Set by a DB trigger, see run_migration.py
+    seq = Column(BigInteger, nullable=True, server_default=FetchedValue())
+    # Full-text search document, generated by Postgres and GIN indexed
+    search_vector = deferred(Column(TSVECTOR, Computed("to_tsvector('english', message)", persisted=True)))
+    created_at = Column(DateTime(timezone=True), primary_key=True, server_default=func.now())
 
     chat = relationship("Chat", back_populates="messages")
     sender = relationship("User", foreign_keys=[sender_id])
-    reads = relationship("MessageRead", back_populates="message", cascade="all, delete-orphan")
+    reads = relationship(
+        "MessageRead",
+        primaryjoin="Message.id == foreign(MessageRead.message_id)",
+        back_populates="message",
+        cascade="all, delete-orphan"
+    )
+
+    __table_args__ = (
+        # Keyset pagination of a chat's history: WHERE chat_id = ? AND id < ? ORDER BY id DESC
+        Index("ix_messages_chat_id_id", "chat_id", "id"),
+        # Reconnect catch-up: WHERE chat_id = ? AND seq > ? ORDER BY seq
+        Index("ix_messages_chat_id_seq", "chat_id", "seq"),
+        Index("ix_messages_search_vector", "search_vector", postgresql_using="gin"),
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
+
+class MessageDedupKey(Base):
+    """
+    Idempotency keys of WebSocket messages (sender_id, client_msg_id). Kept out of `messages`
+    because a unique index on a partitioned table must include the partition key.
+    Purged after a day by archive_chat_partitions.py, retries happen within seconds.
+    """
+    __tablename__ = "message_dedup_keys"
+
+    sender_id = Column(UUID(as_uuid=True), primary_key=True)
+    client_msg_id = Column(String, primary_key=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
 
 class MessageRead(Base):
+    # Legacy per-message receipts, superseded by ChatMember.last_read_message_id.
+    # run_migration.py folds these rows into the watermarks and deletes them.
+    # Range partitioned by month on read_at, like messages.
     __tablename__ = "message_reads"
 
-    id = Column(Integer, primary_key=True, index=True)
-    message_id = Column(Integer, ForeignKey("messages.id", ondelete="CASCADE"), nullable=False)
+    id = Column(Integer, primary_key=True, autoincrement=True, index=True)
+    # No FK: a foreign key to the partitioned messages table would need created_at too
+    message_id = Column(Integer, nullable=False)
     user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False)
     chat_id = Column(Integer, ForeignKey("chats.id", ondelete="CASCADE"), nullable=False)
-    read_at = Column(DateTime(timezone=True), server_default=func.now())
+    read_at = Column(DateTime(timezone=True), primary_key=True, server_default=func.now())
     status = Column(Enum("delivered", "read", name="messagereadstatusenum"), default="read")
 
-    message = relationship("Message", back_populates="reads")
+    __table_args__ = (
+        {"postgresql_partition_by": "RANGE (read_at)"},
+    )
+
+    message = relationship(
+        "Message",
+        primaryjoin="foreign(MessageRead.message_id) == Message.id",
+        back_populates="reads"
+    )
     user = relationship("User", foreign_keys=[user_id])
     chat = relationship("Chat", foreign_keys=[chat_id])
     user = relationship("User", foreign_keys=[user_id])
@@ -100,7 +152,18 @@ class ChatResource(Base):
     file_url = Column(String, nullable=False)
     file_name = Column(String, nullable=False)
     file_type = Column(String, nullable=True) # e.g. 'image/jpeg', 'application/pdf'
+    # Object path in the storage zone (e.g. 'resources/groups/12/notes.pdf'), one row per stored file
+    storage_path = Column(String, nullable=True)
+    file_size = Column(BigInteger, nullable=True)
+    storage_guid = Column(String, nullable=True)
+    # Set by the reconciler when the file is gone from storage
+    deleted_at = Column(DateTime(timezone=True), nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
+    __table_args__ = (
+        Index("ux_chat_resources_storage_path", "storage_path", unique=True),
+        Index("ix_chat_resources_chat_id_created_at", "chat_id", "created_at"),
+    )
+
     chat = relationship("Chat", back_populates="resources")
     sender = relationship("User", foreign_keys=[sender_id])
@@ -1,7 +1,7 @@
 from pydantic import BaseModel
 from typing import Optional, List, Any, Dict
 from datetime import datetime
-from app.models.assessment import AssessmentType
+from app.models.assessment import AssessmentType, SubmissionStatus
 
 class AssessmentBase(BaseModel):
     title: str
@@ -59,6 +59,18 @@ class SubmissionResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class SubmissionReceipt(BaseModel):
+    """Answer to a submission: accepted into the queue, graded by the workers (see GET /submissions/receipts/{id})"""
+    receipt_id: int
+    status: SubmissionStatus
+    id: Optional[int] = None  # The AssessmentSubmission, once graded
+    assessment_id: int
+    student_id: str
+    marks_obtained: Optional[int] = None
+    submitted_at: datetime
+    show_results: bool = False
+    error: Optional[str] = None
+
 # New schemas for submission tracking
 class StudentSubmissionResponse(BaseModel):
     id: int
@@ -94,3 +106,40 @@ class AssessmentWithSubmissions(AssessmentResponse):
     submitted_count: int
     pending_count: int
     average_score: Optional[float] = None
+
+class RegradeResponse(BaseModel):
+    assessment_id: int
+    regraded: int  # Submissions scored
+    changed: int  # Submissions whose marks changed
+
+# Item analytics
+class AnswerFrequency(BaseModel):
+    answer: Any
+    count: int
+    correct: bool
+
+class QuestionAnalytics(BaseModel):
+    question_id: str
+    text: Optional[str] = None
+    kind: str  # "exact", "multi" or "numeric"
+    points: float
+    answered: int
+    unanswered: int
+    p_value: Optional[float] = None  # Share of submissions that got it right
+    discrimination: Optional[float] = None  # p-value of the top 27% minus the bottom 27%
+    answers: List[AnswerFrequency]  # Most frequent answers first
+
+class ScoreBin(BaseModel):
+    start: float
+    end: float
+    count: int
+
+class AssessmentAnalytics(BaseModel):
+    assessment_id: int
+    submission_count: int
+    mean_percentage: Optional[float] = None
+    median_percentage: Optional[float] = None
+    std_percentage: Optional[float] = None
+    histogram: List[ScoreBin]
+    questions: List[QuestionAnalytics]
+    computed_at: datetime
@@ -1,4 +1,4 @@
-from typing import Optional, List, Union
+from typing import Optional, List, Union, Dict
 from datetime import datetime
 from uuid import UUID
 from pydantic import BaseModel
@@ -12,12 +12,15 @@ class MessageBase(BaseModel):
 class MessageCreate(MessageBase):
     chat_id: int
     batch_id: Optional[int] = None
+    client_msg_id: Optional[str] = None
 
 class MessageInDBBase(MessageBase):
     id: int
     chat_id: int
     batch_id: Optional[int] = None
     sender_id: UUID
+    client_msg_id: Optional[str] = None
+    seq: Optional[int] = None
     created_at: datetime
 
     class Config:
@@ -28,6 +31,14 @@ class Message(MessageInDBBase):
     status: Optional[str] = "sent" # sent, delivered, read
     read_count: Optional[int] = 0
 
+class MessageSearchResult(MessageInDBBase):
+    rank: float
+
+class MessageSearchPage(BaseModel):
+    results: List[MessageSearchResult]
+    # Pass back as ?cursor= to get the next page, None when there are no more results
+    next_cursor: Optional[str] = None
+
 # --- Message Read Schemas ---
 class MessageReadBase(BaseModel):
     message_id: int
@@ -45,6 +56,22 @@ class MessageRead(MessageReadBase):
     class Config:
         from_attributes = True
 
+# --- Read Watermark Schemas ---
+class ChatReadUpdate(BaseModel):
+    up_to_message_id: Optional[int] = None
+    # Ids of the messages on screen, marks up to the highest one
+    message_ids: List[int] = []
+
+class ChatReadState(BaseModel):
+    chat_id: int
+    user_id: UUID
+    last_read_message_id: Optional[int] = None
+
+class ChatPresence(BaseModel):
+    chat_id: int
+    online: List[UUID] = []
+    typing: List[UUID] = []
+
 # --- Chat Member Schemas ---
 class ChatMemberBase(BaseModel):
     user_id: UUID
@@ -122,6 +149,7 @@ class BatchSimple(BaseModel):
 class Chat(ChatInDBBase):
     members: List[ChatMember] = []
     latest_message: Optional[Message] = None
+    unread_count: int = 0
     batch: Optional[BatchSimple] = None
 
 # --- Resource Schemas ---
@@ -131,13 +159,21 @@ class ChatResourceBase(BaseModel):
     file_type: Optional[str] = None
 
 class ChatResourceCreate(ChatResourceBase):
-    pass
+    storage_path: Optional[str] = None
+    file_size: Optional[int] = None
 
 class ChatResource(ChatResourceBase):
     id: int
     chat_id: int
     sender_id: UUID
+    file_size: Optional[int] = None
     created_at: datetime
     
     class Config:
         from_attributes = True
+
+class ChatResourceSummary(BaseModel):
+    chat_id: int
+    total: int = 0
+    # file_type -> count ("unknown" when the type wasn't recorded)
+    by_type: Dict[str, int] = {}
@@ -0,0 +1,97 @@
+import json
+from typing import Any, Dict, Hashable, List, Optional
+
+import numpy as np
+
+from app.services.grading_service import as_float
+
+UNANSWERED = -1
+
+
+def parse_response_data(response_data: Optional[str]) -> Dict[str, Any]:
+    """AssessmentSubmission.response_data (JSON object of question id -> answer), {} if missing or unreadable."""
+    try:
+        answers = json.loads(response_data) if response_data else {}
+    except ValueError:
+        return {}
+    return answers if isinstance(answers, dict) else {}
+
+
+def _hashable(value: Any) -> Hashable:
+    if isinstance(value, list):
+        return tuple(_hashable(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, _hashable(v)) for k, v in value.items()))
+    return value
+
+
+class AnswerMatrix:
+    """
+    Submissions × questions of one assessment, encoded once so they can be scored and analysed with NumPy.
+
+    codes[i, j] is the index of submission i's answer to question j in choices[j] (UNANSWERED if none),
+    equal answers share a code (multi-select answers compare as sets, like grading_service.is_correct).
+    values holds the answers to numeric questions as floats (NaN if missing or not a number).
+    Columns follow the answer key's question order.
+    """
+
+    def __init__(self, answer_key: dict, responses: List[Dict[str, Any]]):
+        self.items = answer_key["questions"]
+        n, q = len(responses), len(self.items)
+        self.points = np.array([item["points"] for item in self.items], dtype=np.float64)
+        self.codes = np.full((n, q), UNANSWERED, dtype=np.int32)
+        self.values = np.full((n, q), np.nan, dtype=np.float64)
+        self.choices: List[List[Any]] = []
+        self._lookups: List[Dict[Hashable, int]] = []
+
+        for j, item in enumerate(self.items):
+            lookup: Dict[Hashable, int] = {}
+            choices: List[Any] = []
+            numeric = item["kind"] == "numeric"
+            column = self.codes[:, j]
+            for i, answers in enumerate(responses):
+                answer = answers.get(item["id"])
+                if answer is None:
+                    continue
+                if item["kind"] == "multi":
+                    answer = sorted(answer if isinstance(answer, list) else [answer], key=str)
+                key = _hashable(answer)
+                code = lookup.get(key)
+                if code is None:
+                    code = lookup[key] = len(choices)
+                    choices.append(answer)
+                column[i] = code
+                if numeric:
+                    number = as_float(answer)
+                    if number is not None:
+                        self.values[i, j] = number
+            self.choices.append(choices)
+            self._lookups.append(lookup)
+
+    def correct(self) -> np.ndarray:
+        """Boolean submissions × questions matrix: answer matches the key."""
+        correct = np.zeros(self.codes.shape, dtype=bool)
+        exact = [j for j, item in enumerate(self.items) if item["kind"] != "numeric"]
+        numeric = [j for j, item in enumerate(self.items) if item["kind"] == "numeric"]
+        if exact:
+            keys = np.array([self.code_of(j, self.items[j]["answer"]) for j in exact], dtype=np.int32)
+            correct[:, exact] = self.codes[:, exact] == keys
+        if numeric:
+            answers = np.array([self.items[j]["answer"] for j in numeric], dtype=np.float64)
+            tolerances = np.array([self.items[j]["tolerance"] for j in numeric], dtype=np.float64)
+            with np.errstate(invalid="ignore"):
+                # NaN (unanswered) compares False
+                correct[:, numeric] = np.abs(self.values[:, numeric] - answers) <= tolerances
+        return correct
+
+    def scores(self, correct: Optional[np.ndarray] = None) -> np.ndarray:
+        """Points earned by each submission."""
+        if correct is None:
+            correct = self.correct()
+        return correct.astype(np.float64) @ self.points
+
+    def code_of(self, j: int, answer: Any) -> int:
+        """Code of an answer to question j, -2 (matches nothing) if nobody gave it."""
+        if answer is None:
+            return -2
+        return self._lookups[j].get(_hashable(answer), -2)
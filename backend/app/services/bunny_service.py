@@ -45,12 +45,15 @@ class BunnyService:
                 # raise Exception(f"Failed to upload to Bunny.net: {response.text}")
 
 
-    async def list_files(self, path: str) -> list:
+    async def list_files(self, path: str, strict: bool = False) -> list:
         """
         List files in a directory on Bunny.net storage.
         path: Directory path (e.g. 'resources/groups/123/')
+        strict: raise on errors, including missing configuration, instead of returning [] (a missing directory is still [])
         """
         if not self.api_key or not self.storage_zone:
+            if strict:
+                raise Exception("Bunny.net configuration missing")
             print("Bunny.net configuration missing. Skipping list_files.")
             return []
 
@@ -68,15 +71,22 @@ class BunnyService:
             try:
                 response = await client.get(url, headers=headers)
                 if response.status_code == 200:
-                    return response.json()
+                    listing = response.json()
+                    if strict and not isinstance(listing, list):
+                        raise Exception("Unexpected listing from Bunny.net")
+                    return listing
                 elif response.status_code == 404:
                      # Directory likely doesn't exist yet
                     return []
                 else:
                     print(f"Failed to list files from Bunny.net: {response.status_code} - {response.text}")
+                    if strict:
+                        raise Exception(f"Failed to list files from Bunny.net: {response.status_code}")
                     return []
             except Exception as e:
                 print(f"Error listing files: {e}")
+                if strict:
+                    raise
                 return []
 
     async def download_json(self, url: str) -> dict:
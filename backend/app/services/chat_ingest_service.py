@@ -0,0 +1,196 @@
+import asyncio
+from dataclasses import dataclass
+from typing import List, Optional
+from uuid import UUID
+
+from fastapi import WebSocket
+from sqlalchemy.dialects.postgresql import insert
+
+from app.db.session import AsyncSessionLocal
+from app.models.chat import Message, MessageDedupKey
+from app.utils.websockets import manager
+
+# Queued by stop(): _run flushes what it holds and exits when it gets this
+_STOP = object()
+
+
+def message_event(msg) -> dict:
+    """WebSocket payload for a persisted message (ORM object or RETURNING row)."""
+    return {
+        "id": msg.id,
+        "seq": msg.seq,
+        "message": msg.message,
+        "sender_id": str(msg.sender_id),
+        "chat_id": msg.chat_id,
+        "created_at": msg.created_at.isoformat(),
+        "client_msg_id": msg.client_msg_id,
+        "status": "sent"
+    }
+
+
+@dataclass
+class PendingMessage:
+    chat_id: int
+    sender_id: UUID
+    message: str
+    batch_id: Optional[int] = None
+    client_msg_id: Optional[str] = None
+    # Socket the message came from, told when it can't be persisted
+    websocket: Optional[WebSocket] = None
+
+
+class ChatIngestService:
+    """
+    Write-behind persistence for WebSocket chat messages.
+    Messages are queued, flushed to `messages` in one multi-row INSERT ... RETURNING
+    every `flush_interval` seconds (or as soon as `max_batch` are waiting), then broadcast
+    with their database ids. Retries carrying the same client_msg_id are dropped by
+    claiming the key in message_dedup_keys within the same transaction.
+    When the batch INSERT fails its messages are written one by one, so a single bad row
+    only costs its own message; the sender of that one gets a "failed" ack.
+    """
+
+    def __init__(self, flush_interval: float = 0.02, max_batch: int = 500, max_pending: int = 10000):
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    async def start(self):
+        if self._task is None:
+            self._queue = asyncio.Queue(maxsize=self.max_pending)
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            # No cancel(): the batch _run holds was already acknowledged, let it be flushed first
+            if not self._task.done():
+                await self._queue.put(_STOP)
+            await self._task
+            self._task = None
+            # Submitted while stopping
+            while not self._queue.empty():
+                await self._flush(self._drain(self.max_batch))
+
+    async def submit(self, pending: PendingMessage):
+        """Queue a message for persistence. Only waits when the queue is full (backpressure)."""
+        await self.start()
+        await self._queue.put(pending)
+
+    def _drain(self, limit: int) -> List[PendingMessage]:
+        items = []
+        while len(items) < limit and not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is _STOP:
+                self._stopping = True
+                break
+            items.append(item)
+        return items
+
+    async def _run(self):
+        self._stopping = False
+        while not self._stopping:
+            first = await self._queue.get()
+            if first is _STOP:
+                break
+            # Give the burst a few ms to build up, unless a full batch is already waiting
+            if self._queue.qsize() < self.max_batch - 1:
+                await asyncio.sleep(self.flush_interval)
+            batch = [first] + self._drain(self.max_batch - 1)
+            try:
+                await self._flush(batch)
+            except Exception as e:
+                print(f"Chat message flush failed: {e}")
+
+    async def _flush(self, batch: List[PendingMessage]):
+        # Same key twice in one batch: keep the first one
+        seen = set()
+        unique_batch = []
+        for p in batch:
+            key = (p.sender_id, p.client_msg_id)
+            if p.client_msg_id and key in seen:
+                continue
+            seen.add(key)
+            unique_batch.append(p)
+        # Rows in chat_id order (stable, so each chat keeps its arrival order): the seq trigger
+        # locks the chats' counters in that order in every worker, which can't deadlock
+        batch = sorted(unique_batch, key=lambda p: p.chat_id)
+
+        rows = []
+        try:
+            rows = await self._persist(batch)
+        except Exception as e:
+            print(f"Failed to persist {len(batch)} chat messages as a batch, retrying one by one: {e}")
+            for p in batch:
+                try:
+                    rows.extend(await self._persist([p]))
+                except Exception as e:
+                    print(f"Failed to persist chat message from {p.sender_id} in chat {p.chat_id}: {e}")
+                    self._nack(p)
+
+        for row in rows:
+            try:
+                await manager.broadcast(message_event(row), row.chat_id)
+            except Exception as e:
+                print(f"Failed to broadcast message {row.id} to chat {row.chat_id}: {e}")
+
+    async def _persist(self, batch: List[PendingMessage]) -> list:
+        """Claim the keys and insert the messages in one transaction, RETURNING rows of the new ones."""
+        async with AsyncSessionLocal() as db:
+            keyed = [p for p in batch if p.client_msg_id]
+            if keyed:
+                # Claim the idempotency keys, already claimed ones are retries of persisted messages
+                claimed = await db.execute(
+                    insert(MessageDedupKey)
+                    .values([{"sender_id": p.sender_id, "client_msg_id": p.client_msg_id} for p in keyed])
+                    .on_conflict_do_nothing()
+                    .returning(MessageDedupKey.sender_id, MessageDedupKey.client_msg_id)
+                )
+                fresh = {tuple(row) for row in claimed.all()}
+                batch = [p for p in batch if not p.client_msg_id or (p.sender_id, p.client_msg_id) in fresh]
+
+            rows = []
+            if batch:
+                result = await db.execute(self._insert_messages(batch))
+                rows = result.all()
+            await db.commit()
+        return rows
+
+    def _nack(self, p: PendingMessage):
+        # Untagged messages can't be matched by the client, and aren't acked either
+        if p.websocket is None or not p.client_msg_id:
+            return
+        try:
+            manager.send_personal({
+                "type": "ack",
+                "chat_id": p.chat_id,
+                "client_msg_id": p.client_msg_id,
+                "status": "failed"
+            }, p.websocket)
+        except Exception as e:
+            print(f"Failed to nack message {p.client_msg_id}: {e}")
+
+    def _insert_messages(self, batch: List[PendingMessage]):
+        return (
+            insert(Message)
+            .values([
+                {
+                    "chat_id": p.chat_id,
+                    "batch_id": p.batch_id,
+                    "sender_id": p.sender_id,
+                    "message": p.message,
+                    "is_system_message": False,
+                    "client_msg_id": p.client_msg_id,
+                }
+                for p in batch
+            ])
+            .returning(
+                Message.id, Message.seq, Message.chat_id, Message.sender_id, Message.message,
+                Message.created_at, Message.client_msg_id
+            )
+        )
+
+
+chat_ingest_service = ChatIngestService()
@@ -0,0 +1,79 @@
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Optional, Set
+from uuid import UUID
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.models.chat import Chat, ChatMember, ChatTypeEnum
+
+
+@dataclass
+class ChatAccess:
+    chat_type: ChatTypeEnum
+    member_ids: Set[UUID] = field(default_factory=set)
+    expires_at: float = 0.0
+
+
+class ChatMembershipService:
+    """
+    In-process index chat_id -> member user ids, used for authorization checks instead of
+    loading the chat with all its members. Entries expire after `ttl` seconds (which bounds
+    staleness across workers) and are updated write-through by CRUDChat.create / add_member.
+    """
+
+    def __init__(self, ttl: float = 60.0, max_chats: int = 10000):
+        self.ttl = ttl
+        self.max_chats = max_chats
+        self._entries: "OrderedDict[int, ChatAccess]" = OrderedDict()
+
+    async def get(self, db: AsyncSession, chat_id: int) -> Optional[ChatAccess]:
+        """Chat type and member ids, or None if the chat doesn't exist."""
+        entry = self._entries.get(chat_id)
+        if entry and entry.expires_at > time.monotonic():
+            self._entries.move_to_end(chat_id)
+            return entry
+
+        # Chat row plus member ids in one query
+        result = await db.execute(
+            select(Chat.chat_type, ChatMember.user_id)
+            .outerjoin(ChatMember, ChatMember.chat_id == Chat.id)
+            .filter(Chat.id == chat_id)
+        )
+        rows = result.all()
+        if not rows:
+            self.invalidate(chat_id)
+            return None
+        return self.set(chat_id, rows[0].chat_type, {row.user_id for row in rows if row.user_id})
+
+    async def is_member(self, db: AsyncSession, chat_id: int, user_id: UUID) -> Optional[bool]:
+        """None if the chat doesn't exist."""
+        entry = await self.get(db, chat_id)
+        if entry is None:
+            return None
+        return user_id in entry.member_ids
+
+    def set(self, chat_id: int, chat_type: ChatTypeEnum, member_ids: Set[UUID]) -> ChatAccess:
+        entry = ChatAccess(chat_type=chat_type, member_ids=set(member_ids), expires_at=time.monotonic() + self.ttl)
+        self._entries[chat_id] = entry
+        self._entries.move_to_end(chat_id)
+        if len(self._entries) > self.max_chats:
+            self._entries.popitem(last=False)
+        return entry
+
+    def add_member(self, chat_id: int, user_id: UUID):
+        entry = self._entries.get(chat_id)
+        if entry:
+            entry.member_ids.add(user_id)
+
+    def invalidate(self, chat_id: Optional[int] = None):
+        """Drop one chat, or everything when chat_id is None."""
+        if chat_id is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(chat_id, None)
+
+
+chat_membership_service = ChatMembershipService()
@@ -0,0 +1,275 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Dict, Mapping, Optional, Set
+
+import aiohttp
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, Response, StreamingResponse
+
+from app.core.config import settings
+
+# Forwarded to the CDN so it can answer with 206 / 304 itself
+PASSTHROUGH_REQUEST_HEADERS = ("range", "if-range", "if-none-match", "if-modified-since")
+PASSTHROUGH_RESPONSE_HEADERS = (
+    "content-length", "content-range", "accept-ranges", "etag", "last-modified", "content-encoding"
+)
+# Bodies are relayed and cached as is (auto_decompress=False): ask for the file's own bytes
+UPSTREAM_ENCODING = {"Accept-Encoding": "identity"}
+
+CHUNK_SIZE = 256 * 1024
+
+
+def _remove_file(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+@dataclass
+class CachedFile:
+    path: str
+    etag: str
+    size: int
+    validated_at: float
+
+
+class DiskCache:
+    """
+    Downloaded files on local disk, shared by every worker process using the same directory.
+
+    Each URL is stored as <sha256(url)> plus a <sha256(url)>.json sidecar holding its URL, ETag
+    and size, so any process finds what another one downloaded and nothing has to be rebuilt at
+    startup. The byte limit is enforced against what's actually in the directory (temp files of
+    downloads in progress included), least recently served files (mtime) are evicted first.
+    When each entry was last revalidated is only tracked per process.
+    """
+
+    # Temp files untouched for this long belong to a download whose process died
+    STALE_TEMP_AFTER = 3600
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        # A single file may take at most this much of the cache
+        self.max_file_bytes = max_bytes // 4
+        self._validated_at: Dict[str, float] = {}
+        os.makedirs(directory, exist_ok=True)
+        self._remove_stale_temp_files()
+
+    def _path(self, url: str) -> str:
+        return os.path.join(self.directory, hashlib.sha256(url.encode()).hexdigest())
+
+    def get(self, url: str) -> Optional[CachedFile]:
+        path = self._path(url)
+        try:
+            with open(f"{path}.json") as f:
+                meta = json.load(f)
+            size = os.path.getsize(path)
+        except (OSError, ValueError):
+            return None
+        if meta.get("url") != url or meta.get("size") != size:
+            # Half-written by another process, or a hash collision: treat as a miss
+            return None
+        try:
+            # Recency for eviction, shared by all processes
+            os.utime(path)
+        except OSError:
+            pass
+        return CachedFile(path=path, etag=meta["etag"], size=size, validated_at=self._validated_at.get(url, 0.0))
+
+    def mark_validated(self, url: str):
+        self._validated_at[url] = time.monotonic()
+
+    def temp_path(self) -> str:
+        return os.path.join(self.directory, f"{os.getpid()}-{uuid.uuid4().hex}.part")
+
+    def put(self, url: str, etag: str, temp_path: str, size: int) -> CachedFile:
+        """Move a fully downloaded temp file into the cache."""
+        path = self._path(url)
+        os.replace(temp_path, path)
+        meta_temp = f"{self.temp_path()}.json"
+        with open(meta_temp, "w") as f:
+            json.dump({"url": url, "etag": etag, "size": size}, f)
+        os.replace(meta_temp, f"{path}.json")
+        self.mark_validated(url)
+        self._enforce_limit(keep=path)
+        return CachedFile(path=path, etag=etag, size=size, validated_at=self._validated_at[url])
+
+    def discard(self, url: str):
+        path = self._path(url)
+        self._validated_at.pop(url, None)
+        _remove_file(f"{path}.json")
+        _remove_file(path)
+
+    def _enforce_limit(self, keep: str):
+        files = []
+        total = 0
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                total += stat.st_size
+                if entry.is_file() and not entry.name.endswith((".json", ".part")) and entry.path != keep:
+                    files.append((stat.st_mtime, entry.path, stat.st_size))
+        for _, path, size in sorted(files):
+            if total <= self.max_bytes:
+                break
+            _remove_file(f"{path}.json")
+            _remove_file(path)
+            total -= size
+
+    def _remove_stale_temp_files(self):
+        cutoff = time.time() - self.STALE_TEMP_AFTER
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if ".part" not in entry.name:
+                    continue
+                try:
+                    if entry.stat().st_mtime < cutoff:
+                        _remove_file(entry.path)
+                except OSError:
+                    continue
+
+
+class DownloadProxyService:
+    """
+    Proxies CDN downloads through one shared keep-alive connection pool.
+    Range / conditional headers are passed through to the CDN. With PROXY_CACHE_DIR set,
+    complete downloads are also kept in a DiskCache (shared by the worker processes) and repeat
+    downloads are served from local disk (Range included), revalidated with a HEAD every
+    `revalidate_after` seconds. Disk cache I/O runs in the threadpool, off the event loop.
+    """
+
+    def __init__(self, max_connections: int = 100, revalidate_after: float = 60.0):
+        self.max_connections = max_connections
+        self.revalidate_after = revalidate_after
+        self.cache = (
+            DiskCache(settings.PROXY_CACHE_DIR, settings.PROXY_CACHE_MAX_BYTES)
+            if settings.PROXY_CACHE_DIR else None
+        )
+        # URLs currently being written to the cache, concurrent misses just stream through
+        self._filling: Set[str] = set()
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections, ttl_dns_cache=300, keepalive_timeout=60),
+                # No total timeout: large files may legitimately take long
+                timeout=aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=60),
+                auto_decompress=False,
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def download(self, url: str, request_headers: Mapping[str, str], filename: str) -> Response:
+        disposition = {"Content-Disposition": f'attachment; filename="{filename}"'}
+
+        cached = await self._cached(url)
+        if cached:
+            if request_headers.get("if-none-match") == cached.etag:
+                return Response(status_code=304, headers={"ETag": cached.etag})
+            # FileResponse answers Range / If-Range requests from the file itself
+            return FileResponse(
+                cached.path,
+                media_type="application/octet-stream",
+                headers={**disposition, "ETag": cached.etag},
+            )
+
+        upstream_headers = {h: request_headers[h] for h in PASSTHROUGH_REQUEST_HEADERS if h in request_headers}
+        try:
+            upstream = await self.session().get(url, headers={**upstream_headers, **UPSTREAM_ENCODING})
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise HTTPException(status_code=502, detail=f"CDN unreachable: {e}")
+        if upstream.status == 304:
+            upstream.release()
+            return Response(status_code=304, headers={"ETag": upstream.headers.get("ETag", "")})
+        if upstream.status not in (200, 206):
+            upstream.release()
+            raise HTTPException(status_code=404, detail="File not found or upstream error")
+
+        headers = {h: upstream.headers[h] for h in PASSTHROUGH_RESPONSE_HEADERS if h in upstream.headers}
+        return StreamingResponse(
+            self._stream(url, upstream),
+            status_code=upstream.status,
+            media_type="application/octet-stream",
+            headers={**headers, **disposition},
+        )
+
+    async def _cached(self, url: str) -> Optional[CachedFile]:
+        if self.cache is None:
+            return None
+        entry = await run_in_threadpool(self.cache.get, url)
+        if entry is None or time.monotonic() - entry.validated_at < self.revalidate_after:
+            return entry
+        try:
+            async with self.session().head(url, headers=UPSTREAM_ENCODING) as response:
+                etag = response.headers.get("ETag")
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            # CDN unreachable: the copy we have is better than nothing
+            return entry
+        if etag != entry.etag:
+            await run_in_threadpool(self.cache.discard, url)
+            return None
+        self.cache.mark_validated(url)
+        return entry
+
+    def _should_fill(self, url: str, upstream: aiohttp.ClientResponse) -> bool:
+        return (
+            self.cache is not None
+            and upstream.status == 200
+            # A CDN that compressed anyway: relayed with its Content-Encoding, never cached
+            and upstream.headers.get("Content-Encoding", "identity").lower() == "identity"
+            and url not in self._filling
+            and upstream.headers.get("ETag") is not None
+            and upstream.content_length is not None
+            and upstream.content_length <= self.cache.max_file_bytes
+        )
+
+    async def _stream(self, url: str, upstream: aiohttp.ClientResponse):
+        filling = self._should_fill(url, upstream)
+        temp_path = None
+        out = None
+        written = 0
+        if filling:
+            self._filling.add(url)
+            temp_path = self.cache.temp_path()
+        try:
+            if filling:
+                out = await run_in_threadpool(open, temp_path, "wb")
+            async for chunk in upstream.content.iter_chunked(CHUNK_SIZE):
+                if out:
+                    await run_in_threadpool(out.write, chunk)
+                    written += len(chunk)
+                yield chunk
+            if out:
+                await run_in_threadpool(out.close)
+                out = None
+                if written == upstream.content_length:
+                    await run_in_threadpool(self.cache.put, url, upstream.headers["ETag"], temp_path, written)
+                    temp_path = None
+        finally:
+            upstream.release()
+            if out:
+                await run_in_threadpool(out.close)
+            if temp_path:
+                # Client went away or the download broke off: don't keep a partial file
+                await run_in_threadpool(_remove_file, temp_path)
+            if filling:
+                self._filling.discard(url)
+
+
+download_proxy_service = DownloadProxyService()
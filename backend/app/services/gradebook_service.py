@@ -0,0 +1,197 @@
+import csv
+import io
+import zipfile
+from typing import Any, AsyncIterator, Iterable, List, Sequence
+from xml.sax.saxutils import escape
+
+from sqlalchemy import and_
+from sqlalchemy.future import select
+
+from app.db.session import AsyncSessionLocal
+from app.models.assessment import Assessment, AssessmentSubmission
+from app.models.batch import BatchMember, BatchMemberRole
+from app.models.user import User
+
+# Rows fetched per round trip from the server-side cursor / written before the output is flushed
+FETCH_SIZE = 1000
+FLUSH_ROWS = 200
+
+XLSX_STATIC_PARTS = {
+    "[Content_Types].xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    "_rels/.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    "xl/workbook.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Gradebook" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    ),
+    "xl/_rels/workbook.xml.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'
+    ),
+}
+
+
+class _DrainBuffer(io.RawIOBase):
+    """Write-only, non-seekable sink: what's been written so far is taken out with drain()."""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _xlsx_cell(value: Any) -> str:
+    if value is None:
+        return "<c/>"
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return f"<c><v>{value}</v></c>"
+    return f'<c t="inlineStr"><is><t>{escape(str(value))}</t></is></c>'
+
+
+def _xlsx_row(values: Iterable[Any]) -> bytes:
+    return ("<row>" + "".join(_xlsx_cell(value) for value in values) + "</row>").encode()
+
+
+async def stream_csv(header: Sequence[str], rows: AsyncIterator[List[Any]]) -> AsyncIterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    yield buffer.getvalue().encode()
+    buffer.seek(0)
+    buffer.truncate()
+
+    pending = 0
+    async for row in rows:
+        writer.writerow(["" if value is None else value for value in row])
+        pending += 1
+        if pending >= FLUSH_ROWS:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    yield buffer.getvalue().encode()
+
+
+async def stream_xlsx(header: Sequence[str], rows: AsyncIterator[List[Any]]) -> AsyncIterator[bytes]:
+    """
+    A single-sheet XLSX written as it goes: zipfile writes to the non-seekable buffer with data
+    descriptors, so each chunk of the zip can be sent as soon as it's compressed.
+    """
+    sink = _DrainBuffer()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as workbook:
+        for name, content in XLSX_STATIC_PARTS.items():
+            workbook.writestr(name, content)
+        with workbook.open("xl/worksheets/sheet1.xml", "w", force_zip64=True) as sheet:
+            sheet.write(
+                b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+            )
+            sheet.write(_xlsx_row(header))
+            yield sink.drain()
+
+            pending = 0
+            async for row in rows:
+                sheet.write(_xlsx_row(row))
+                pending += 1
+                if pending >= FLUSH_ROWS:
+                    # Empty until the compressor has a block ready
+                    chunk = sink.drain()
+                    if chunk:
+                        yield chunk
+                    pending = 0
+            sheet.write(b"</sheetData></worksheet>")
+    yield sink.drain()
+
+
+async def gradebook_rows(batch_ids: List[int], assessments: List[Assessment]) -> AsyncIterator[List[Any]]:
+    """
+    [student name, email, marks per assessment..., total, percentage] for every student of the batches,
+    read through a server-side cursor one student at a time (rows arrive grouped by student).
+    """
+    column = {assessment.id: index for index, assessment in enumerate(assessments)}
+    total_marks = sum(assessment.total_marks or 0 for assessment in assessments)
+    students = (
+        select(BatchMember.user_id)
+        .filter(BatchMember.batch_id.in_(batch_ids), BatchMember.role == BatchMemberRole.student)
+        .distinct()
+        .subquery()
+    )
+    stmt = (
+        select(User.id, User.full_name, User.email, AssessmentSubmission.assessment_id, AssessmentSubmission.marks_obtained)
+        .join(students, students.c.user_id == User.id)
+        .outerjoin(
+            AssessmentSubmission,
+            and_(
+                AssessmentSubmission.student_id == User.id,
+                AssessmentSubmission.assessment_id.in_(list(column)),
+            ),
+        )
+        # Latest submission last, so it's the one kept
+        .order_by(User.full_name, User.id, AssessmentSubmission.submitted_at)
+        .execution_options(yield_per=FETCH_SIZE)
+    )
+
+    def finish(name: str, email: str, marks: List[Any]) -> List[Any]:
+        earned = sum(mark for mark in marks if mark is not None)
+        percentage = round(earned / total_marks * 100, 2) if total_marks else None
+        return [name, email, *marks, earned, percentage]
+
+    # Own session: the response is still streaming after the request's one is closed
+    async with AsyncSessionLocal() as db:
+        result = await db.stream(stmt)
+        current_id = None
+        name = email = None
+        marks: List[Any] = []
+        async for student_id, full_name, student_email, assessment_id, marks_obtained in result:
+            if student_id != current_id:
+                if current_id is not None:
+                    yield finish(name, email, marks)
+                current_id, name, email = student_id, full_name, student_email
+                marks = [None] * len(assessments)
+            if assessment_id is not None:
+                marks[column[assessment_id]] = marks_obtained
+        if current_id is not None:
+            yield finish(name, email, marks)
+
+
+def gradebook_header(assessments: List[Assessment]) -> List[str]:
+    return [
+        "Student Name",
+        "Email",
+        *(f"{assessment.title} (/{assessment.total_marks})" for assessment in assessments),
+        "Total",
+        "Percentage",
+    ]
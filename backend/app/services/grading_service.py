@@ -0,0 +1,77 @@
+import math
+from typing import Any, Dict, Optional, Tuple
+
+# Question types graded as a set of options / a number within a tolerance (anything else: exact match)
+MULTI_SELECT_TYPES = {"multiple select", "multi select", "multi-select", "checkboxes"}
+NUMERIC_TYPES = {"numeric", "number", "numerical"}
+
+
+def as_float(value: Any) -> Optional[float]:
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return number if math.isfinite(number) else None
+
+
+def _correct_answer(question: dict) -> Any:
+    # correctOption 0 is a valid answer, only fall back to correctAnswer when it's missing
+    for field in ("correctOption", "correctOptions", "correctAnswer", "correctAnswers"):
+        if question.get(field) is not None:
+            return question[field]
+    return None
+
+
+def compile_answer_key(questions_data: dict) -> dict:
+    """
+    Compact answer key of a template ({"questions": [{"id", "type", "correctOption" / "correctAnswer", "points", ...}]}):
+    {"total_points": float, "questions": [{"id", "kind", "answer", "points", "tolerance"}]}, in template order.
+    kind is "multi" (answer = sorted list), "numeric" (answer ± tolerance) or "exact".
+    """
+    items = []
+    total_points = 0.0
+    for question in questions_data.get("questions", []):
+        if not isinstance(question, dict):
+            continue
+        points = as_float(question.get("points")) or 0.0
+        total_points += points
+        answer = _correct_answer(question)
+        question_type = str(question.get("type") or "").strip().lower()
+        item = {"id": str(question.get("id")), "kind": "exact", "answer": answer, "points": points}
+
+        if question_type in MULTI_SELECT_TYPES or isinstance(answer, list):
+            item["kind"] = "multi"
+            item["answer"] = sorted(answer, key=str) if isinstance(answer, list) else [answer]
+        elif question_type in NUMERIC_TYPES or question.get("tolerance") is not None:
+            number = as_float(answer)
+            if number is not None:
+                item["kind"] = "numeric"
+                item["answer"] = number
+                item["tolerance"] = abs(as_float(question.get("tolerance")) or 0.0)
+        items.append(item)
+    return {"total_points": total_points, "questions": items}
+
+
+def is_correct(item: dict, user_answer: Any) -> bool:
+    if user_answer is None or item["answer"] is None:
+        return False
+    if item["kind"] == "multi":
+        if not isinstance(user_answer, list):
+            user_answer = [user_answer]
+        return sorted(user_answer, key=str) == item["answer"]
+    if item["kind"] == "numeric":
+        number = as_float(user_answer)
+        return number is not None and abs(number - item["answer"]) <= item["tolerance"]
+    return user_answer == item["answer"]
+
+
+def score(answer_key: dict, answers: Dict[str, Any]) -> Tuple[float, float]:
+    """(earned points, total points) of a submission's answers (question id -> answer)."""
+    earned = sum(item["points"] for item in answer_key["questions"] if is_correct(item, answers.get(item["id"])))
+    return earned, answer_key["total_points"]
+
+
+def marks(earned: float) -> int:
+    # assessment_submissions.marks_obtained is an integer column
+    return int(round(earned))
+
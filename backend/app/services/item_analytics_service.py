@@ -0,0 +1,148 @@
+import asyncio
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.crud.crud_submission import submission as crud_submission
+from app.db.session import AsyncSessionLocal
+from app.models.assessment import AssessmentSubmission, Question
+from app.services.answer_matrix import UNANSWERED, AnswerMatrix, parse_response_data
+from app.services.grading_service import as_float
+
+# Share of the cohort in the upper / lower group of the discrimination index
+DISCRIMINATION_GROUP = 0.27
+HISTOGRAM_BINS = 10
+# Most frequent answers listed per question (free text / numeric answers can all differ)
+MAX_ANSWERS_PER_QUESTION = 20
+
+
+def _round(value: float) -> Optional[float]:
+    return None if value is None or np.isnan(value) else round(float(value), 4)
+
+
+def compute_item_analytics(answer_key: dict, responses: List[Dict[str, Any]], texts: Dict[str, str]) -> dict:
+    """Item statistics of a cohort's answers, all computed on one AnswerMatrix."""
+    matrix = AnswerMatrix(answer_key, responses)
+    n = len(responses)
+    correct = matrix.correct()
+    total_points = answer_key["total_points"]
+    percentages = matrix.scores(correct) / total_points * 100 if total_points else np.zeros(n)
+
+    # Discrimination: p-value in the top scorers minus p-value in the bottom scorers
+    discrimination = np.full(len(matrix.items), np.nan)
+    group = int(round(n * DISCRIMINATION_GROUP))
+    if group >= 1 and n >= 2:
+        order = np.argsort(percentages, kind="stable")
+        discrimination = correct[order[-group:]].mean(axis=0) - correct[order[:group]].mean(axis=0)
+
+    p_values = correct.mean(axis=0) if n else np.full(len(matrix.items), np.nan)
+    answered = (matrix.codes != UNANSWERED).sum(axis=0)
+
+    questions = []
+    for j, item in enumerate(matrix.items):
+        choices = matrix.choices[j]
+        column = matrix.codes[:, j]
+        counts = np.bincount(column[column != UNANSWERED], minlength=len(choices))
+        if item["kind"] == "numeric":
+            values = np.array([as_float(choice) if as_float(choice) is not None else np.nan for choice in choices])
+            with np.errstate(invalid="ignore"):
+                choice_correct = np.abs(values - item["answer"]) <= item["tolerance"]
+        else:
+            choice_correct = np.arange(len(choices)) == matrix.code_of(j, item["answer"])
+        top = np.argsort(-counts, kind="stable")[:MAX_ANSWERS_PER_QUESTION]
+        questions.append({
+            "question_id": item["id"],
+            "text": texts.get(item["id"]),
+            "kind": item["kind"],
+            "points": item["points"],
+            "answered": int(answered[j]),
+            "unanswered": n - int(answered[j]),
+            "p_value": _round(p_values[j]),
+            "discrimination": _round(discrimination[j]),
+            "answers": [
+                {"answer": choices[c], "count": int(counts[c]), "correct": bool(choice_correct[c])} for c in top
+            ],
+        })
+
+    bin_counts, edges = np.histogram(np.clip(percentages, 0, 100), bins=HISTOGRAM_BINS, range=(0, 100))
+    return {
+        "submission_count": n,
+        "mean_percentage": _round(percentages.mean()) if n else None,
+        "median_percentage": _round(np.median(percentages)) if n else None,
+        "std_percentage": _round(percentages.std()) if n else None,
+        "histogram": [
+            {"start": float(edges[b]), "end": float(edges[b + 1]), "count": int(bin_counts[b])}
+            for b in range(HISTOGRAM_BINS)
+        ],
+        "questions": questions,
+    }
+
+
+class ItemAnalyticsService:
+    """
+    Per-assessment item analytics, cached in memory.
+
+    An entry is reused while the assessment's submissions (count, last id) and answer key
+    (questions_indexed_at) are unchanged, so workers that didn't see a submission arrive still
+    recompute; submit_assessment also drops its own entry right away. Concurrent requests for
+    the same assessment share one computation.
+    """
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[int, Tuple[tuple, dict]]" = OrderedDict()
+        self._inflight: Dict[Tuple[int, tuple], asyncio.Task] = {}
+
+    def invalidate(self, assessment_id: int):
+        self._entries.pop(assessment_id, None)
+
+    async def get(self, db: AsyncSession, *, assessment_id: int, answer_key: dict, key_version: Any) -> dict:
+        result = await db.execute(
+            select(func.count(AssessmentSubmission.id), func.max(AssessmentSubmission.id))
+            .filter(AssessmentSubmission.assessment_id == assessment_id)
+        )
+        stamp = (*result.one(), key_version)
+
+        cached = self._entries.get(assessment_id)
+        if cached and cached[0] == stamp:
+            self._entries.move_to_end(assessment_id)
+            return cached[1]
+
+        flight = (assessment_id, stamp)
+        task = self._inflight.get(flight)
+        if task is None:
+            task = asyncio.ensure_future(self._compute(assessment_id, answer_key, stamp))
+            self._inflight[flight] = task
+            task.add_done_callback(lambda _: self._inflight.pop(flight, None))
+        return await asyncio.shield(task)
+
+    async def _compute(self, assessment_id: int, answer_key: dict, stamp: tuple) -> dict:
+        # Own session: the computation outlives the request that started it if that one goes away
+        async with AsyncSessionLocal() as db:
+            responses = []
+            async for rows in crud_submission.iter_responses(db, assessment_id=assessment_id):
+                responses.extend(parse_response_data(row.response_data) for row in rows)
+            result = await db.execute(
+                select(Question.question_key, Question.text).filter(Question.assessment_id == assessment_id)
+            )
+            texts = {key: text for key, text in result.all() if key is not None}
+
+        # NumPy work off the event loop
+        analytics = await run_in_threadpool(compute_item_analytics, answer_key, responses, texts)
+        analytics["assessment_id"] = assessment_id
+        analytics["computed_at"] = datetime.now(timezone.utc)
+
+        self._entries[assessment_id] = (stamp, analytics)
+        self._entries.move_to_end(assessment_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return analytics
+
+
+item_analytics_service = ItemAnalyticsService()
@@ -0,0 +1,74 @@
+import asyncio
+from collections import defaultdict
+from typing import Dict, Optional
+from uuid import UUID
+
+from app.utils.websockets import manager
+
+# Receipts per event, keeps the payload well under the 8000 byte NOTIFY limit
+MAX_RECEIPTS_PER_EVENT = 50
+
+
+class ReadReceiptService:
+    """
+    Coalesces read receipts: watermark changes are collected per chat and broadcast as one
+    "read_receipts" event per chat every `flush_interval` seconds, keeping only each
+    reader's highest watermark, instead of one event per message read.
+    """
+
+    def __init__(self, flush_interval: float = 0.25):
+        self.flush_interval = flush_interval
+        # chat_id -> {user_id: last_read_message_id}
+        self._pending: Dict[int, Dict[UUID, int]] = defaultdict(dict)
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            await self._flush()
+
+    async def record(self, chat_id: int, user_id: UUID, last_read_message_id: int):
+        """Queue a receipt. Never waits on the broadcast."""
+        await self.start()
+        readers = self._pending[chat_id]
+        readers[user_id] = max(readers.get(user_id, 0), last_read_message_id)
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            # Let receipts from the same burst pile up
+            await asyncio.sleep(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                await self._flush()
+            except Exception as e:
+                print(f"Failed to broadcast read receipts: {e}")
+
+    async def _flush(self):
+        pending, self._pending = self._pending, defaultdict(dict)
+        for chat_id, readers in pending.items():
+            receipts = [
+                {"user_id": str(user_id), "last_read_message_id": last_read_message_id}
+                for user_id, last_read_message_id in readers.items()
+            ]
+            for i in range(0, len(receipts), MAX_RECEIPTS_PER_EVENT):
+                await manager.broadcast({
+                    "type": "read_receipts",
+                    "chat_id": chat_id,
+                    "receipts": receipts[i:i + MAX_RECEIPTS_PER_EVENT]
+                }, chat_id)
+
+
+read_receipt_service = ReadReceiptService()
@@ -0,0 +1,134 @@
+import asyncio
+import mimetypes
+from typing import List, Optional
+
+from sqlalchemy import func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.core.config import settings
+from app.crud.crud_chat import chat as crud_chat
+from app.db.session import engine
+from app.models.chat import Chat, ChatTypeEnum
+from app.services.bunny_service import bunny_service
+
+# pg_advisory_lock key, only one worker reconciles at a time
+RECONCILE_LOCK_ID = 724_016
+
+
+def group_resource_prefix(chat_id: int) -> str:
+    """Storage directory of a group chat's uploads (see POST /chats/{chat_id}/resources)."""
+    return f"resources/groups/{chat_id}/"
+
+
+class ResourceCatalogService:
+    """
+    Keeps chat_resources (what resource listings are served from) in line with the storage zone.
+    Uploads write their row directly, this background job only catches drift: files added or
+    removed outside the API. Runs every `interval` seconds, listing `concurrency` chats at a time.
+    """
+
+    def __init__(self, interval: int = settings.RESOURCE_RECONCILE_INTERVAL, concurrency: int = 4):
+        self.interval = interval
+        self.concurrency = concurrency
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.reconcile()
+            except Exception as e:
+                print(f"Resource reconcile failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def reconcile(self) -> bool:
+        """One pass over every group chat. Returns False if another worker holds the lock."""
+        # Dedicated connection: the session-level advisory lock must be released on the same one
+        async with engine.connect() as conn:
+            locked = await conn.scalar(select(func.pg_try_advisory_lock(RECONCILE_LOCK_ID)))
+            await conn.commit()
+            if not locked:
+                return False
+            try:
+                async with AsyncSession(bind=conn, expire_on_commit=False) as db:
+                    result = await db.execute(
+                        select(Chat.id, Chat.created_by).filter(Chat.chat_type == ChatTypeEnum.group)
+                    )
+                    chats = result.all()
+                    await db.commit()
+
+                    semaphore = asyncio.Semaphore(self.concurrency)
+
+                    async def list_chat(chat_id: int):
+                        async with semaphore:
+                            return await bunny_service.list_files(group_resource_prefix(chat_id), strict=True)
+
+                    listings = await asyncio.gather(
+                        *(list_chat(chat.id) for chat in chats), return_exceptions=True
+                    )
+
+                    upserted = deleted = skipped = 0
+                    for chat, listing in zip(chats, listings):
+                        if isinstance(listing, Exception):
+                            # Never mark files deleted because of a failed listing
+                            skipped += 1
+                            continue
+                        stored = self._stored_files(chat.id, listing)
+                        try:
+                            added, removed = await crud_chat.sync_resources(
+                                db,
+                                chat_id=chat.id,
+                                # Files found in storage only: attributed to the chat's creator
+                                sender_id=chat.created_by,
+                                prefix=group_resource_prefix(chat.id),
+                                stored=stored,
+                                # No files listed (empty directory, only subdirectories, or a 404) can't be
+                                # told apart from a storage hiccup: it only adds, it never empties the catalog
+                                prune=bool(stored),
+                            )
+                        except Exception as e:
+                            await db.rollback()
+                            print(f"Resource reconcile of chat {chat.id} failed: {e}")
+                            skipped += 1
+                            continue
+                        upserted += added
+                        deleted += removed
+                    print(
+                        f"Resource catalog reconciled: {len(chats)} chats, {upserted} files, "
+                        f"{deleted} removed, {skipped} skipped"
+                    )
+            finally:
+                await conn.execute(select(func.pg_advisory_unlock(RECONCILE_LOCK_ID)))
+                await conn.commit()
+        return True
+
+    def _stored_files(self, chat_id: int, listing: List[dict]) -> List[dict]:
+        prefix = group_resource_prefix(chat_id)
+        return [
+            {
+                "storage_path": f"{prefix}{item['ObjectName']}",
+                "file_name": item["ObjectName"],
+                "file_url": f"{bunny_service.cdn_url}/{prefix}{item['ObjectName']}",
+                "file_type": mimetypes.guess_type(item["ObjectName"])[0],
+                "file_size": item.get("Length"),
+                "storage_guid": item.get("Guid"),
+            }
+            for item in listing
+            if not item.get("IsDirectory")
+        ]
+
+
+resource_catalog_service = ResourceCatalogService()
@@ -0,0 +1,255 @@
+import asyncio
+from datetime import timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import Integer, and_, column, func, insert, or_, update, values
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.core.config import settings
+from app.crud.crud_question import question as crud_question
+from app.db.session import AsyncSessionLocal
+from app.models.assessment import Assessment, AssessmentSubmission, QueuedSubmission, SubmissionStatus
+from app.services.answer_matrix import parse_response_data
+from app.services.grading_service import marks, score
+from app.services.item_analytics_service import item_analytics_service
+
+# Jobs claimed per worker round trip
+BATCH_SIZE = 50
+# A job left "processing" this long belongs to a worker that died: claim it again
+STALE_AFTER = timedelta(minutes=5)
+MAX_ATTEMPTS = 5
+
+
+class SubmissionQueueService:
+    """
+    Grades the submissions accepted into submission_queue.
+
+    `workers` tasks per process claim queued jobs in batches (FOR UPDATE SKIP LOCKED, so every
+    process can run workers), grade them against the assessments' answer keys and write the
+    AssessmentSubmission rows and the job results in one transaction. Workers are woken up by
+    notify() for jobs enqueued by this process, and poll every `poll_interval` seconds for the rest.
+    Callers wait for a job with wait(); that only returns early for jobs graded by this process.
+    A job is claimed at most MAX_ATTEMPTS times and errors are kept per job, so one job that
+    can't be graded or stored doesn't hold up the rest of its batch.
+    """
+
+    def __init__(self, workers: int = settings.SUBMISSION_WORKERS, poll_interval: float = 1.0):
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        # job id -> futures of the callers waiting for it
+        self._waiters: Dict[int, List[asyncio.Future]] = {}
+
+    async def start(self):
+        if not self._tasks:
+            self._wakeup = asyncio.Event()
+            self._tasks = [asyncio.create_task(self._run()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        # Jobs claimed by the cancelled workers are picked up again once stale
+        self._tasks = []
+
+    def notify(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def wait(self, job_id: int, timeout: float):
+        """Wait up to timeout seconds for this process to finish the job."""
+        if timeout <= 0:
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(job_id, []).append(future)
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            waiters = self._waiters.get(job_id)
+            if waiters and future in waiters:
+                waiters.remove(future)
+                if not waiters:
+                    del self._waiters[job_id]
+
+    def _finished(self, job_ids: List[int]):
+        for job_id in job_ids:
+            for future in self._waiters.pop(job_id, []):
+                if not future.done():
+                    future.set_result(None)
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                processed = await self._process_batch()
+            except Exception as e:
+                print(f"Submission grading failed: {e}")
+                processed = 0
+            if processed:
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _process_batch(self) -> int:
+        async with AsyncSessionLocal() as db:
+            stale = and_(
+                QueuedSubmission.status == SubmissionStatus.processing,
+                QueuedSubmission.claimed_at < func.now() - STALE_AFTER,
+            )
+            # Jobs whose worker died on their last attempt: give up on them instead of claiming them forever
+            result = await db.execute(
+                update(QueuedSubmission)
+                .where(stale, QueuedSubmission.attempts >= MAX_ATTEMPTS)
+                .values(status=SubmissionStatus.failed, error=f"Grading did not finish after {MAX_ATTEMPTS} attempts")
+                .returning(QueuedSubmission.id)
+                .execution_options(synchronize_session=False)
+            )
+            abandoned = result.scalars().all()
+            claimable = (
+                select(QueuedSubmission.id)
+                .filter(
+                    or_(QueuedSubmission.status == SubmissionStatus.queued, stale),
+                    QueuedSubmission.attempts < MAX_ATTEMPTS,
+                )
+                .order_by(QueuedSubmission.id)
+                .limit(BATCH_SIZE)
+                .with_for_update(skip_locked=True)
+            )
+            result = await db.execute(
+                update(QueuedSubmission)
+                .where(QueuedSubmission.id.in_(claimable.scalar_subquery()))
+                .values(
+                    status=SubmissionStatus.processing,
+                    claimed_at=func.now(),
+                    attempts=QueuedSubmission.attempts + 1,
+                )
+                .returning(
+                    QueuedSubmission.id, QueuedSubmission.assessment_id, QueuedSubmission.student_id,
+                    QueuedSubmission.answers, QueuedSubmission.attempts,
+                )
+                .execution_options(synchronize_session=False)
+            )
+            jobs = result.all()
+            # Claim is committed on its own, so other workers skip these while they're graded
+            await db.commit()
+            self._finished(abandoned)
+            if not jobs:
+                return len(abandoned)
+
+            answer_keys = {}
+            # job id -> why it couldn't be graded
+            errors: Dict[int, str] = {}
+            assessment_errors = {}
+            assessment_ids = {job.assessment_id for job in jobs}
+            assessments = (
+                await db.execute(select(Assessment).filter(Assessment.id.in_(assessment_ids)))
+            ).scalars().all()
+            for assessment in assessments:
+                try:
+                    answer_key = await crud_question.get_answer_key(db, assessment=assessment)
+                except Exception as e:
+                    assessment_errors[assessment.id] = f"Failed to fetch questions: {e}"
+                    continue
+                if answer_key is None:
+                    assessment_errors[assessment.id] = "Assessment has no questions"
+                else:
+                    answer_keys[assessment.id] = answer_key
+
+            graded = []
+            for job in jobs:
+                if job.assessment_id not in answer_keys:
+                    errors[job.id] = assessment_errors.get(job.assessment_id, "Assessment not found")
+                    continue
+                try:
+                    graded.append((job, marks(score(answer_keys[job.assessment_id], parse_response_data(job.answers))[0])))
+                except Exception as e:
+                    errors[job.id] = f"Grading failed: {e}"
+
+            stored = await self._store_submissions(db, graded, errors)
+            if stored:
+                graded_rows = values(
+                    column("id", Integer), column("submission_id", Integer), column("marks", Integer),
+                    name="graded",
+                ).data([(job.id, submission_id, graded_marks) for job, graded_marks, submission_id in stored])
+                await db.execute(
+                    update(QueuedSubmission)
+                    .where(QueuedSubmission.id == graded_rows.c.id)
+                    .values(
+                        status=SubmissionStatus.graded,
+                        submission_id=graded_rows.c.submission_id,
+                        marks_obtained=graded_rows.c.marks,
+                        graded_at=func.now(),
+                        error=None,
+                    )
+                    .execution_options(synchronize_session=False)
+                )
+
+            failed = [job for job in jobs if job.id in errors]
+            for job in failed:
+                # Template download problems are usually transient: retry a few times
+                await db.execute(
+                    update(QueuedSubmission)
+                    .where(QueuedSubmission.id == job.id)
+                    .values(
+                        status=SubmissionStatus.failed if job.attempts >= MAX_ATTEMPTS else SubmissionStatus.queued,
+                        error=errors[job.id],
+                    )
+                )
+            await db.commit()
+
+        for assessment_id in {job.assessment_id for job, _, _ in stored}:
+            item_analytics_service.invalidate(assessment_id)
+        finished = [job.id for job, _, _ in stored] + [job.id for job in failed if job.attempts >= MAX_ATTEMPTS]
+        self._finished(finished)
+        # Only retries left: back off until the next poll instead of hammering the CDN
+        return len(finished) + len(abandoned)
+
+    async def _store_submissions(self, db: AsyncSession, graded: List[tuple], errors: Dict[int, str]) -> List[tuple]:
+        """
+        Insert the AssessmentSubmission rows of the graded (job, marks) pairs, all at once or, if that
+        fails, one by one so a bad job can't hold up the others (its error goes to errors).
+        Returns (job, marks, submission id) for the stored ones.
+        """
+        if not graded:
+            return []
+
+        async def insert_rows(pairs):
+            result = await db.execute(
+                insert(AssessmentSubmission).returning(AssessmentSubmission.id, sort_by_parameter_order=True),
+                [
+                    {
+                        "assessment_id": job.assessment_id,
+                        "student_id": job.student_id,
+                        "marks_obtained": graded_marks,
+                        "response_data": job.answers,
+                    }
+                    for job, graded_marks in pairs
+                ],
+            )
+            return [(job, graded_marks, sid) for (job, graded_marks), sid in zip(pairs, result.scalars().all())]
+
+        try:
+            async with db.begin_nested():
+                return await insert_rows(graded)
+        except Exception as e:
+            print(f"Storing {len(graded)} graded submissions failed, retrying one by one: {e}")
+        stored = []
+        for pair in graded:
+            try:
+                async with db.begin_nested():
+                    stored.extend(await insert_rows([pair]))
+            except Exception as e:
+                errors[pair[0].id] = f"Failed to store the submission: {e}"
+        return stored
+
+submission_queue_service = SubmissionQueueService()
@@ -0,0 +1,111 @@
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+import httpx
+
+from app.core.config import settings
+
+
+@dataclass
+class CachedTemplate:
+    data: dict
+    etag: Optional[str]
+    size: int
+    validated_at: float
+
+
+class TemplateCacheService:
+    """
+    Assessment question templates (the JSON files behind Assessment.template_url), cached in memory.
+
+    Templates are uploaded once under timestamped filenames and never rewritten, so entries are
+    only revalidated (If-None-Match) every `revalidate_after` seconds and a stale copy is served
+    if Bunny.net is unreachable. Concurrent misses for the same URL share one download.
+    Evicted least recently used first once the cached JSON goes over `max_bytes`.
+    Returned dicts are shared between requests: treat them as read-only.
+    """
+
+    def __init__(self, max_bytes: int = settings.TEMPLATE_CACHE_MAX_BYTES, revalidate_after: float = 3600.0):
+        self.max_bytes = max_bytes
+        self.revalidate_after = revalidate_after
+        self._entries: "OrderedDict[str, CachedTemplate]" = OrderedDict()
+        self._size = 0
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(timeout=30.0)
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def get(self, url: str) -> dict:
+        entry = self._entries.get(url)
+        if entry and time.monotonic() - entry.validated_at < self.revalidate_after:
+            self._entries.move_to_end(url)
+            return entry.data
+
+        task = self._inflight.get(url)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(url, entry))
+            self._inflight[url] = task
+            task.add_done_callback(lambda _: self._inflight.pop(url, None))
+        # Shielded: a client disconnecting mid-download doesn't cancel it for the other waiters
+        return await asyncio.shield(task)
+
+    def put(self, url: str, data: dict, etag: Optional[str] = None):
+        """Prime the cache with a template that was just uploaded."""
+        self._store(url, data, etag, len(json.dumps(data)))
+
+    def invalidate(self, url: Optional[str] = None):
+        """Drop one template, or everything when url is None."""
+        if url is None:
+            self._entries.clear()
+            self._size = 0
+        else:
+            entry = self._entries.pop(url, None)
+            if entry:
+                self._size -= entry.size
+
+    async def _fetch(self, url: str, entry: Optional[CachedTemplate]) -> dict:
+        headers = {"If-None-Match": entry.etag} if entry and entry.etag else {}
+        try:
+            response = await self.client().get(url, headers=headers)
+        except httpx.HTTPError:
+            if entry:
+                return entry.data
+            raise
+
+        if response.status_code == 304 and entry:
+            entry.validated_at = time.monotonic()
+            self._entries.move_to_end(url)
+            return entry.data
+        if response.status_code != 200:
+            if entry:
+                return entry.data
+            raise Exception(f"Failed to download from Bunny.net: {response.status_code} - {response.text}")
+
+        data = response.json()
+        self._store(url, data, response.headers.get("ETag"), len(response.content))
+        return data
+
+    def _store(self, url: str, data: dict, etag: Optional[str], size: int):
+        self.invalidate(url)
+        if size > self.max_bytes:
+            return
+        self._entries[url] = CachedTemplate(data=data, etag=etag, size=size, validated_at=time.monotonic())
+        self._size += size
+        while self._size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= evicted.size
+
+
+template_cache_service = TemplateCacheService()
@@ -0,0 +1,201 @@
+import asyncio
+import time
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from uuid import UUID
+
+from app.utils.websockets import ConnectionManager, manager
+
+# Broker-only events, every worker folds them into its own copy of the state
+PRESENCE_SIGNAL = "presence_signal"
+TYPING_SIGNAL = "typing_signal"
+
+
+class ExpiringSet:
+    """Members that drop out `ttl` seconds after their last refresh."""
+
+    def __init__(self):
+        self._expires: Dict[UUID, float] = {}
+
+    def add(self, member: UUID, ttl: float) -> bool:
+        """Returns True when the member wasn't in the set yet."""
+        is_new = member not in self._expires
+        self._expires[member] = time.monotonic() + ttl
+        return is_new
+
+    def discard(self, member: UUID) -> bool:
+        return self._expires.pop(member, None) is not None
+
+    def expire(self) -> List[UUID]:
+        """Drop and return the expired members."""
+        now = time.monotonic()
+        expired = [member for member, expires_at in self._expires.items() if expires_at <= now]
+        for member in expired:
+            del self._expires[member]
+        return expired
+
+    def members(self) -> List[UUID]:
+        now = time.monotonic()
+        return [member for member, expires_at in self._expires.items() if expires_at > now]
+
+    def __len__(self):
+        return len(self._expires)
+
+
+class PresenceTracker:
+    """
+    Online and typing indicators per chat, kept in memory only (never in Postgres).
+
+    Sockets on this worker announce their user through the broker, every worker applies the
+    signal to its own expiring sets, so each one can answer for any chat:
+      - online: refreshed by client heartbeats, re-announced at most every ttl / 3 seconds,
+        dropped `ttl` seconds after the last one (covers crashed workers and dead sockets)
+      - typing: published at most every `typing_throttle` seconds per user, sent to clients as
+        one coalesced "typing" event per chat every `flush_interval` seconds when it changed
+    """
+
+    def __init__(
+        self,
+        connection_manager: ConnectionManager,
+        ttl: float = 30.0,
+        typing_ttl: float = 6.0,
+        typing_throttle: float = 2.0,
+        flush_interval: float = 0.5,
+    ):
+        self.manager = connection_manager
+        self.ttl = ttl
+        self.typing_ttl = typing_ttl
+        self.typing_throttle = typing_throttle
+        self.flush_interval = flush_interval
+        self._online: Dict[int, ExpiringSet] = defaultdict(ExpiringSet)
+        self._typing: Dict[int, ExpiringSet] = defaultdict(ExpiringSet)
+        # Chats whose typing set changed since the last flush
+        self._typing_dirty: Set[int] = set()
+        # (chat_id, user_id) -> sockets of this worker / last time it was announced / last typing signal
+        self._local: Dict[Tuple[int, UUID], int] = defaultdict(int)
+        self._announced: Dict[Tuple[int, UUID], float] = {}
+        self._typing_sent: Dict[Tuple[int, UUID], float] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self._task is None:
+            self.manager.internal_handlers[PRESENCE_SIGNAL] = self._on_presence_signal
+            self.manager.internal_handlers[TYPING_SIGNAL] = self._on_typing_signal
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    # --- Called by the WebSocket endpoints (local sockets) ---
+
+    async def join(self, user_id: UUID, chat_ids: Iterable[int]):
+        for chat_id in chat_ids:
+            self._local[(chat_id, user_id)] += 1
+            await self._announce(chat_id, user_id)
+
+    async def leave(self, user_id: UUID, chat_ids: Iterable[int]):
+        for chat_id in chat_ids:
+            key = (chat_id, user_id)
+            self._local[key] -= 1
+            if self._local[key] > 0:
+                continue
+            # Last socket of this user on this worker (other workers re-announce theirs)
+            del self._local[key]
+            self._announced.pop(key, None)
+            self._typing_sent.pop(key, None)
+            await self.manager.broadcast(
+                {"type": PRESENCE_SIGNAL, "chat_id": chat_id, "user_id": str(user_id), "status": "offline"}, chat_id
+            )
+
+    async def heartbeat(self, user_id: UUID, chat_ids: Iterable[int]):
+        for chat_id in chat_ids:
+            announced_at = self._announced.get((chat_id, user_id), 0.0)
+            if time.monotonic() - announced_at >= self.ttl / 3:
+                await self._announce(chat_id, user_id)
+
+    async def typing(self, user_id: UUID, chat_id: int):
+        key = (chat_id, user_id)
+        now = time.monotonic()
+        if now - self._typing_sent.get(key, 0.0) < self.typing_throttle:
+            return
+        self._typing_sent[key] = now
+        await self.manager.broadcast(
+            {"type": TYPING_SIGNAL, "chat_id": chat_id, "user_id": str(user_id)}, chat_id
+        )
+
+    # --- Queries ---
+
+    def online(self, chat_id: int) -> List[UUID]:
+        return self._online[chat_id].members() if chat_id in self._online else []
+
+    def typing_users(self, chat_id: int) -> List[UUID]:
+        return self._typing[chat_id].members() if chat_id in self._typing else []
+
+    # --- Internals ---
+
+    async def _announce(self, chat_id: int, user_id: UUID):
+        self._announced[(chat_id, user_id)] = time.monotonic()
+        await self.manager.broadcast(
+            {"type": PRESENCE_SIGNAL, "chat_id": chat_id, "user_id": str(user_id), "status": "online"}, chat_id
+        )
+
+    def _presence_event(self, chat_id: int, user_id: UUID, status: str) -> dict:
+        return {"type": "presence", "chat_id": chat_id, "user_id": str(user_id), "status": status}
+
+    async def _on_presence_signal(self, chat_id: int, message: dict):
+        user_id = UUID(message["user_id"])
+        if message["status"] == "online":
+            if self._online[chat_id].add(user_id, self.ttl):
+                self.manager.deliver_local(chat_id, self._presence_event(chat_id, user_id, "online"))
+            return
+
+        if self._online[chat_id].discard(user_id):
+            self.manager.deliver_local(chat_id, self._presence_event(chat_id, user_id, "offline"))
+        if self._typing[chat_id].discard(user_id):
+            self._typing_dirty.add(chat_id)
+        if self._local.get((chat_id, user_id)):
+            # Another worker's socket closed but the user is still connected here
+            await self._announce(chat_id, user_id)
+
+    async def _on_typing_signal(self, chat_id: int, message: dict):
+        if self._typing[chat_id].add(UUID(message["user_id"]), self.typing_ttl):
+            self._typing_dirty.add(chat_id)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                self._sweep()
+            except Exception as e:
+                print(f"Presence sweep failed: {e}")
+
+    def _sweep(self):
+        # Every worker holds the same sets, so expiry is applied locally without any broker traffic
+        for chat_id in list(self._online):
+            for user_id in self._online[chat_id].expire():
+                self.manager.deliver_local(chat_id, self._presence_event(chat_id, user_id, "offline"))
+            if not self._online[chat_id]:
+                del self._online[chat_id]
+
+        for chat_id in list(self._typing):
+            if self._typing[chat_id].expire():
+                self._typing_dirty.add(chat_id)
+            if not self._typing[chat_id]:
+                del self._typing[chat_id]
+
+        dirty, self._typing_dirty = self._typing_dirty, set()
+        for chat_id in dirty:
+            self.manager.deliver_local(chat_id, {
+                "type": "typing",
+                "chat_id": chat_id,
+                "user_ids": [str(user_id) for user_id in self.typing_users(chat_id)]
+            })
+
+
+presence_tracker = PresenceTracker(manager)
@@ -0,0 +1,213 @@
+import asyncio
+import json
+from abc import ABC, abstractmethod
+from datetime import timedelta
+from typing import Any, Awaitable, Callable, Optional
+
+import asyncpg
+
+from app.core.config import settings
+
+# handler(chat_id, message) called for every event published on any worker
+EventHandler = Callable[[int, dict], Awaitable[None]]
+# Called when events may have been missed (connection lost, unreadable payload)
+LossHandler = Callable[[], None]
+
+
+class Broker(ABC):
+    """
+    Fan-out backend behind ConnectionManager.broadcast.
+    Every published event is handed to the handler of every subscribed worker
+    (including the publishing one), which then delivers to its local sockets.
+    on_events_lost is called whenever some events may not have reached this worker.
+    """
+
+    @abstractmethod
+    async def start(self, handler: EventHandler, on_events_lost: Optional[LossHandler] = None) -> None:
+        ...
+
+    @abstractmethod
+    async def stop(self) -> None:
+        ...
+
+    @abstractmethod
+    async def publish(self, chat_id: int, message: dict) -> None:
+        ...
+
+
+class InMemoryBroker(Broker):
+    """Single-process broker. Good enough for one uvicorn worker and for local dev."""
+
+    def __init__(self):
+        self._handler: Optional[EventHandler] = None
+
+    async def start(self, handler: EventHandler, on_events_lost: Optional[LossHandler] = None) -> None:
+        self._handler = handler
+
+    async def stop(self) -> None:
+        self._handler = None
+
+    async def publish(self, chat_id: int, message: dict) -> None:
+        if self._handler:
+            await self._handler(chat_id, message)
+
+
+class PostgresBroker(Broker):
+    """
+    Cross-process broker on Postgres LISTEN/NOTIFY.
+    Uses one dedicated asyncpg connection per worker (outside the SQLAlchemy pool), supervised:
+    when it drops (or stops answering the periodic keepalive) it's reopened with backoff and the
+    channel LISTENed again. Events published while a worker was disconnected are lost for it;
+    clients catch up through last_seq replay.
+    NOTIFY payloads are capped at 8000 bytes by Postgres. Bigger events (long messages, large
+    read receipt batches) are stored in chat_event_payloads and only their id is notified.
+    """
+
+    # Encoded payload bytes sent inline, a little under the 8000 byte limit
+    MAX_INLINE_PAYLOAD = 7900
+    KEEPALIVE_INTERVAL = 30.0
+    KEEPALIVE_TIMEOUT = 5.0
+    # Spilled payloads are read within milliseconds, anything older is garbage
+    SPILL_RETENTION = timedelta(minutes=5)
+    MAX_RECONNECT_DELAY = 30.0
+
+    def __init__(self, dsn: str, channel: str = "chat_events"):
+        self.dsn = dsn
+        self.channel = channel
+        self._conn: Optional[asyncpg.Connection] = None
+        self._handler: Optional[EventHandler] = None
+        self._on_events_lost: Optional[LossHandler] = None
+        self._lock = asyncio.Lock()
+        self._connected = asyncio.Event()
+        self._lost = asyncio.Event()
+        self._supervisor: Optional[asyncio.Task] = None
+
+    async def start(self, handler: EventHandler, on_events_lost: Optional[LossHandler] = None) -> None:
+        self._handler = handler
+        self._on_events_lost = on_events_lost
+        # First connection inline, so a bad DSN fails startup instead of retrying forever
+        await self._connect()
+        self._supervisor = asyncio.create_task(self._supervise())
+
+    async def stop(self) -> None:
+        if self._supervisor is not None:
+            self._supervisor.cancel()
+            try:
+                await self._supervisor
+            except asyncio.CancelledError:
+                pass
+            self._supervisor = None
+        await self._close()
+
+    async def publish(self, chat_id: int, message: dict, timeout: float = 5.0) -> None:
+        payload = json.dumps({"chat_id": chat_id, "message": message}, default=str)
+        if not self._connected.is_set():
+            try:
+                await asyncio.wait_for(self._connected.wait(), timeout)
+            except asyncio.TimeoutError:
+                raise ConnectionError("Chat broker is not connected") from None
+        # asyncpg connections don't allow concurrent queries
+        async with self._lock:
+            if self._conn is None:
+                raise ConnectionError("Chat broker is not connected")
+            if len(payload.encode()) > self.MAX_INLINE_PAYLOAD:
+                payload_id = await self._conn.fetchval(
+                    "INSERT INTO chat_event_payloads (payload) VALUES ($1) RETURNING id", payload
+                )
+                payload = json.dumps({"chat_id": chat_id, "payload_id": payload_id})
+            await self._conn.execute("SELECT pg_notify($1, $2)", self.channel, payload)
+
+    async def _connect(self) -> None:
+        conn = await asyncpg.connect(self.dsn)
+        conn.add_termination_listener(self._on_terminate)
+        await conn.add_listener(self.channel, self._on_notify)
+        self._conn = conn
+        self._lost.clear()
+        self._connected.set()
+
+    async def _close(self) -> None:
+        self._connected.clear()
+        conn, self._conn = self._conn, None
+        if conn is not None and not conn.is_closed():
+            try:
+                await conn.remove_listener(self.channel, self._on_notify)
+            finally:
+                await conn.close()
+
+    async def _supervise(self) -> None:
+        delay = 1.0
+        while True:
+            if self._conn is None:
+                try:
+                    await self._connect()
+                    print("Chat broker reconnected")
+                    self._events_lost()
+                    delay = 1.0
+                except Exception as e:
+                    print(f"Chat broker reconnect failed, retrying in {delay:.0f}s: {e}")
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, self.MAX_RECONNECT_DELAY)
+                    continue
+
+            try:
+                await asyncio.wait_for(self._lost.wait(), self.KEEPALIVE_INTERVAL)
+            except asyncio.TimeoutError:
+                # Keepalive: catches connections that died without the socket noticing
+                try:
+                    async with self._lock:
+                        await asyncio.wait_for(
+                            self._conn.execute(
+                                "DELETE FROM chat_event_payloads WHERE created_at < now() - $1::interval",
+                                self.SPILL_RETENTION,
+                            ),
+                            self.KEEPALIVE_TIMEOUT,
+                        )
+                    continue
+                except Exception as e:
+                    print(f"Chat broker keepalive failed: {e}")
+            print("Chat broker connection lost")
+            try:
+                await self._close()
+            except Exception:
+                # Dead connection, nothing to clean up server side
+                pass
+
+    def _events_lost(self) -> None:
+        if self._on_events_lost:
+            self._on_events_lost()
+
+    def _on_terminate(self, connection: Any) -> None:
+        if connection is self._conn:
+            self._connected.clear()
+            self._lost.set()
+
+    def _on_notify(self, connection: Any, pid: int, channel: str, payload: str) -> None:
+        try:
+            event = json.loads(payload)
+        except ValueError as e:
+            print(f"Invalid chat event payload: {e}")
+            return
+        if self._handler:
+            asyncio.get_running_loop().create_task(self._dispatch(event))
+
+    async def _dispatch(self, event: dict) -> None:
+        if "payload_id" in event:
+            try:
+                async with self._lock:
+                    payload = await self._conn.fetchval(
+                        "SELECT payload FROM chat_event_payloads WHERE id = $1", event["payload_id"]
+                    )
+                event = json.loads(payload)
+            except Exception as e:
+                print(f"Failed to load chat event {event['payload_id']}: {e}")
+                self._events_lost()
+                return
+        await self._handler(int(event["chat_id"]), event["message"])
+
+
+def get_broker() -> Broker:
+    if settings.CHAT_BROKER == "postgres":
+        # asyncpg expects a plain postgresql:// DSN
+        dsn = settings.ASYNC_DATABASE_URL.replace("postgresql+asyncpg://", "postgresql://", 1)
+        return PostgresBroker(dsn)
+    return InMemoryBroker()
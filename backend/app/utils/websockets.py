@@ -1,33 +1,216 @@
-from typing import List, Dict
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional, Set
 from fastapi import WebSocket
-from collections import defaultdict
+from collections import defaultdict, deque, OrderedDict
+
+from app.utils.pubsub import Broker, get_broker
+
+logger = logging.getLogger(__name__)
+
+# "Try again later" close code sent to clients evicted for not keeping up
+WS_CLOSE_SLOW_CONSUMER = 1013
+# Sent to clients whose socket failed on our side, they reconnect and replay
+WS_CLOSE_INTERNAL_ERROR = 1011
+
+# Events older per-chat clients don't know about (they render every event they get)
+LIVE_EVENT_TYPES = {"read_receipts", "presence", "typing"}
+
+class SocketSender:
+    """
+    Outbound side of one WebSocket: a bounded queue drained by its own writer task,
+    so a slow client only ever delays itself. on_dead(sender, close_code) is called when
+    a send fails or times out.
+    """
+
+    def __init__(self, websocket: WebSocket, on_dead, queue_size: int, send_timeout: float, live_events: bool = True):
+        self.websocket = websocket
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.send_timeout = send_timeout
+        # Chats this socket receives events for
+        self.chat_ids: Set[int] = set()
+        # Whether LIVE_EVENT_TYPES are delivered to this socket
+        self.live_events = live_events
+        self._on_dead = on_dead
+        self._task = asyncio.create_task(self._writer())
+
+    def enqueue(self, message: dict) -> bool:
+        """Returns False when the client is too far behind (queue full)."""
+        try:
+            self.queue.put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    async def _writer(self):
+        try:
+            while True:
+                message = await self.queue.get()
+                await asyncio.wait_for(self.websocket.send_json(message), timeout=self.send_timeout)
+        except asyncio.CancelledError:
+            raise
+        except asyncio.TimeoutError:
+            logger.warning("WebSocket send timed out after %ss, closing it", self.send_timeout)
+            self._on_dead(self, WS_CLOSE_SLOW_CONSUMER)
+        except Exception as e:
+            # Broken pipe or closed socket
+            logger.warning("Error sending to WebSocket, closing it: %s", e)
+            self._on_dead(self, WS_CLOSE_INTERNAL_ERROR)
+
+    def close(self, code: Optional[int] = None):
+        self._task.cancel()
+        if code is not None:
+            # Closing makes the endpoint's receive loop raise WebSocketDisconnect
+            asyncio.create_task(self._close_socket(code))
+
+    async def _close_socket(self, code: int):
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
+
+class ReplayBuffer:
+    """
+    Bounded ring buffer of recent message events per chat (LRU over chats), so a client
+    reconnecting with its last seen seq can catch up from memory instead of the database.
+    Cleared when the broker may have lost events, so a buffer never looks complete over a hole.
+    """
+
+    def __init__(self, per_chat: int = 256, max_chats: int = 2000):
+        self.per_chat = per_chat
+        self.max_chats = max_chats
+        self._events: "OrderedDict[int, deque]" = OrderedDict()
+
+    def append(self, chat_id: int, event: dict):
+        events = self._events.get(chat_id)
+        if events is None:
+            events = self._events[chat_id] = deque(maxlen=self.per_chat)
+            if len(self._events) > self.max_chats:
+                self._events.popitem(last=False)
+        else:
+            self._events.move_to_end(chat_id)
+        events.append(event)
+
+    def since(self, chat_id: int, last_seq: int) -> Optional[List[dict]]:
+        """
+        Events with seq > last_seq, or None when the buffer doesn't reach back that far
+        or is missing a seq in between.
+        """
+        events = self._events.get(chat_id)
+        if not events or min(e["seq"] for e in events) > last_seq + 1:
+            return None
+        missed = {}
+        for event in events:
+            if event["seq"] > last_seq:
+                missed.setdefault(event["seq"], event)
+        ordered = [missed[seq] for seq in sorted(missed)]
+        if ordered and ordered[-1]["seq"] - last_seq != len(ordered):
+            return None
+        return ordered
+
+    def clear(self):
+        self._events.clear()
 
 class ConnectionManager:
-    def __init__(self):
-        # chat_id -> List[WebSocket]
-        self.active_connections: Dict[int, List[WebSocket]] = defaultdict(list)
+    def __init__(self, broker: Optional[Broker] = None, queue_size: int = 100, send_timeout: float = 10.0):
+        # chat_id -> {WebSocket: SocketSender} (sockets attached to THIS worker only)
+        self.active_connections: Dict[int, Dict[WebSocket, SocketSender]] = defaultdict(dict)
+        # One sender per socket, a multiplexed socket is subscribed to several chats
+        self.senders: Dict[WebSocket, SocketSender] = {}
+        # Every worker sees every event through the broker, so each one can replay any chat
+        self.replay_buffer = ReplayBuffer()
+        # Broker fans events out to every worker, each one delivers to its own sockets
+        self.broker = broker or get_broker()
+        self.queue_size = queue_size
+        self.send_timeout = send_timeout
+        # Broker events consumed by the workers themselves (presence, typing), never sent to sockets
+        self.internal_handlers: Dict[str, Callable[[int, dict], Awaitable[None]]] = {}
+        self._started = False
+        self._start_lock = asyncio.Lock()
 
-    async def connect(self, websocket: WebSocket, chat_id: int):
+    async def start(self):
+        async with self._start_lock:
+            if not self._started:
+                await self.broker.start(self._deliver, on_events_lost=self.replay_buffer.clear)
+                self._started = True
+
+    async def stop(self):
+        async with self._start_lock:
+            if self._started:
+                await self.broker.stop()
+                self._started = False
+
+    async def connect(self, websocket: WebSocket, chat_id: Optional[int] = None, live_events: bool = True):
+        """Accept the socket, optionally subscribing it to a single chat right away."""
+        await self.start()
         await websocket.accept()
-        self.active_connections[chat_id].append(websocket)
+        self.senders[websocket] = SocketSender(
+            websocket,
+            on_dead=lambda sender, code: self._evict(sender, code=code),
+            queue_size=self.queue_size,
+            send_timeout=self.send_timeout,
+            live_events=live_events,
+        )
+        if chat_id is not None:
+            self.subscribe(websocket, chat_id)
+
+    def subscribe(self, websocket: WebSocket, chat_id: int):
+        sender = self.senders.get(websocket)
+        if sender:
+            self.active_connections[chat_id][websocket] = sender
+            sender.chat_ids.add(chat_id)
 
-    def disconnect(self, websocket: WebSocket, chat_id: int):
+    def unsubscribe(self, websocket: WebSocket, chat_id: int):
+        sender = self.senders.get(websocket)
+        if sender:
+            sender.chat_ids.discard(chat_id)
         if chat_id in self.active_connections:
-            if websocket in self.active_connections[chat_id]:
-                self.active_connections[chat_id].remove(websocket)
+            self.active_connections[chat_id].pop(websocket, None)
             if not self.active_connections[chat_id]:
                 del self.active_connections[chat_id]
 
+    def disconnect(self, websocket: WebSocket, chat_id: Optional[int] = None):
+        """Drop the socket from every chat it was subscribed to (chat_id kept for older callers)."""
+        sender = self.senders.pop(websocket, None)
+        if sender:
+            for subscribed_chat_id in list(sender.chat_ids):
+                self.unsubscribe(websocket, subscribed_chat_id)
+            sender.close()
+
+    def send_personal(self, message: dict, websocket: WebSocket):
+        """Queue a message for a single local socket (acks, errors...)."""
+        sender = self.senders.get(websocket)
+        if sender and not sender.enqueue(message):
+            self._evict(sender, code=WS_CLOSE_SLOW_CONSUMER)
+
     async def broadcast(self, message: dict, chat_id: int):
+        await self.start()
+        await self.broker.publish(chat_id, message)
+
+    async def _deliver(self, chat_id: int, message: dict):
+        """Queue an event received from the broker on every local socket of the chat. Never blocks."""
+        internal_handler = self.internal_handlers.get(message.get("type"))
+        if internal_handler:
+            await internal_handler(chat_id, message)
+            return
+        self.deliver_local(chat_id, message)
+
+    def deliver_local(self, chat_id: int, message: dict):
+        """Queue an event on this worker's sockets only (events every worker derives on its own)."""
+        if message.get("seq") is not None:
+            self.replay_buffer.append(chat_id, message)
         if chat_id in self.active_connections:
-            # We iterate over a copy of the list to avoid modification issues if a disconnect happens immediately
-            # though async disconnect logic should handle it.
-            # Using simple loop for now
-            for connection in self.active_connections[chat_id]:
-                try:
-                    await connection.send_json(message)
-                except Exception as e:
-                    # In case of broken pipe etc, we might want to log or cleanup
-                    print(f"Error broadcasting to socket: {e}")
+            # Iterate over a copy, slow consumers get evicted while we loop
+            for sender in list(self.active_connections[chat_id].values()):
+                if message.get("type") in LIVE_EVENT_TYPES and not sender.live_events:
+                    continue
+                if not sender.enqueue(message):
+                    logger.warning("Evicting slow WebSocket consumer from chat %s", chat_id)
+                    self._evict(sender, code=WS_CLOSE_SLOW_CONSUMER)
+
+    def _evict(self, sender: SocketSender, code: Optional[int]):
+        if self.senders.get(sender.websocket) is sender:
+            self.disconnect(sender.websocket)
+        sender.close(code=code)
 
 manager = ConnectionManager()
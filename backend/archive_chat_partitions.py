@@ -0,0 +1,68 @@
+"""
+Chat history maintenance, run daily (cron):
+  - creates the next months' partitions of messages / message_reads
+  - exports partitions older than CHAT_ARCHIVE_KEEP_MONTHS to CHAT_ARCHIVE_DIR/<partition>.csv.gz,
+    then detaches and drops them (also finishes partitions left detached by earlier versions)
+  - purges WebSocket idempotency keys older than a day
+"""
+import asyncio
+import asyncpg
+import os
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+
+from app.db.partitions import (
+    PARTITIONED_TABLES, ensure_monthly_partitions, list_monthly_partitions, list_detached_partitions,
+    archive_partition, add_months, month_start,
+)
+
+load_dotenv()
+
+MONTHS_AHEAD = 3
+
+async def run_maintenance():
+    database_url = os.getenv("DATABASE_URL")
+    keep_months = int(os.getenv("CHAT_ARCHIVE_KEEP_MONTHS", "12"))
+    archive_dir = os.getenv("CHAT_ARCHIVE_DIR", "archive/chat")
+
+    if not database_url:
+        print("❌ DATABASE_URL not found in .env file")
+        return
+
+    print("🔄 Connecting to database...")
+
+    try:
+        conn = await asyncpg.connect(database_url)
+        print("✅ Connected successfully!")
+
+        this_month = month_start(datetime.now(timezone.utc).date())
+        cutoff = add_months(this_month, -keep_months)
+
+        for table in PARTITIONED_TABLES:
+            print(f"\n📝 {table}")
+            created = await ensure_monthly_partitions(conn, table, this_month, add_months(this_month, MONTHS_AHEAD))
+            for name in created:
+                print(f"  ✅ Created {name}")
+
+            for name, month in await list_monthly_partitions(conn, table):
+                if month >= cutoff:
+                    break
+                path = await archive_partition(conn, table, name, archive_dir)
+                print(f"  📦 Archived {name} -> {path}")
+
+            for name, _ in await list_detached_partitions(conn, table):
+                path = await archive_partition(conn, table, name, archive_dir, attached=False)
+                print(f"  📦 Archived detached {name} -> {path}")
+
+        purged = await conn.execute("DELETE FROM message_dedup_keys WHERE created_at < now() - interval '1 day';")
+        print(f"\n🧹 Idempotency keys: {purged}")
+
+        print("\n✅ Maintenance completed successfully!")
+        await conn.close()
+
+    except Exception as e:
+        print(f"\n❌ Maintenance failed: {str(e)}")
+        return
+
+if __name__ == "__main__":
+    asyncio.run(run_maintenance())
@@ -0,0 +1,57 @@
+"""
+Fill the question bank index (`questions`) and the answer keys (`assessments.answer_key`) from the assessment templates stored on Bunny.net.
+Run once after run_migration.py, safe to re-run: only assessments not indexed yet are processed
+(pass --all to re-extract every assessment).
+"""
+import asyncio
+import sys
+
+from sqlalchemy.future import select
+
+from app.crud.crud_question import question as crud_question
+from app.db.session import AsyncSessionLocal
+from app.models.assessment import Assessment
+from app.services.template_cache_service import template_cache_service
+
+# Templates downloaded at the same time / held in memory at once
+CONCURRENCY = 8
+CHUNK_SIZE = 100
+
+
+async def run_backfill(reindex_all: bool = False):
+    async with AsyncSessionLocal() as db:
+        if reindex_all:
+            result = await db.execute(select(Assessment).filter(Assessment.template_url.isnot(None)).order_by(Assessment.id))
+            assessments = result.scalars().all()
+        else:
+            assessments = [assessment for assessment, _ in await crud_question.get_unindexed(db)]
+
+        print(f"🔄 Indexing questions of {len(assessments)} assessments...")
+        semaphore = asyncio.Semaphore(CONCURRENCY)
+
+        async def download(assessment: Assessment):
+            async with semaphore:
+                return await template_cache_service.get(assessment.template_url)
+
+        indexed = failed = 0
+        for start in range(0, len(assessments), CHUNK_SIZE):
+            chunk = assessments[start:start + CHUNK_SIZE]
+            templates = await asyncio.gather(*(download(a) for a in chunk), return_exceptions=True)
+
+            for assessment, questions_data in zip(chunk, templates):
+                if isinstance(questions_data, Exception):
+                    print(f"  ❌ Assessment {assessment.id} ({assessment.title}): {questions_data}")
+                    failed += 1
+                    continue
+                count = await crud_question.index_assessment(db, assessment_id=assessment.id, questions_data=questions_data)
+                print(f"  ✅ Assessment {assessment.id}: {count} questions")
+                indexed += 1
+            # Templates aren't needed in memory anymore
+            template_cache_service.invalidate()
+
+    await template_cache_service.close()
+    print(f"\n✅ Backfill done: {indexed} assessments indexed, {failed} failed")
+
+
+if __name__ == "__main__":
+    asyncio.run(run_backfill(reindex_all="--all" in sys.argv))
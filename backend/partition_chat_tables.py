@@ -0,0 +1,137 @@
+"""
+One-off migration: convert messages and message_reads into monthly range-partitioned tables.
+Run run_migration.py first (this expects its columns, indexes and seq trigger to exist).
+Safe to re-run: tables that are already partitioned are skipped.
+"""
+import asyncio
+import asyncpg
+import os
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+
+from app.db.partitions import ensure_monthly_partitions, add_months
+
+load_dotenv()
+
+# Partitions created ahead of time, archive_chat_partitions.py keeps extending them
+MONTHS_AHEAD = 3
+
+MESSAGES_DDL = """
+CREATE TABLE messages (
+    id INTEGER NOT NULL DEFAULT nextval('messages_id_seq'),
+    chat_id INTEGER NOT NULL REFERENCES chats(id) ON DELETE CASCADE,
+    batch_id INTEGER REFERENCES batches(id),
+    sender_id UUID NOT NULL REFERENCES users(id),
+    message TEXT NOT NULL,
+    is_system_message BOOLEAN DEFAULT false,
+    client_msg_id VARCHAR,
+    seq BIGINT,
+    search_vector tsvector GENERATED ALWAYS AS (to_tsvector('english', message)) STORED,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+"""
+
+MESSAGES_COLUMNS = "id, chat_id, batch_id, sender_id, message, is_system_message, client_msg_id, seq"
+
+MESSAGES_INDEXES = [
+    "CREATE INDEX ix_messages_id ON messages (id);",
+    "CREATE INDEX ix_messages_chat_id_id ON messages (chat_id, id);",
+    "CREATE INDEX ix_messages_chat_id_seq ON messages (chat_id, seq);",
+    "CREATE INDEX ix_messages_search_vector ON messages USING GIN (search_vector);",
+    "CREATE TRIGGER messages_assign_seq BEFORE INSERT ON messages FOR EACH ROW EXECUTE FUNCTION assign_message_seq();",
+]
+
+MESSAGE_READS_DDL = """
+CREATE TABLE message_reads (
+    id INTEGER NOT NULL DEFAULT nextval('message_reads_id_seq'),
+    message_id INTEGER NOT NULL,
+    user_id UUID NOT NULL REFERENCES users(id),
+    chat_id INTEGER NOT NULL REFERENCES chats(id) ON DELETE CASCADE,
+    read_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    status messagereadstatusenum DEFAULT 'read',
+    PRIMARY KEY (id, read_at)
+) PARTITION BY RANGE (read_at);
+"""
+
+MESSAGE_READS_COLUMNS = "id, message_id, user_id, chat_id, status"
+
+MESSAGE_READS_INDEXES = [
+    "CREATE INDEX ix_message_reads_id ON message_reads (id);",
+]
+
+
+async def is_partitioned(conn, table: str) -> bool:
+    relkind = await conn.fetchval(
+        "SELECT relkind FROM pg_class WHERE relname = $1 AND relkind IN ('r', 'p')", table
+    )
+    return relkind == "p"
+
+
+async def convert(conn, table: str, key: str, ddl: str, columns: str, indexes: list):
+    if await is_partitioned(conn, table):
+        print(f"  ⏭️  {table} is already partitioned")
+        return
+
+    legacy = f"{table}_unpartitioned"
+    async with conn.transaction():
+        await conn.execute(f"ALTER TABLE {table} RENAME TO {legacy};")
+        # Free the index / trigger names for the new parent table
+        await conn.execute(f"DROP TRIGGER IF EXISTS messages_assign_seq ON {legacy};")
+        # (renaming the pkey index renames its constraint too)
+        for index in await conn.fetch("SELECT indexname FROM pg_indexes WHERE tablename = $1", legacy):
+            name = index["indexname"]
+            await conn.execute(f"ALTER INDEX {name} RENAME TO {name}_unpartitioned;")
+
+        await conn.execute(ddl)
+        # Keep the id sequence alive when the old table is dropped
+        await conn.execute(f"ALTER SEQUENCE {table}_id_seq OWNED BY {table}.id;")
+
+        oldest = await conn.fetchval(f"SELECT MIN({key}) FROM {legacy}")
+        today = datetime.now(timezone.utc).date()
+        start = oldest.date() if oldest else today
+        end = add_months(today, MONTHS_AHEAD)
+        created = await ensure_monthly_partitions(conn, table, start, end)
+        # Catches rows outside the monthly ranges (e.g. clock skew) instead of failing the insert.
+        # ensure_monthly_partitions moves a month's rows out of it when that month's partition is created.
+        await conn.execute(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT;")
+        print(f"  ✅ Created {len(created)} monthly partitions for {table}")
+
+        await conn.execute(
+            f"INSERT INTO {table} ({columns}, {key}) "
+            f"SELECT {columns}, COALESCE({key}, now()) FROM {legacy};"
+        )
+        await conn.execute(f"DROP TABLE {legacy} CASCADE;")
+
+        for statement in indexes:
+            await conn.execute(statement)
+    print(f"  ✅ {table} is now partitioned by month on {key}")
+
+
+async def run_migration():
+    database_url = os.getenv("DATABASE_URL")
+
+    if not database_url:
+        print("❌ DATABASE_URL not found in .env file")
+        return
+
+    print("🔄 Connecting to database...")
+
+    try:
+        conn = await asyncpg.connect(database_url)
+        print("✅ Connected successfully!")
+        print("\n📝 Partitioning chat tables...")
+
+        # message_reads first: its FK to messages(id) can't point at a partitioned table
+        await convert(conn, "message_reads", "read_at", MESSAGE_READS_DDL, MESSAGE_READS_COLUMNS, MESSAGE_READS_INDEXES)
+        await convert(conn, "messages", "created_at", MESSAGES_DDL, MESSAGES_COLUMNS, MESSAGES_INDEXES)
+
+        print("\n✅ Migration completed successfully!")
+        await conn.close()
+
+    except Exception as e:
+        print(f"\n❌ Migration failed: {str(e)}")
+        return
+
+if __name__ == "__main__":
+    asyncio.run(run_migration())
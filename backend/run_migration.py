@@ -32,7 +32,170 @@ async def run_migration():
             "ALTER TABLE assessments ADD COLUMN IF NOT EXISTS shuffle_questions INTEGER DEFAULT 0;",
             "ALTER TABLE assessments ADD COLUMN IF NOT EXISTS show_results_immediately INTEGER DEFAULT 1;",
             "ALTER TABLE assessments ADD COLUMN IF NOT EXISTS assigned_to TEXT DEFAULT 'entire_batch';",
-            "ALTER TABLE assessment_submissions ADD COLUMN IF NOT EXISTS response_data TEXT;"
+            "ALTER TABLE assessment_submissions ADD COLUMN IF NOT EXISTS response_data TEXT;",
+            "CREATE INDEX IF NOT EXISTS ix_messages_chat_id_id ON messages (chat_id, id);",
+            "ALTER TABLE chat_members ADD COLUMN IF NOT EXISTS last_read_message_id INTEGER;",
+            # Fold per-message read receipts into the member watermarks, then drop the covered rows
+            """UPDATE chat_members cm SET last_read_message_id = GREATEST(COALESCE(cm.last_read_message_id, 0), r.max_read)
+               FROM (SELECT chat_id, user_id, MAX(message_id) AS max_read FROM message_reads
+                     WHERE status = 'read' GROUP BY chat_id, user_id) r
+               WHERE cm.chat_id = r.chat_id AND cm.user_id = r.user_id;""",
+            """DELETE FROM message_reads mr USING chat_members cm
+               WHERE mr.chat_id = cm.chat_id AND mr.user_id = cm.user_id
+               AND mr.message_id <= cm.last_read_message_id;""",
+            "ALTER TABLE messages ADD COLUMN IF NOT EXISTS client_msg_id VARCHAR;",
+            # Idempotency keys live in their own table (messages is partitioned, see partition_chat_tables.py)
+            """CREATE TABLE IF NOT EXISTS message_dedup_keys (
+                   sender_id UUID NOT NULL,
+                   client_msg_id VARCHAR NOT NULL,
+                   created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                   PRIMARY KEY (sender_id, client_msg_id)
+               );""",
+            "DROP INDEX IF EXISTS ux_messages_sender_id_client_msg_id;",
+            # Per-chat message sequence numbers: backfill, then let a trigger hand them out
+            "ALTER TABLE chats ADD COLUMN IF NOT EXISTS last_seq BIGINT NOT NULL DEFAULT 0;",
+            "ALTER TABLE messages ADD COLUMN IF NOT EXISTS seq BIGINT;",
+            """UPDATE messages m SET seq = s.rn
+               FROM (SELECT id, ROW_NUMBER() OVER (PARTITION BY chat_id ORDER BY id) AS rn
+                     FROM messages WHERE seq IS NULL) s
+               WHERE m.id = s.id AND NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'messages_assign_seq');""",
+            "UPDATE chats c SET last_seq = COALESCE((SELECT MAX(seq) FROM messages WHERE chat_id = c.id), 0);",
+            "ALTER TABLE chats ADD COLUMN IF NOT EXISTS last_message_at TIMESTAMPTZ;",
+            # Under the chat row lock, so a chat's ids, seqs and created_at all increase together:
+            # a cursor message's own created_at bounds its neighbours' (partition pruning in CRUDMessage)
+            """CREATE OR REPLACE FUNCTION assign_message_seq() RETURNS trigger AS $$
+               BEGIN
+                   UPDATE chats SET last_seq = last_seq + 1, last_message_at = GREATEST(last_message_at, NEW.created_at)
+                   WHERE id = NEW.chat_id RETURNING last_seq, last_message_at INTO NEW.seq, NEW.created_at;
+                   NEW.id := nextval('messages_id_seq');
+                   RETURN NEW;
+               END
+               $$ LANGUAGE plpgsql;""",
+            # Messages from before the trigger did that: raise created_at to the running max in id order
+            """UPDATE messages m SET created_at = f.fixed
+               FROM (SELECT id, created_at, MAX(created_at) OVER (PARTITION BY chat_id ORDER BY id) AS fixed
+                     FROM messages) f
+               WHERE m.id = f.id AND m.created_at = f.created_at AND f.fixed > f.created_at;""",
+            "UPDATE chats c SET last_message_at = (SELECT MAX(created_at) FROM messages WHERE chat_id = c.id) WHERE last_message_at IS NULL;",
+            "DROP TRIGGER IF EXISTS messages_assign_seq ON messages;",
+            "CREATE TRIGGER messages_assign_seq BEFORE INSERT ON messages FOR EACH ROW EXECUTE FUNCTION assign_message_seq();",
+            "CREATE INDEX IF NOT EXISTS ix_messages_chat_id_seq ON messages (chat_id, seq);",
+            "ALTER TABLE messages ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (to_tsvector('english', message)) STORED;",
+            "CREATE INDEX IF NOT EXISTS ix_messages_search_vector ON messages USING GIN (search_vector);",
+            # Resource catalog: listings come from chat_resources, kept in sync with storage by the reconciler
+            "ALTER TABLE chat_resources ADD COLUMN IF NOT EXISTS storage_path VARCHAR;",
+            "ALTER TABLE chat_resources ADD COLUMN IF NOT EXISTS file_size BIGINT;",
+            "ALTER TABLE chat_resources ADD COLUMN IF NOT EXISTS storage_guid VARCHAR;",
+            "ALTER TABLE chat_resources ADD COLUMN IF NOT EXISTS deleted_at TIMESTAMPTZ;",
+            # Object path from the public URL (re-uploads overwrite, so only the latest row per path gets it)
+            """UPDATE chat_resources cr SET storage_path = regexp_replace(cr.file_url, '^https?://[^/]+/', '')
+               WHERE cr.storage_path IS NULL AND cr.id IN (
+                   SELECT MAX(id) FROM chat_resources GROUP BY regexp_replace(file_url, '^https?://[^/]+/', '')
+               ) AND NOT EXISTS (
+                   SELECT 1 FROM chat_resources o
+                   WHERE o.storage_path = regexp_replace(cr.file_url, '^https?://[^/]+/', '')
+               );""",
+            "CREATE UNIQUE INDEX IF NOT EXISTS ux_chat_resources_storage_path ON chat_resources (storage_path);",
+            "CREATE INDEX IF NOT EXISTS ix_chat_resources_chat_id_created_at ON chat_resources (chat_id, created_at);",
+            # Question bank index: one row per template question (filled by backfill_question_index.py)
+            "ALTER TABLE assessments ADD COLUMN IF NOT EXISTS questions_indexed_at TIMESTAMPTZ;",
+            """CREATE TABLE IF NOT EXISTS questions (
+                   id SERIAL PRIMARY KEY,
+                   assessment_id INTEGER NOT NULL REFERENCES assessments(id) ON DELETE CASCADE,
+                   position INTEGER NOT NULL,
+                   question_key VARCHAR,
+                   text TEXT,
+                   type VARCHAR,
+                   difficulty VARCHAR,
+                   category VARCHAR,
+                   points DOUBLE PRECISION,
+                   data JSONB NOT NULL
+               );""",
+            "CREATE INDEX IF NOT EXISTS ix_questions_id ON questions (id);",
+            "CREATE UNIQUE INDEX IF NOT EXISTS ux_questions_assessment_id_position ON questions (assessment_id, position);",
+            "CREATE INDEX IF NOT EXISTS ix_questions_assessment_id_question_key ON questions (assessment_id, question_key);",
+            "CREATE INDEX IF NOT EXISTS ix_questions_lower_difficulty ON questions (lower(difficulty));",
+            "CREATE INDEX IF NOT EXISTS ix_questions_type ON questions (type);",
+            "CREATE INDEX IF NOT EXISTS ix_questions_lower_category ON questions (lower(category));",
+            "CREATE EXTENSION IF NOT EXISTS pg_trgm;",
+            "CREATE INDEX IF NOT EXISTS ix_questions_text_trgm ON questions USING GIN (text gin_trgm_ops);",
+            "ALTER TABLE assessments ADD COLUMN IF NOT EXISTS answer_key JSONB;",
+            # Assessments indexed before answer keys existed: let backfill_question_index.py compile theirs
+            "UPDATE assessments SET questions_indexed_at = NULL WHERE answer_key IS NULL AND questions_indexed_at IS NOT NULL;",
+            # Assignments: Assessment.assigned_to normalized into one row per batch / student
+            """CREATE TABLE IF NOT EXISTS assessment_assignments (
+                   id SERIAL PRIMARY KEY,
+                   assessment_id INTEGER NOT NULL REFERENCES assessments(id) ON DELETE CASCADE,
+                   batch_id INTEGER REFERENCES batches(id) ON DELETE CASCADE,
+                   student_id UUID REFERENCES users(id) ON DELETE CASCADE,
+                   CONSTRAINT ck_assessment_assignments_target CHECK ((batch_id IS NULL) <> (student_id IS NULL))
+               );""",
+            "CREATE INDEX IF NOT EXISTS ix_assessment_assignments_id ON assessment_assignments (id);",
+            "CREATE UNIQUE INDEX IF NOT EXISTS ux_assessment_assignments_assessment_id_batch_id ON assessment_assignments (assessment_id, batch_id);",
+            "CREATE UNIQUE INDEX IF NOT EXISTS ux_assessment_assignments_assessment_id_student_id ON assessment_assignments (assessment_id, student_id);",
+            "CREATE INDEX IF NOT EXISTS ix_assessment_assignments_batch_id ON assessment_assignments (batch_id);",
+            "CREATE INDEX IF NOT EXISTS ix_assessment_assignments_student_id ON assessment_assignments (student_id);",
+            "CREATE INDEX IF NOT EXISTS ix_batch_members_user_id_batch_id ON batch_members (user_id, batch_id);",
+            """INSERT INTO assessment_assignments (assessment_id, batch_id)
+               SELECT id, batch_id FROM assessments WHERE assigned_to IS NULL OR assigned_to = 'entire_batch'
+               ON CONFLICT DO NOTHING;""",
+            # JSON arrays of student ids, unreadable ones are skipped (the old code ignored them too)
+            """DO $$
+               DECLARE a RECORD;
+               BEGIN
+                   FOR a IN SELECT id, assigned_to FROM assessments WHERE assigned_to LIKE '[%' LOOP
+                       BEGIN
+                           INSERT INTO assessment_assignments (assessment_id, student_id)
+                           SELECT a.id, u.id FROM jsonb_array_elements_text(a.assigned_to::jsonb) AS s(value)
+                           JOIN users u ON u.id = CASE WHEN s.value ~* '^[0-9a-f-]{36}$' THEN s.value::uuid END
+                           ON CONFLICT DO NOTHING;
+                       EXCEPTION WHEN others THEN
+                           RAISE NOTICE 'Assessment %: unreadable assigned_to', a.id;
+                       END;
+                   END LOOP;
+               END
+               $$;""",
+            # Submission queue: submissions accepted immediately, graded by background workers
+            """DO $$ BEGIN
+                   CREATE TYPE submissionstatus AS ENUM ('queued', 'processing', 'graded', 'failed');
+               EXCEPTION WHEN duplicate_object THEN NULL;
+               END $$;""",
+            """CREATE TABLE IF NOT EXISTS submission_queue (
+                   id SERIAL PRIMARY KEY,
+                   assessment_id INTEGER NOT NULL REFERENCES assessments(id) ON DELETE CASCADE,
+                   student_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+                   idempotency_key VARCHAR NOT NULL,
+                   answers TEXT NOT NULL,
+                   status submissionstatus NOT NULL DEFAULT 'queued',
+                   attempts INTEGER NOT NULL DEFAULT 0,
+                   error TEXT,
+                   submission_id INTEGER REFERENCES assessment_submissions(id) ON DELETE SET NULL,
+                   marks_obtained INTEGER,
+                   created_at TIMESTAMPTZ DEFAULT now(),
+                   claimed_at TIMESTAMPTZ,
+                   graded_at TIMESTAMPTZ
+               );""",
+            "CREATE INDEX IF NOT EXISTS ix_submission_queue_id ON submission_queue (id);",
+            "CREATE UNIQUE INDEX IF NOT EXISTS ux_submission_queue_assessment_id_student_id ON submission_queue (assessment_id, student_id);",
+            "CREATE UNIQUE INDEX IF NOT EXISTS ux_submission_queue_student_id_idempotency_key ON submission_queue (student_id, idempotency_key);",
+            "CREATE INDEX IF NOT EXISTS ix_submission_queue_submission_id ON submission_queue (submission_id);",
+            "CREATE INDEX IF NOT EXISTS ix_submission_queue_pending ON submission_queue (id) WHERE status IN ('queued', 'processing');",
+            # Existing submissions count as graded receipts (latest one per student), so nobody can submit twice
+            """INSERT INTO submission_queue
+                   (assessment_id, student_id, idempotency_key, answers, status, submission_id, marks_obtained, created_at, graded_at)
+               SELECT DISTINCT ON (assessment_id, student_id)
+                   assessment_id, student_id, 'legacy-' || id, COALESCE(response_data, '{}'), 'graded', id, marks_obtained,
+                   submitted_at, submitted_at
+               FROM assessment_submissions
+               ORDER BY assessment_id, student_id, id DESC
+               ON CONFLICT DO NOTHING;""",
+            # Chat events too big for a NOTIFY payload, read back by id (see PostgresBroker)
+            """CREATE UNLOGGED TABLE IF NOT EXISTS chat_event_payloads (
+                   id BIGSERIAL PRIMARY KEY,
+                   payload TEXT NOT NULL,
+                   created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+               );""",
+            "CREATE INDEX IF NOT EXISTS ix_chat_event_payloads_created_at ON chat_event_payloads (created_at);",
         ]
         
         for migration in migrations:
@@ -48,6 +211,33 @@ async def run_migration():
         print("  - assessments.show_results_immediately")
         print("  - assessments.assigned_to")
         print("  - assessment_submissions.response_data")
+        print("  - chat_members.last_read_message_id (message_reads compacted into it)")
+        print("  - messages.client_msg_id")
+        print("  - messages.seq / chats.last_seq (+ messages_assign_seq trigger)")
+        print("  - chats.last_message_at (messages_assign_seq keeps created_at in id order)")
+        print("  - messages.search_vector (generated tsvector)")
+        print("  - chat_resources.storage_path / file_size / storage_guid / deleted_at")
+        print("  - assessments.questions_indexed_at")
+        print("  - assessments.answer_key (compiled by backfill_question_index.py / on first submission)")
+        print("\nNew indexes added:")
+        print("  - ix_messages_chat_id_id")
+        print("  - ix_messages_chat_id_seq")
+        print("  - ix_messages_search_vector (GIN)")
+        print("  - ux_chat_resources_storage_path")
+        print("  - ix_chat_resources_chat_id_created_at")
+        print("  - questions: ux_questions_assessment_id_position, ix_questions_lower_difficulty,")
+        print("    ix_questions_type, ix_questions_lower_category, ix_questions_text_trgm (GIN, pg_trgm)")
+        print("  - assessment_assignments: ux_..._assessment_id_batch_id, ux_..._assessment_id_student_id,")
+        print("    ix_assessment_assignments_batch_id, ix_assessment_assignments_student_id")
+        print("  - ix_batch_members_user_id_batch_id")
+        print("  - submission_queue: ux_..._assessment_id_student_id, ux_..._student_id_idempotency_key,")
+        print("    ix_submission_queue_submission_id, ix_submission_queue_pending (partial)")
+        print("\nNew tables added:")
+        print("  - message_dedup_keys")
+        print("  - questions (run backfill_question_index.py to fill it)")
+        print("  - assessment_assignments (backfilled from assessments.assigned_to)")
+        print("  - submission_queue (backfilled from assessment_submissions)")
+        print("  - chat_event_payloads (unlogged, oversized chat broker events)")
         
         await conn.close()
         
@@ -151,7 +151,7 @@ export default function AssessmentAttempt() {
             const result = await assessmentsService.submitAssessment(assignmentId, answers);
 
             // Show results if enabled
-            if (result.show_results) {
+            if (result.show_results && result.status === 'graded') {
                 alert(`Assessment submitted successfully!\n\nYour Score: ${result.marks_obtained}/${assessment.total_marks}\nPercentage: ${((result.marks_obtained / assessment.total_marks) * 100).toFixed(2)}%\n${result.marks_obtained >= (assessment.passing_score / 100) * assessment.total_marks ? 'Status: PASSED ✓' : 'Status: FAILED ✗'}`);
             } else {
                 alert('Assessment submitted successfully! Results will be available later.');